@@ -12,7 +12,7 @@ from .exceptions import BaseASTMError, NotAccepted, InvalidState
 from .codec import (
     decode, decode_message, decode_record,
     encode, encode_message, encode_record,
-    make_checksum
+    make_checksum, StreamDecoder
 )
 from .mapping import Record, Component
 from .records import (
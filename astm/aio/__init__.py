@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+"""ASTM protocol on top of :mod:`asyncio` event loop, so the server and
+client could share it with other asyncio based services. Requires
+Python 3.5+.
+"""
+
+from .protocol import ASTMProtocol
+from .server import AsyncRecordsDispatcher, RequestHandler, start_server
+from .client import Client, start_client
+
+__all__ = ['ASTMProtocol', 'AsyncRecordsDispatcher', 'RequestHandler',
+           'start_server', 'Client', 'start_client']
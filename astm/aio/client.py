@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import asyncio
+import logging
+from ..client import DEFAULT_RECORDS_FLOW_MAP, ClientMixIn
+from ..constants import EOT
+from .protocol import ASTMProtocol
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Client', 'start_client']
+
+
+class Client(ClientMixIn, ASTMProtocol):
+    """ASTM client for :mod:`asyncio` transport. Session starts once
+    connection is made, arguments have the same meaning as for
+    :class:`astm.client.Client`.
+    """
+
+    def __init__(self, emitter, encoding=None, timeout=20,
+                 flow_map=DEFAULT_RECORDS_FLOW_MAP, chunk_size=None,
+                 bulk_mode=False):
+        super(Client, self).__init__(timeout=timeout)
+        self.emitter = self.emitter_wrapper(
+            emitter,
+            encoding=encoding or self.encoding,
+            flow_map=flow_map,
+            chunk_size=chunk_size,
+            bulk_mode=bulk_mode
+        )
+
+    def connection_made(self, transport):
+        """Initiates ASTM communication session."""
+        super(Client, self).connection_made(transport)
+        self._open_session()
+
+    def connection_lost(self, exc):
+        self.emitter.close()
+        super(Client, self).connection_lost(exc)
+
+    def _close_session(self, close_connection=False):
+        self.push(EOT)
+        if close_connection:
+            self.close()
+
+
+async def start_client(emitter, host='localhost', port=15200, client=None,
+                       **kwargs):
+    """Connects to ASTM server on the current event loop and starts sending
+    records produced by `emitter`::
+
+        client = await start_client(emitter, port=15200)
+        await client.wait_closed()
+
+    :param client: Custom :class:`Client` subclass.
+
+    Other keyword arguments are passed to the `client`.
+
+    :returns: `client` instance.
+    """
+    client = client or Client
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_connection(
+        lambda: client(emitter, **kwargs), host, port)
+    return protocol
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import asyncio
+import inspect
+import logging
+from ..constants import STX, ENQ, ACK, NAK, EOT, CRLF, ENCODING
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ASTMProtocol']
+
+
+class ASTMProtocol(asyncio.Protocol):
+    """Common ASTM protocol routines on top of :mod:`asyncio` transport.
+
+    Received data is split into control characters and messages which are
+    passed to :meth:`on_enq`, :meth:`on_ack`, :meth:`on_nak`, :meth:`on_eot`
+    and :meth:`on_message` handlers in the same way as
+    :class:`astm.protocol.ASTMProtocol` does. Value returned by handler is
+    sent back. If handler returns awaitable, reading is paused until it's
+    done and then its result is sent back, so the data is handled in order
+    it was received.
+
+    :param timeout: Number of seconds of inactivity before :meth:`on_timeout`
+                    call. If :const:`None` timeout is disabled.
+    :type timeout: int
+    """
+
+    encoding = ENCODING
+    #: Size of transport write buffer above which :meth:`pause_writing` is
+    #: called and reading is paused.
+    outbox_high_watermark = 65536
+    #: Size of transport write buffer below which :meth:`resume_writing` is
+    #: called and reading is resumed.
+    outbox_low_watermark = 16384
+    _last_recv_data = None
+    _last_sent_data = None
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        #: :class:`asyncio.Transport` of the connection.
+        self.transport = None
+        self._loop = None
+        self._buffer = bytearray()
+        self._pending = None
+        self._closed = None
+        self._timer = None
+        self._last_activity = None
+        #: Transport write buffer is above high watermark.
+        self.writing_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._loop = asyncio.get_event_loop()
+        self._closed = self._loop.create_future()
+        self._last_activity = self._loop.time()
+        transport.set_write_buffer_limits(self.outbox_high_watermark,
+                                          self.outbox_low_watermark)
+        if self.timeout is not None:
+            self._timer = self._loop.call_later(self.timeout,
+                                                self._check_timeout)
+
+    def connection_lost(self, exc):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending is not None:
+            self._pending.cancel()
+        self.transport = None
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def data_received(self, data):
+        self._last_activity = self._loop.time()
+        self._buffer.extend(data)
+        self._process()
+
+    def _process(self):
+        buf = self._buffer
+        while buf and self._pending is None and self._is_open():
+            if buf.startswith(STX):  # this looks like a message
+                end = buf.find(CRLF)
+                if end == -1:
+                    break
+                end += len(CRLF)
+            else:
+                end = 1
+            data = bytes(buf[:end])
+            del buf[:end]
+            self.dispatch(data)
+
+    def dispatch(self, data):
+        """Dispatcher of received data."""
+        self._last_recv_data = data
+        if data == ENQ:
+            handler = self.on_enq
+        elif data == ACK:
+            handler = self.on_ack
+        elif data == NAK:
+            handler = self.on_nak
+        elif data == EOT:
+            handler = self.on_eot
+        elif data.startswith(STX): # this looks like a message
+            handler = self.on_message
+        else:
+            handler = lambda: self.default_handler(data)
+
+        try:
+            resp = handler()
+        except Exception:
+            self.handle_error()
+            return
+
+        if inspect.isawaitable(resp):
+            self._pending = asyncio.ensure_future(resp)
+            self._pending.add_done_callback(self._on_handled)
+            self.transport.pause_reading()
+        elif resp is not None:
+            self.push(resp)
+
+    def _on_handled(self, future):
+        self._pending = None
+        if self.transport is None or future.cancelled():
+            return
+        try:
+            resp = future.result()
+        except Exception:
+            self.handle_error()
+            return
+        if resp is not None:
+            self.push(resp)
+        if self._is_open() and not self.writing_paused:
+            self.transport.resume_reading()
+            self._process()
+
+    def pause_writing(self):
+        """Called by transport when its write buffer goes above
+        :attr:`outbox_high_watermark`. Pauses reading till
+        :meth:`resume_writing` call."""
+        self.writing_paused = True
+        if self._is_open():
+            self.transport.pause_reading()
+
+    def resume_writing(self):
+        """Called by transport when its write buffer goes below
+        :attr:`outbox_low_watermark`."""
+        self.writing_paused = False
+        if self._is_open() and self._pending is None:
+            self.transport.resume_reading()
+            self._process()
+
+    def _is_open(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    def default_handler(self, data):
+        raise ValueError('Unable to dispatch data: %r', data)
+
+    def handle_error(self):
+        """Logs error of received data handling and closes connection."""
+        log.exception('Error occurred on data handling.')
+        self.close()
+
+    def push(self, data):
+        """Sends `data` to the remote side."""
+        self._last_sent_data = data
+        self._last_activity = self._loop.time()
+        self.transport.write(data)
+
+    def close(self):
+        """Closes connection once outgoing data is sent."""
+        if self.transport is not None:
+            self.transport.close()
+
+    def discard_input_buffers(self):
+        del self._buffer[:]
+
+    def wait_closed(self):
+        """Returns future that is done when connection is closed."""
+        return self._closed
+
+    def _check_timeout(self):
+        # timer is rearmed only when it fires, so sending and receiving data
+        # just updates the last activity time
+        self._timer = None
+        idle = self._loop.time() - self._last_activity
+        if idle < self.timeout:
+            self._timer = self._loop.call_later(self.timeout - idle,
+                                                self._check_timeout)
+        else:
+            self.on_timeout()
+
+    def on_enq(self):
+        """Calls on <ENQ> message receiving."""
+
+    def on_ack(self):
+        """Calls on <ACK> message receiving."""
+
+    def on_nak(self):
+        """Calls on <NAK> message receiving."""
+
+    def on_eot(self):
+        """Calls on <EOT> message receiving."""
+
+    def on_message(self):
+        """Calls on ASTM message receiving."""
+
+    def on_timeout(self):
+        """Calls when timeout event occurs. Used to limit waiting time for
+        response data."""
+        log.warning('Communication timeout')
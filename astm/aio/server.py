@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import asyncio
+import inspect
+import logging
+from ..codec import get_codec
+from ..constants import ACK, ENQ, EOT, NAK
+from ..exceptions import InvalidState, NotAccepted
+from ..server import BaseRecordsDispatcher, collect_message
+from .protocol import ASTMProtocol
+
+log = logging.getLogger(__name__)
+
+__all__ = ['AsyncRecordsDispatcher', 'RequestHandler', 'start_server']
+
+
+class AsyncRecordsDispatcher(BaseRecordsDispatcher):
+    """Records dispatcher which handlers may be coroutines::
+
+        class Dispatcher(AsyncRecordsDispatcher):
+
+            async def on_result(self, record):
+                await db.execute(...)
+
+    Message is acknowledged only after all its records are handled. Plain
+    functions are supported as handlers as well.
+    """
+
+    async def __call__(self, message):
+        seq, records, cs = self.codec.decode_message(message, self.encoding,
+                                                     self.lazy,
+                                                     self.intern_cache,
+                                                     self.projection)
+        for record in records:
+            result = self.dispatch.get(record[0],
+                                       self.on_unknown)(self.wrap(record))
+            if inspect.isawaitable(result):
+                await result
+
+
+class RequestHandler(ASTMProtocol):
+    """ASTM protocol request handler for :mod:`asyncio` server.
+
+    :param dispatcher: Records dispatcher instance. Both
+                       :class:`AsyncRecordsDispatcher` and
+                       :class:`~astm.server.BaseRecordsDispatcher` are
+                       supported.
+
+    :param timeout: Number of seconds to wait for incoming data before
+                    connection closing.
+    :type timeout: int
+
+    :param sink: Object with ``write(data)`` method to store received
+                 sessions, see :class:`astm.server.RequestHandler`. It's
+                 flushed after every session.
+    """
+
+    #: :class:`~astm.codec.Codec` for the delimiters defined by the Header
+    #: record of the current session.
+    codec = get_codec()
+
+    def __init__(self, dispatcher, timeout=None, sink=None):
+        super(RequestHandler, self).__init__(timeout=timeout)
+        self.dispatcher = dispatcher
+        self.sink = sink
+        self.client_info = {'host': None, 'port': None}
+        self._session = []
+        self._chunks = []
+        self._is_transfer_state = False
+
+    def connection_made(self, transport):
+        super(RequestHandler, self).connection_made(transport)
+        peername = transport.get_extra_info('peername')
+        if peername is not None:
+            self.client_info = {'host': peername[0], 'port': peername[1]}
+
+    def connection_lost(self, exc):
+        if self.sink is not None and len(self._session) > 1:
+            log.warning('Session of %s:%s is cut off before EOT, %d accepted'
+                        ' messages are not stored', self.client_info['host'],
+                        self.client_info['port'], len(self._session) - 1)
+        self._session = []
+        super(RequestHandler, self).connection_lost(exc)
+
+    def on_enq(self):
+        if not self._is_transfer_state:
+            self._is_transfer_state = True
+            self._session = [ENQ]
+            return ACK
+        else:
+            log.error('ENQ is not expected')
+            return NAK
+
+    def on_ack(self):
+        raise NotAccepted('Server should not be ACKed.')
+
+    def on_nak(self):
+        raise NotAccepted('Server should not be NAKed.')
+
+    def on_eot(self):
+        if self._is_transfer_state:
+            self._is_transfer_state = False
+            if self.sink is not None:
+                self._session.append(EOT)
+                self.sink.write(b''.join(self._session))
+                if hasattr(self.sink, 'flush'):
+                    self.sink.flush()
+            self._session = []
+        else:
+            raise InvalidState('Server is not ready to accept EOT message.')
+
+    def on_message(self):
+        if not self._is_transfer_state:
+            self.discard_input_buffers()
+            return NAK
+        return self._accept_message(self._last_recv_data)
+
+    async def _accept_message(self, message):
+        try:
+            await self.handle_message(message)
+        except NotAccepted as err:
+            log.error('Message is not accepted: %s', err)
+            return NAK
+        except Exception:
+            log.exception('Error occurred on message handling.')
+            return NAK
+        if self.sink is not None:
+            self._session.append(message)
+        return ACK
+
+    async def handle_message(self, message):
+        message = collect_message(self, message)
+        if message is None:
+            return
+        result = self.dispatcher(message)
+        if inspect.isawaitable(result):
+            await result
+
+    def discard_input_buffers(self):
+        self._chunks = []
+        return super(RequestHandler, self).discard_input_buffers()
+
+    def on_timeout(self):
+        """Closes connection on timeout."""
+        super(RequestHandler, self).on_timeout()
+        self.close()
+
+
+async def start_server(host='localhost', port=15200, request=None,
+                       dispatcher=None, timeout=None, encoding=None,
+                       sink=None, **kwargs):
+    """Starts ASTM server on the current event loop. Arguments have the same
+    meaning as for :class:`astm.server.Server`, others are passed to
+    :meth:`asyncio.AbstractEventLoop.create_server`::
+
+        server = await start_server(dispatcher=Dispatcher, port=15200)
+        async with server:
+            await server.serve_forever()
+
+    :returns: :class:`asyncio.Server` instance.
+    """
+    request = request or RequestHandler
+    dispatcher = dispatcher or AsyncRecordsDispatcher
+
+    def factory():
+        return request(dispatcher(encoding), timeout=timeout, sink=sink)
+
+    loop = asyncio.get_event_loop()
+    return await loop.create_server(factory, host, port, **kwargs)
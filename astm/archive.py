@@ -0,0 +1,668 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+"""Random access to the raw ASTM traffic captures.
+
+Capture is a file with concatenated ASTM byte stream as it was sent over the
+wire: ENQ, frames, EOT, etc. :class:`CaptureReader` memory-maps the file and
+builds an index of frames and sessions which is stored in a sidecar file near
+the capture to be reused next time::
+
+    with CaptureReader('lis.capture') as reader:
+        for frame in reader.session(42):
+            seq, records, cs = decode_message(frame, 'latin-1')
+
+Frames are returned as :class:`memoryview` slices of the mapped file, so the
+data is not copied until it's decoded.
+
+For long-term storage traffic could be written to the block-compressed
+archive by :class:`BlockArchiveWriter` and read by :class:`BlockArchiveReader`
+with the same interface.
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from .codec import find_frame_end, join
+from .constants import STX, ETB, ENQ, EOT
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+__all__ = ['FrameIndex', 'BaseArchiveReader', 'CaptureReader',
+           'BlockArchiveWriter', 'BlockArchiveReader']
+
+try:
+    array('Q')
+except ValueError:  # pragma: no cover
+    _OFFSET_TYPECODE = 'L'
+else:
+    _OFFSET_TYPECODE = 'Q'
+
+_SCAN_RE = re.compile(b'[' + STX + ENQ + EOT + b']')
+
+_INDEX_MAGIC = b'ASTMIDX1'
+#: magic, byteorder, session is open, pending chunks record type, data size,
+#: data mtime, scanned position, number of frames and number of sessions.
+_INDEX_HEADER = struct.Struct('<8sc?c5xQdQQQ')
+_BYTEORDER = sys.byteorder[:1].encode('ascii')
+
+_ARCHIVE_MAGIC = b'ASTMBLK1'
+#: magic and compression method code.
+_ARCHIVE_HEADER = struct.Struct('<8sc')
+#: stream offset of the block data, its size, compressed size and CRC32.
+_BLOCK_HEADER = struct.Struct('<QIII')
+_COMPRESSIONS = {'zlib': b'z', 'lzma': b'x'}
+# mmap supports memoryview only since Python 3, before frames are copied
+_MMAP_VIEWS = sys.version_info[0] >= 3
+
+
+class FrameIndex(object):
+    """Index of frames and sessions of ASTM byte stream.
+
+    Frames are stored by their offset in the stream, length (from STX to
+    trailing CRLF, both inclusive), session number and type of the first
+    record. For chunked messages all the chunks have type of the message
+    first record. Session starts with ENQ and ends after EOT. Frames that
+    are out of any session starts new one.
+    """
+
+    def __init__(self):
+        #: Frame offsets.
+        self.offsets = array(_OFFSET_TYPECODE)
+        #: Frame lengths.
+        self.lengths = array('L')
+        #: Session number of each frame.
+        self.sessions = array('L')
+        #: Record type of each frame.
+        self.rtypes = bytearray()
+        #: Session start offsets.
+        self.session_starts = array(_OFFSET_TYPECODE)
+        #: Session end offsets.
+        self.session_ends = array(_OFFSET_TYPECODE)
+        #: Position in stream to continue scanning from.
+        self.position = 0
+        self._session_open = False
+        self._chunk_rtype = b''
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def sessions_count(self):
+        """Number of sessions."""
+        return len(self.session_starts)
+
+    @property
+    def closed_sessions_count(self):
+        """Number of sessions that are ended by EOT or by the next session
+        start."""
+        return len(self.session_starts) - self._session_open
+
+    def start_session(self, offset):
+        """Starts new session at `offset`. Previous session is closed if it
+        wasn't."""
+        if self._session_open:
+            self.end_session(offset)
+        self.session_starts.append(offset)
+        self.session_ends.append(offset)
+        self._session_open = True
+
+    def end_session(self, offset):
+        """Ends current session at `offset`."""
+        if self._session_open:
+            self.session_ends[-1] = offset
+            self._session_open = False
+
+    def add_frame(self, offset, length, rtype):
+        """Adds frame to the current session."""
+        if not self._session_open:
+            self.start_session(offset)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.sessions.append(len(self.session_starts) - 1)
+        self.rtypes.extend(rtype or b'\0')
+        self.session_ends[-1] = offset + length
+
+    def frame_type(self, idx):
+        """Returns record type of frame by index."""
+        return bytes(self.rtypes[idx:idx + 1])
+
+    def session_frames(self, num):
+        """Returns range of indexes of frames that belongs to the session."""
+        if not 0 <= num < len(self.session_starts):
+            raise IndexError('session index out of range')
+        return range(bisect_left(self.sessions, num),
+                     bisect_right(self.sessions, num))
+
+    def scan(self, data, end=None, base=0):
+        """Indexes `data` stream from the last scanned position. Incomplete
+        frame at the end of data is left to be indexed by next scan.
+
+        :param data: ASTM byte stream.
+        :type data: bytes or :class:`mmap.mmap`
+
+        :param end: Position in `data` to scan it till.
+        :type end: int
+
+        :param base: Stream offset of the `data` start, if it's only part of
+                     the stream. It should not be greater than position
+                     scanned last time.
+        :type base: int
+        """
+        if end is None:
+            end = len(data)
+        pos = self.position - base
+        while pos < end:
+            match = _SCAN_RE.search(data, pos, end)
+            if match is None:
+                pos = end
+                break
+            start = match.start()
+            char = match.group()
+            if char == ENQ:
+                self.start_session(base + start)
+                self._chunk_rtype = b''
+                pos = start + 1
+            elif char == EOT:
+                self.end_session(base + start + 1)
+                self._chunk_rtype = b''
+                pos = start + 1
+            else:
+                frame = find_frame_end(data, start, end)
+                if frame is None or frame[0] > end:
+                    pos = start
+                    break
+                stop, last = frame
+                rtype = self._chunk_rtype or bytes(data[start + 2:start + 3])
+                self.add_frame(base + start, stop - start, rtype)
+                if last:
+                    self._chunk_rtype = b''
+                else:
+                    self._chunk_rtype = rtype
+                pos = stop
+        self.position = base + pos
+
+    def save(self, path, size, mtime):
+        """Saves index to the file.
+
+        :param path: Index file path.
+        :type path: str
+
+        :param size: Size of indexed data.
+        :type size: int
+
+        :param mtime: Modification time of indexed data.
+        :type mtime: float
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fobj:
+            fobj.write(_INDEX_HEADER.pack(
+                _INDEX_MAGIC, _BYTEORDER, self._session_open,
+                self._chunk_rtype or b'\0', size, mtime, self.position,
+                len(self.offsets), len(self.session_starts)))
+            for items in (self.offsets, self.lengths, self.sessions,
+                          self.session_starts, self.session_ends):
+                items.tofile(fobj)
+            fobj.write(self.rtypes)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, size, mtime):
+        """Loads index from the file.
+
+        Index is considered stale if data is shorter than it was at the
+        moment of indexing or it has the same size, but was modified. Data
+        that was appended since index was saved should be indexed by
+        :meth:`scan`.
+
+        :returns: :class:`FrameIndex` instance or :const:`None` if index file
+                  doesn't exists, is broken or stale.
+        """
+        try:
+            fobj = open(path, 'rb')
+        except IOError:
+            return None
+        with fobj:
+            header = fobj.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                return None
+            (magic, byteorder, session_open, chunk_rtype, indexed_size,
+             indexed_mtime, position, nframes,
+             nsessions) = _INDEX_HEADER.unpack(header)
+            if magic != _INDEX_MAGIC or size < indexed_size:
+                return None
+            if size == indexed_size and mtime != indexed_mtime:
+                return None
+            index = cls()
+            try:
+                for items, count in ((index.offsets, nframes),
+                                     (index.lengths, nframes),
+                                     (index.sessions, nframes),
+                                     (index.session_starts, nsessions),
+                                     (index.session_ends, nsessions)):
+                    items.fromfile(fobj, count)
+                    if byteorder != _BYTEORDER:
+                        items.byteswap()
+            except EOFError:
+                return None
+            index.rtypes = bytearray(fobj.read(nframes))
+            if len(index.rtypes) != nframes:
+                return None
+        index.position = position
+        index._session_open = session_open
+        index._chunk_rtype = chunk_rtype.strip(b'\0')
+        return index
+
+
+class BaseArchiveReader(object):
+    """Base reader of indexed ASTM traffic.
+
+    Subclasses should provide :attr:`index` and implement :meth:`read` for
+    their storage.
+    """
+
+    #: :class:`FrameIndex` instance.
+    index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def sessions_count(self):
+        """Number of captured sessions."""
+        return self.index.sessions_count
+
+    @property
+    def closed_sessions_count(self):
+        """Number of captured sessions that are complete."""
+        return self.index.closed_sessions_count
+
+    def read(self, offset, length):
+        """Returns `length` bytes of traffic from `offset`.
+
+        :rtype: :class:`memoryview`
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases underlying resources."""
+
+    def _save_index(self, stat):
+        try:
+            self.index.save(self.index_path, stat.st_size, stat.st_mtime)
+        except (IOError, OSError):
+            pass
+
+    def frame(self, idx):
+        """Returns frame by index."""
+        index = self.index
+        return self.read(index.offsets[idx], index.lengths[idx])
+
+    def frames(self, start=0, stop=None, rtype=None):
+        """Iterates over frames that starts within offsets range.
+
+        :param start: Start offset, inclusive.
+        :type start: int
+
+        :param stop: Stop offset, exclusive. If :const:`None` frames are
+                     returned till the end.
+        :type stop: int
+
+        :param rtype: Return only frames with records of this type.
+        :type rtype: bytes
+        """
+        offsets = self.index.offsets
+        first = bisect_left(offsets, start)
+        last = len(offsets) if stop is None else bisect_left(offsets, stop)
+        return self._iter_frames(range(first, last), rtype)
+
+    def session(self, num):
+        """Returns frames of session by its number."""
+        return list(self._iter_frames(self.index.session_frames(num)))
+
+    def session_data(self, num):
+        """Returns raw session data from ENQ till EOT."""
+        index = self.index
+        if not 0 <= num < index.sessions_count:
+            raise IndexError('session index out of range')
+        start = index.session_starts[num]
+        return self.read(start, index.session_ends[num] - start)
+
+    def messages(self, num):
+        """Returns complete messages of session by its number. Chunked
+        messages are joined."""
+        messages, chunks = [], []
+        for frame in self.session(num):
+            frame = frame.tobytes()
+            if frame[-5:-4] == ETB:
+                chunks.append(frame)
+                continue
+            if chunks:
+                chunks.append(frame)
+                frame, chunks = join(chunks), []
+            messages.append(frame)
+        return messages
+
+    def _iter_frames(self, indexes, rtype=None):
+        index = self.index
+        offsets, lengths, rtypes = index.offsets, index.lengths, index.rtypes
+        if rtype is not None:
+            rtype = ord(rtype)
+        for idx in indexes:
+            if rtype is not None and rtypes[idx] != rtype:
+                continue
+            yield self.read(offsets[idx], lengths[idx])
+
+
+class CaptureReader(BaseArchiveReader):
+    """Memory-mapped reader of raw ASTM traffic capture.
+
+    :param path: Capture file path.
+    :type path: str
+
+    :param index_path: Sidecar index file path. By default it's capture path
+                       with ``.idx`` suffix. If index could not be saved it's
+                       kept in memory only.
+    :type index_path: str
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        self._file = open(path, 'rb')
+        self._mmap = None
+        self._view = memoryview(b'')
+        stat = os.fstat(self._file.fileno())
+        self.index = FrameIndex.load(self.index_path, stat.st_size,
+                                     stat.st_mtime)
+        if self.index is None:
+            self.index = FrameIndex()
+        self.refresh()
+
+    def refresh(self):
+        """Maps data that was appended to the capture since it was opened
+        and indexes it."""
+        stat = os.fstat(self._file.fileno())
+        if self._mmap is None or stat.st_size > len(self._mmap):
+            self._remap(stat.st_size)
+        if self.index.position < len(self._view):
+            self.index.scan(self._mmap)
+            self._save_index(stat)
+
+    def read(self, offset, length):
+        if not _MMAP_VIEWS:  # pragma: no cover
+            return memoryview(self._mmap[offset:offset + length])
+        return self._view[offset:offset + length]
+
+    def close(self):
+        self._view = memoryview(b'')
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:  # frames are still in use, leave it to gc
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def _remap(self, size):
+        if not size:
+            return
+        old = self._mmap
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        self._view = self._mmap if not _MMAP_VIEWS else memoryview(self._mmap)
+        if old is not None:
+            try:
+                old.close()
+            except BufferError:  # views of old map are still in use
+                pass
+
+
+def _compressor(method, level):
+    if method == b'z':
+        return lambda data: zlib.compress(data, 6 if level is None else level)
+    if lzma is None:
+        raise ImportError('lzma is required')
+    return lambda data: lzma.compress(data, preset=level)
+
+
+def _decompressor(method):
+    if method == b'z':
+        return zlib.decompress
+    if lzma is None:
+        raise ImportError('lzma is required')
+    return lzma.decompress
+
+
+def _read_blocks(fobj, pos):
+    """Yields blocks headers and file positions of their data starting from
+    `pos`. Stops on the first incomplete block."""
+    size = os.fstat(fobj.fileno()).st_size
+    while pos + _BLOCK_HEADER.size <= size:
+        fobj.seek(pos)
+        offset, length, clength, crc = _BLOCK_HEADER.unpack(
+            fobj.read(_BLOCK_HEADER.size))
+        data_pos = pos + _BLOCK_HEADER.size
+        if data_pos + clength > size:
+            break
+        yield offset, length, clength, crc, data_pos
+        pos = data_pos + clength
+
+
+class BlockArchiveWriter(object):
+    """Appends ASTM traffic to the block-compressed archive.
+
+    Data is collected into blocks which are compressed independently, so
+    :class:`BlockArchiveReader` decompresses only blocks with requested
+    frames. Writer is suitable as :class:`~astm.server.RequestHandler` sink::
+
+        sink = BlockArchiveWriter('lis.archive')
+        server = Server(sink=sink)
+
+    Request handler flushes the sink after every session, so accepted
+    sessions are stored at once, each one within its own block, and the
+    server closes it on shutdown.
+
+    Incomplete block at the end of existing archive is truncated on opening.
+
+    :param path: Archive file path.
+    :type path: str
+
+    :param compression: Compression method: ``zlib`` or ``lzma``. Ignored for
+                        existing archive.
+    :type compression: str
+
+    :param block_size: Uncompressed size of block.
+    :type block_size: int
+
+    :param level: Compression level.
+    :type level: int
+    """
+
+    def __init__(self, path, compression='zlib', block_size=1 << 20,
+                 level=None):
+        if compression not in _COMPRESSIONS:
+            raise ValueError('Unknown compression method %r' % compression)
+        self.path = path
+        self.block_size = block_size
+        self._buffer = bytearray()
+        self._file = open(path, 'ab+')
+        self._file.seek(0)
+        header = self._file.read(_ARCHIVE_HEADER.size)
+        if not header:
+            method = _COMPRESSIONS[compression]
+            self._file.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC, method))
+            self._file.flush()
+            self._offset = 0
+        else:
+            magic, method = _ARCHIVE_HEADER.unpack(header)
+            if magic != _ARCHIVE_MAGIC:
+                self._file.close()
+                raise ValueError('%r is not ASTM block archive' % path)
+            end, self._offset = _ARCHIVE_HEADER.size, 0
+            for offset, length, clength, crc, pos in _read_blocks(self._file,
+                                                                  end):
+                end, self._offset = pos + clength, offset + length
+            self._file.truncate(end)
+        self._compress = _compressor(method, level)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        """Writes data to the archive. Data is compressed and stored when
+        block is filled or on :meth:`flush`."""
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            self._write_block(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+
+    def flush(self):
+        """Stores collected data as block, even if it isn't filled."""
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            del self._buffer[:]
+        self._file.flush()
+
+    def close(self):
+        """Flushes collected data and closes archive."""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def _write_block(self, data):
+        cdata = self._compress(data)
+        self._file.write(_BLOCK_HEADER.pack(self._offset, len(data),
+                                            len(cdata),
+                                            zlib.crc32(data) & 0xffffffff))
+        self._file.write(cdata)
+        self._file.flush()
+        self._offset += len(data)
+
+
+class BlockArchiveReader(BaseArchiveReader):
+    """Reader of block-compressed archive written by
+    :class:`BlockArchiveWriter`.
+
+    Frames index is built on first opening and stored in sidecar file as for
+    :class:`CaptureReader`. Data is read by decompressing only the blocks
+    which contains it, few recently used blocks are kept decompressed.
+
+    :param path: Archive file path.
+    :type path: str
+
+    :param index_path: Sidecar index file path.
+    :type index_path: str
+
+    :param cache_size: Number of decompressed blocks to keep in memory.
+    :type cache_size: int
+    """
+
+    def __init__(self, path, index_path=None, cache_size=8):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        self.cache_size = cache_size
+        self._file = open(path, 'rb')
+        magic, method = _ARCHIVE_HEADER.unpack(
+            self._file.read(_ARCHIVE_HEADER.size))
+        if magic != _ARCHIVE_MAGIC:
+            self._file.close()
+            raise ValueError('%r is not ASTM block archive' % path)
+        self._decompress = _decompressor(method)
+        self._end = _ARCHIVE_HEADER.size
+        self._blocks = []
+        #: Stream offsets of the blocks.
+        self.block_offsets = array(_OFFSET_TYPECODE)
+        self._cache = OrderedDict()
+        stat = os.fstat(self._file.fileno())
+        self.index = FrameIndex.load(self.index_path, stat.st_size,
+                                     stat.st_mtime)
+        if self.index is None:
+            self.index = FrameIndex()
+        self.refresh()
+
+    @property
+    def size(self):
+        """Uncompressed size of archived data."""
+        if not self._blocks:
+            return 0
+        return self.block_offsets[-1] + self._blocks[-1][0]
+
+    def refresh(self):
+        """Reads blocks that were appended to the archive since it was
+        opened and indexes them."""
+        for offset, length, clength, crc, pos in _read_blocks(self._file,
+                                                              self._end):
+            self.block_offsets.append(offset)
+            self._blocks.append((length, clength, crc, pos))
+            self._end = pos + clength
+        index = self.index
+        if index.position >= self.size:
+            return
+        num = bisect_right(self.block_offsets, index.position) - 1
+        base = self.block_offsets[num]
+        carry = b''
+        for num in range(num, len(self._blocks)):
+            data = carry + self._block(num)
+            index.scan(data, base=base)
+            carry = data[index.position - base:]
+            base = index.position
+        self._save_index(os.fstat(self._file.fileno()))
+
+    def read(self, offset, length):
+        offsets = self.block_offsets
+        num = bisect_right(offsets, offset) - 1
+        if num < 0 or length <= 0:
+            return memoryview(b'')
+        stop = offset + length
+        chunks = []
+        while num < len(offsets) and offsets[num] < stop:
+            data = self._block(num)
+            start = offsets[num]
+            chunks.append(data[max(offset - start, 0):stop - start])
+            num += 1
+        return memoryview(chunks[0] if len(chunks) == 1 else b''.join(chunks))
+
+    def close(self):
+        self._cache.clear()
+        self._file.close()
+
+    def _block(self, num):
+        cache = self._cache
+        if num in cache:
+            data = cache.pop(num)
+        else:
+            length, clength, crc, pos = self._blocks[num]
+            self._file.seek(pos)
+            data = self._decompress(self._file.read(clength))
+            if len(data) != length or zlib.crc32(data) & 0xffffffff != crc:
+                raise ValueError('Block %d of %r is corrupted'
+                                 '' % (num, self.path))
+            if cache and len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        cache[num] = data
+        return data
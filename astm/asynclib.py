@@ -24,6 +24,7 @@ import os
 import select
 import socket
 import sys
+import threading
 import time
 from collections import deque
 from errno import (
@@ -31,7 +32,12 @@ from errno import (
     ENOTCONN, ESHUTDOWN, EINTR, EISCONN, EBADF, ECONNABORTED, EPIPE, EAGAIN,
     errorcode
 )
-from .compat import long, b, bytes, buffer
+from .compat import long, b, basestring, bytes
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    selectors = None
 
 class ExitNow(Exception):
     pass
@@ -46,6 +52,17 @@ _SOCKET_MAP = {}
 
 _SCHEDULED_TASKS = []
 
+#: Scatter-gather send is available (not on Windows and Python 2).
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+#: Sets of channels which interest may be changed, grouped by map id.
+_INTEREST_CHANGES = {}
+
+#: Queued thread-safe calls and wakeup channel of the running loop, grouped
+#: by socket map id.
+_WAKERS = {}
+_WAKERS_LOCK = threading.Lock()
+
 log = logging.getLogger(__name__)
 
 
@@ -58,6 +75,27 @@ def _strerror(err):
         return "Unknown error %s" % err
 
 
+def _watch_interest(map):
+    """Returns set to be filled with `map` channels which interest may be
+    changed."""
+    changes = set()
+    entry = _INTEREST_CHANGES.get(id(map))
+    if entry is None:
+        # map reference is kept to not let its id be reused
+        entry = _INTEREST_CHANGES[id(map)] = (map, [])
+    entry[1].append(changes)
+    return changes
+
+
+def _unwatch_interest(map, changes):
+    entry = _INTEREST_CHANGES.get(id(map))
+    if entry is None:
+        return
+    entry[1][:] = [item for item in entry[1] if item is not changes]
+    if not entry[1]:
+        del _INTEREST_CHANGES[id(map)]
+
+
 def read(obj):
     """Triggers ``handle_read_event`` for specified object."""
     try:
@@ -155,6 +193,189 @@ def poll(timeout=0.0, map=None):
             exception(obj)
 
 
+class SelectBackend(object):
+    """I/O multiplexer backend based on :func:`select.select`.
+
+    Interest of every channel is checked by :meth:`~Dispatcher.readable` and
+    :meth:`~Dispatcher.writable` calls on each pass. Number of channels is
+    limited by system ``FD_SETSIZE`` value (usually 1024).
+    """
+
+    def poll(self, timeout, map):
+        """Waits for I/O events for `timeout` seconds and handles them."""
+        poll(timeout, map)
+
+    def close(self):
+        """Releases backend resources."""
+
+
+class SelectorsBackend(object):
+    """I/O multiplexer backend based on :mod:`selectors` module: epoll,
+    kqueue, etc.
+
+    Channels stays registered within selector between the passes. Instead of
+    checking :meth:`~Dispatcher.readable` and :meth:`~Dispatcher.writable` of
+    every channel on each pass, the backend rechecks only channels which
+    reported about possible interest change by
+    :meth:`~Dispatcher.update_interest`, so the cost of pass depends on the
+    number of active channels, not on the total one.
+
+    Channels which are added to or removed from the map without notification
+    are detected by the map size change and cause full map rescan.
+
+    Unlike :class:`SelectBackend` it doesn't watch for exceptional conditions,
+    since :mod:`selectors` doesn't support them, so
+    :meth:`~Dispatcher.handle_exception_event` is never called and out-of-band
+    data is not reported. Socket errors are still reported as read or write
+    events and handled by the related handlers.
+
+    :param selector: :class:`selectors.BaseSelector` subclass. By default
+                     the most efficient one for the platform is used.
+    """
+
+    def __init__(self, selector=None):
+        if selectors is None:
+            raise ImportError('selectors module is required')
+        self.selector = (selector or selectors.DefaultSelector)()
+        self._map = None
+        self._changes = None
+        # fd -> (channel, events) of registered channels
+        self._interest = {}
+        # channel -> fd of all known channels
+        self._channels = {}
+
+    def poll(self, timeout, map):
+        """Waits for I/O events for `timeout` seconds and handles them."""
+        if map is not self._map:
+            self._watch(map)
+        if len(self._channels) != len(map):
+            self._rescan(map)
+        changes = self._changes
+        while changes:
+            obj = changes.pop()
+            self._sync(obj._fileno, obj, map)
+        if not self._interest:
+            time.sleep(timeout)
+            return
+        try:
+            ready = self.selector.select(timeout)
+        except (OSError, select.error) as err:
+            if err.args[0] != EINTR:
+                raise
+            return
+        for key, events in ready:
+            obj = key.data
+            if events & selectors.EVENT_READ and map.get(key.fd) is obj:
+                read(obj)
+            if events & selectors.EVENT_WRITE and map.get(key.fd) is obj:
+                write(obj)
+
+    def close(self):
+        """Unregisters all the channels and closes selector."""
+        self._unwatch()
+        self.selector.close()
+
+    def _watch(self, map):
+        self._unwatch()
+        self._map = map
+        self._changes = _watch_interest(map)
+
+    def _unwatch(self):
+        if self._map is not None:
+            _unwatch_interest(self._map, self._changes)
+        for fd in list(self._interest):
+            self._unregister(fd)
+        self._channels.clear()
+        self._map = self._changes = None
+
+    def _rescan(self, map):
+        channels = self._channels
+        for obj, fd in list(channels.items()):
+            if map.get(fd) is not obj:
+                self._sync(None, obj, map)
+        for fd, obj in list(map.items()):
+            self._sync(fd, obj, map)
+
+    def _sync(self, fd, obj, map):
+        old_fd = self._channels.pop(obj, None)
+        if old_fd is not None and old_fd != fd:
+            current = self._interest.get(old_fd)
+            if current is not None and current[0] is obj:
+                self._unregister(old_fd)
+        if fd is None or map.get(fd) is not obj:
+            if fd is not None and fd in self._interest:
+                if self._interest[fd][0] is obj:
+                    self._unregister(fd)
+            return
+        self._channels[obj] = fd
+        events = 0
+        if obj.readable():
+            events |= selectors.EVENT_READ
+        # accepting sockets should not be writable
+        if obj.writable() and not obj.accepting:
+            events |= selectors.EVENT_WRITE
+        self._update(fd, obj, events)
+
+    def _update(self, fd, obj, events):
+        current = self._interest.get(fd)
+        if current is not None and current[0] is not obj:
+            # fd was reused by another channel
+            self._unregister(fd)
+            if self._channels.get(current[0]) == fd:
+                del self._channels[current[0]]
+            current = None
+        if not events:
+            if current is not None:
+                self._unregister(fd)
+            return
+        if current is None:
+            self.selector.register(fd, events, obj)
+        elif current[1] != events:
+            self.selector.modify(fd, events, obj)
+        else:
+            return
+        self._interest[fd] = (obj, events)
+
+    def _unregister(self, fd):
+        del self._interest[fd]
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError, OSError):
+            pass
+
+
+#: Names of :mod:`selectors` classes available as backends.
+_SELECTORS = {
+    'selectors': 'DefaultSelector',
+    'epoll': 'EpollSelector',
+    'kqueue': 'KqueueSelector',
+    'devpoll': 'DevpollSelector',
+    'poll': 'PollSelector',
+}
+
+
+def make_backend(backend=None):
+    """Returns I/O multiplexer backend instance.
+
+    :param backend: Backend instance or name: ``select`` (default),
+                    ``selectors`` for the best one available for the platform,
+                    ``epoll``, ``kqueue``, ``devpoll`` or ``poll``.
+    """
+    if backend is None or backend == 'select':
+        return SelectBackend()
+    if not isinstance(backend, basestring):
+        return backend
+    if backend not in _SELECTORS:
+        raise ValueError('Unknown backend %r' % backend)
+    if selectors is None:
+        raise ImportError('selectors module is required')
+    selector = getattr(selectors, _SELECTORS[backend], None)
+    if selector is None:
+        raise ValueError('Backend %r is not available on this platform'
+                         '' % backend)
+    return SelectorsBackend(selector)
+
+
 def scheduler(tasks=None):
     if tasks is None:
         tasks = _SCHEDULED_TASKS
@@ -172,7 +393,53 @@ def scheduler(tasks=None):
                 call.cancel()
 
 
-def loop(timeout=30.0, map=None, tasks=None, count=None):
+def next_deadline(tasks=None, wheel=None):
+    """Returns the time of the earliest scheduled call or :const:`None` if
+    there are no calls. Calls may be made a bit later than the returned time,
+    but never earlier.
+
+    :param tasks: Heap of :class:`call_later` calls. The global one is used
+                  if omitted.
+    :type tasks: list
+
+    :param wheel: :class:`TimingWheel` instance. The default one is used if
+                  omitted.
+    :type wheel: :class:`TimingWheel`
+
+    :rtype: float
+    """
+    if tasks is None:
+        tasks = _SCHEDULED_TASKS
+    if wheel is None:
+        wheel = _TIMING_WHEEL
+    deadline = None
+    if tasks:
+        # reset calls are not resorted till they are popped, but their
+        # timeouts could only grow, so the heap top is still the lower bound
+        deadline = tasks[0].timeout
+    if wheel:
+        wheel_deadline = wheel.next_deadline()
+        if deadline is None or wheel_deadline < deadline:
+            deadline = wheel_deadline
+    return deadline
+
+
+def _loop_step(timeout, map, tasks, wheel, backend):
+    deadline = next_deadline(tasks, wheel)
+    if deadline is not None:
+        timeout = max(0, min(timeout, deadline - time.time()))
+    if map:
+        backend.poll(timeout, map)
+    elif timeout:
+        time.sleep(timeout)
+    if tasks:
+        scheduler(tasks)
+    if wheel:
+        wheel.run()
+
+
+def loop(timeout=30.0, map=None, tasks=None, count=None, backend=None,
+         wheel=None):
     """
     Enter a polling loop that terminates after count passes or all open
     channels have been closed. All arguments are optional. The *count*
@@ -189,26 +456,48 @@ def loop(timeout=30.0, map=None, tasks=None, count=None):
     :class:`asyncore.dispatcher`, :class:`asynchat.async_chat` and subclasses
     thereof) can freely be mixed in the map.
 
+    The *backend* parameter sets I/O multiplexer backend, see
+    :func:`make_backend`. Backend created by name is closed on loop exit,
+    while backend instance could be passed to keep registrations between
+    loop calls.
+
+    The *wheel* parameter sets :class:`TimingWheel` which calls are made
+    within the loop next to the *tasks* ones. If omitted, the default one
+    used by :func:`call_timeout` is used.
+
+    Polling never waits past the :func:`next_deadline` of the scheduled
+    calls, so *timeout* is just the upper bound. If there are no channels
+    left, the loop sleeps till the next call.
+
+    While the loop is running, it also watches wakeup channel of
+    :func:`call_soon_threadsafe`, which doesn't keep the loop running
+    itself.
     """
     if map is None:
         map = _SOCKET_MAP
     if tasks is None:
         tasks = _SCHEDULED_TASKS
+    if wheel is None:
+        wheel = _TIMING_WHEEL
+    owned = backend is None or isinstance(backend, basestring)
+    backend = make_backend(backend)
+
+    waker = _get_waker(map)
 
-    if count is None:
-        while map or tasks:
-            if map:
-                poll(timeout, map)
-            if tasks:
-                scheduler()
+    try:
+        if count is None:
+            while _has_channels(map, waker) or tasks or wheel:
+                _loop_step(timeout, map, tasks, wheel, backend)
 
-    else:
-        while (map or tasks) and count > 0:
-            if map:
-                poll(timeout, map)
-            if tasks:
-                scheduler()
-            count -= 1
+        else:
+            while (_has_channels(map, waker) or tasks or wheel) and count > 0:
+                _loop_step(timeout, map, tasks, wheel, backend)
+                count -= 1
+    finally:
+        if not _has_channels(map, waker):
+            _stop_waker(map, waker)
+        if owned:
+            backend.close()
 
 
 class call_later:
@@ -217,6 +506,9 @@ class call_later:
     It can be used to asynchronously schedule a call within the polling
     loop without blocking it. The instance returned is an object that
     can be used to cancel or reschedule the call.
+
+    It's not thread-safe: use :func:`call_soon_threadsafe` to schedule the
+    call from other threads.
     """
 
     def __init__(self, seconds, target, *args, **kwargs):
@@ -287,6 +579,173 @@ class call_later:
                 heapq._siftup(self.__tasks, pos)
 
 
+class TimingWheel(object):
+    """Hashed timing wheel of delayed calls.
+
+    Unlike :class:`call_later` heap, arming, resetting and cancelling of
+    the call take constant time, which matters for I/O timeouts that are
+    reset on every received or sent frame. Timers are placed into the wheel
+    slots by their deadline ticks; resetting to the later time just updates
+    the deadline and the timer is moved to the proper slot only when its
+    old slot is reached.
+
+    Calls are never made before their deadline, but may be delayed for the
+    `resolution` seconds. Errors of the calls are logged, so they don't
+    prevent other due calls.
+
+    :param resolution: Tick duration in seconds.
+    :type resolution: float
+
+    :param slots: Number of wheel slots.
+    :type slots: int
+    """
+
+    def __init__(self, resolution=0.1, slots=512):
+        self.resolution = resolution
+        self._slots = [set() for _ in range(slots)]
+        self._current = int(time.time() / resolution)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, seconds, target, *args, **kwargs):
+        """Schedules the call of `target` after `seconds`.
+
+        :returns: :class:`WheelTimer` instance with the same interface as
+                  :class:`call_later` has.
+        """
+        return WheelTimer(self, seconds, target, *args, **kwargs)
+
+    def run(self, now=None):
+        """Makes all the calls which deadline has come."""
+        if now is None:
+            now = time.time()
+        target = int(now / self.resolution)
+        if target <= self._current:
+            return
+        slots = self._slots
+        size = len(slots)
+        ticks = min(target - self._current, size)
+        current = self._current
+        self._current = target
+        for tick in range(current + 1, current + ticks + 1):
+            slot = slots[tick % size]
+            if not slot:
+                continue
+            for timer in list(slot):
+                if timer.timeout > now:
+                    self._move(timer)
+                    continue
+                self._remove(timer)
+                try:
+                    timer.call()
+                except _RERAISEABLE_EXC:
+                    # rest of due calls are made on the next run
+                    self._current = min(self._current, tick - 1)
+                    raise
+                except Exception:
+                    log.exception('Error occurred in %r call', timer._target)
+                finally:
+                    if not timer.cancelled:
+                        timer.cancelled = True
+                        timer._release()
+
+    def next_deadline(self):
+        """Returns the time since which the earliest call could be made or
+        :const:`None` if there are no calls."""
+        if not self._count:
+            return None
+        slots = self._slots
+        size = len(slots)
+        for tick in range(self._current + 1, self._current + size + 1):
+            if slots[tick % size]:
+                return tick * self.resolution
+
+    def clear(self):
+        """Cancels all the calls."""
+        for slot in self._slots:
+            for timer in list(slot):
+                timer.cancel()
+
+    def _place(self, timer):
+        tick = max(int(timer.timeout / self.resolution), self._current + 1)
+        timer._tick = tick
+        self._slots[tick % len(self._slots)].add(timer)
+        self._count += 1
+
+    def _remove(self, timer):
+        self._slots[timer._tick % len(self._slots)].discard(timer)
+        self._count -= 1
+
+    def _move(self, timer):
+        self._remove(timer)
+        self._place(timer)
+
+
+class WheelTimer(object):
+    """Delayed call scheduled on the :class:`TimingWheel`."""
+
+    __slots__ = ('timeout', 'cancelled', '_wheel', '_delay', '_target',
+                 '_args', '_kwargs', '_tick')
+
+    def __init__(self, wheel, seconds, target, *args, **kwargs):
+        assert callable(target), "%s is not callable" % target
+        assert seconds >= 0, \
+            "%s is not greater than or equal to 0 seconds" % (seconds)
+        self._wheel = wheel
+        self._delay = seconds
+        self._target = target
+        self._args = args
+        self._kwargs = kwargs
+        self.timeout = time.time() + seconds
+        self.cancelled = False
+        wheel._place(self)
+
+    def call(self):
+        """Call this scheduled function."""
+        assert not self.cancelled, "Already cancelled"
+        self._target(*self._args, **self._kwargs)
+
+    def reset(self):
+        """Reschedule this call resetting the current countdown."""
+        assert not self.cancelled, "Already cancelled"
+        self.timeout = time.time() + self._delay
+
+    def delay(self, seconds):
+        """Reschedule this call for a later time."""
+        assert not self.cancelled, "Already cancelled."
+        assert seconds >= 0, \
+            "%s is not greater than or equal to 0 seconds" % (seconds)
+        self._delay = seconds
+        self.timeout = time.time() + seconds
+        if int(self.timeout / self._wheel.resolution) < self._tick:
+            self._wheel._move(self)
+
+    def cancel(self):
+        """Unschedule this call."""
+        assert not self.cancelled, "Already cancelled"
+        self.cancelled = True
+        self._wheel._remove(self)
+        self._release()
+
+    def _release(self):
+        self._target = self._args = self._kwargs = None
+
+
+#: Timing wheel for I/O timeouts which is run by :func:`loop` by default.
+_TIMING_WHEEL = TimingWheel()
+
+
+def call_timeout(seconds, target, *args, **kwargs):
+    """Schedules the call on the default :class:`TimingWheel`. Suitable for
+    I/O timeouts which are frequently reset.
+
+    :returns: :class:`WheelTimer` instance.
+    """
+    return _TIMING_WHEEL.call_later(seconds, target, *args, **kwargs)
+
+
 class Dispatcher(object):
     """
     The :class:`Dispatcher` class is a thin wrapper around a low-level socket
@@ -377,6 +836,7 @@ class Dispatcher(object):
         if map is None:
             map = self._map
         map[self._fileno] = self
+        self.update_interest()
 
     def _del_channel(self, map=None):
         fd = self._fileno
@@ -386,6 +846,7 @@ class Dispatcher(object):
             log.debug('Closing channel %d:%s' % (fd, self))
             del map[fd]
         self._fileno = None
+        self.update_interest()
 
     def create_socket(self, family, type):
         """
@@ -413,6 +874,25 @@ class Dispatcher(object):
         except socket.error:
             pass
 
+    def set_reuse_port(self):
+        """Allows several sockets to bind the same address and port, so the
+        kernel balances incoming connections between them. Raises
+        :exc:`NotImplementedError` if ``SO_REUSEPORT`` is not supported."""
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise NotImplementedError('SO_REUSEPORT is not supported')
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    def update_interest(self):
+        """Notifies the loop that :meth:`readable` or :meth:`writable`
+        results may be changed. Backends which track channels interest, like
+        :class:`SelectorsBackend`, recheck it only after this notification,
+        so subclasses which override these methods should call it each time
+        when the conditions they depend on are changed."""
+        entry = _INTEREST_CHANGES.get(id(self._map))
+        if entry is not None:
+            for changes in entry[1]:
+                changes.add(self)
+
     def readable(self):
         """
         Called each time around the asynchronous loop to determine whether a
@@ -437,6 +917,7 @@ class Dispatcher(object):
         and should be at least 1; the maximum value is system-dependent
         (usually 5)."""
         self.accepting = True
+        self.update_interest()
         if os.name == 'nt' and num > 5:
             num = 5
         return self.socket.listen(num)
@@ -460,6 +941,7 @@ class Dispatcher(object):
         """
         self.connected = False
         self.addr = address
+        self.update_interest()
         err = self.socket.connect_ex(address)
         if err in (EINPROGRESS, EALREADY, EWOULDBLOCK)\
         or err == EINVAL and os.name in ('nt', 'ce'):
@@ -497,7 +979,9 @@ class Dispatcher(object):
     def send(self, data):
         """Send `data` to the remote end-point of the socket."""
         try:
-            log.debug('[%s:%d] <<< %r', self.addr[0], self.addr[1], str(data))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('[%s:%d] <<< %r', self.addr[0], self.addr[1],
+                          bytes(data))
             result = self.socket.send(data)
             return result
         except socket.error as err:
@@ -509,6 +993,27 @@ class Dispatcher(object):
             else:
                 raise
 
+    def sendmsg(self, buffers):
+        """Send sequence of `buffers` to the remote end-point of the socket
+        with a single system call. Available only if the platform supports
+        :meth:`socket.socket.sendmsg`.
+
+        Returns number of sent bytes.
+        """
+        try:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('[%s:%d] <<< %r', self.addr[0], self.addr[1],
+                          b''.join(bytes(item) for item in buffers))
+            return self.socket.sendmsg(buffers)
+        except socket.error as err:
+            if err.args[0] == EWOULDBLOCK:
+                return 0
+            elif err.args[0] in _DISCONNECTED:
+                self.handle_close()
+                return 0
+            else:
+                raise
+
     def recv(self, buffer_size):
         """Read at most `buffer_size` bytes from the socket's remote end-point.
 
@@ -533,6 +1038,32 @@ class Dispatcher(object):
             else:
                 raise
 
+    def recv_into(self, buffer, nbytes=0):
+        """Read at most `nbytes` bytes from the socket's remote end-point into
+        writable `buffer`. If `nbytes` is ``0`` the whole buffer is filled.
+
+        Returns number of read bytes. Zero implies that the channel has been
+        closed from the other end.
+        """
+        try:
+            num = self.socket.recv_into(buffer, nbytes)
+            if not num:
+                # a closed connection is indicated by signaling
+                # a read condition, and having recv() return 0.
+                self.handle_close()
+                return 0
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('[%s:%d] >>> %r', self.addr[0], self.addr[1],
+                          bytes(buffer[:num]))
+            return num
+        except socket.error as err:
+            # winsock sometimes throws ENOTCONN
+            if err.args[0] in _DISCONNECTED:
+                self.handle_close()
+                return 0
+            else:
+                raise
+
     def close(self):
         """Close the socket.
         
@@ -567,6 +1098,7 @@ class Dispatcher(object):
             raise socket.error(err, _strerror(err))
         self.handle_connect()
         self.connected = True
+        self.update_interest()
 
     def handle_write_event(self):
         if self.accepting:
@@ -653,11 +1185,13 @@ class Dispatcher(object):
         self.close()
 
 
-def close_all(map=None, tasks=None, ignore_all=False):
+def close_all(map=None, tasks=None, ignore_all=False, wheel=None):
     if map is None:
         map = _SOCKET_MAP
     if tasks is None:
         tasks = _SCHEDULED_TASKS
+    if wheel is None:
+        wheel = _TIMING_WHEEL
     for x in list(map.values()):
         try:
             x.close()
@@ -683,6 +1217,14 @@ def close_all(map=None, tasks=None, ignore_all=False):
                 raise
     del tasks[:]
 
+    try:
+        wheel.clear()
+    except _RERAISEABLE_EXC:
+        raise
+    except Exception:
+        if not ignore_all:
+            raise
+
 
 class AsyncChat(Dispatcher):
     """
@@ -701,10 +1243,34 @@ class AsyncChat(Dispatcher):
 
     # these are overridable defaults
 
-    #: The asynchronous input buffer size.
+    #: The asynchronous input buffer size: initial number of bytes to read
+    #: at once. Each connection doubles it when reads fill the buffer and
+    #: halves it when reads stay small, within the bounds below.
     recv_buffer_size = 4096
-    #: The asynchronous output buffer size.
+    #: Minimal input buffer size.
+    recv_buffer_min_size = 512
+    #: Maximal input buffer size. Set it and :attr:`recv_buffer_min_size` to
+    #: :attr:`recv_buffer_size` to disable adaptive sizing.
+    recv_buffer_max_size = 65536
+    #: The asynchronous output buffer size: maximum number of bytes sent
+    #: with a single call.
     send_buffer_size = 4096
+    #: Maximum number of outgoing queue items sent with a single call.
+    send_gather_size = 64
+
+    #: Number of bytes in the outgoing queue above which
+    #: :meth:`pause_writing` is called and reading is paused, so the peer
+    #: which doesn't read responses couldn't flood the channel.
+    outbox_high_watermark = 65536
+    #: Number of bytes in the outgoing queue below which
+    #: :meth:`resume_writing` is called and reading is resumed.
+    outbox_low_watermark = 16384
+    #: Number of bytes in the incoming queue above which reading is paused.
+    #: Code that consumes :attr:`inbox` outside of :meth:`found_terminator`
+    #: should call :meth:`~Dispatcher.update_interest` to resume reading.
+    inbox_high_watermark = 65536
+    #: Number of bytes in the incoming queue below which reading is resumed.
+    inbox_low_watermark = 16384
 
     #: Encoding usage is not enabled by default, because that is a
     #: sign of an application bug that we don't want to pass silently.
@@ -718,10 +1284,36 @@ class AsyncChat(Dispatcher):
     _terminator = None
 
     def __init__(self, sock=None, map=None):
-        # for string terminator matching
-        self._input_buffer = b''
+        # received data is read into the buffer tail and consumed from its
+        # head, so only the [start:end] part of it contains unprocessed data
+        self._input_buffer = bytearray()
+        self._input_start = 0
+        self._input_end = 0
+        # number of consecutive reads that filled less than half of buffer
+        self._small_reads = 0
         self.inbox = deque()
         self.outbox = deque()
+        # number of already sent bytes of the first outgoing queue item
+        self._outbox_offset = 0
+        # number of pushed bytes in the outgoing queue
+        self._outbox_size = 0
+        #: Outgoing queue is above high watermark.
+        self.writing_paused = False
+        self._inbox_paused = False
+        #: I/O statistics: total number of received bytes and receive calls,
+        #: current input buffer size, total number of sent bytes and send
+        #: calls, number of flushes and bytes and send calls made by the last
+        #: one.
+        self.stats = {
+            'received_bytes': 0,
+            'recv_calls': 0,
+            'recv_buffer_size': self.recv_buffer_size,
+            'sent_bytes': 0,
+            'send_calls': 0,
+            'flushes': 0,
+            'last_flush_bytes': 0,
+            'last_flush_calls': 0,
+        }
         super(AsyncChat, self).__init__(sock, map)
         self.collect_incoming_data = self.pull
         self.initiate_send = self.flush
@@ -770,51 +1362,112 @@ class AsyncChat(Dispatcher):
     terminator = property(_get_terminator, _set_terminator)
 
     def handle_read(self):
+        size = self.recv_buffer_size
+        self._reserve_input_buffer(size)
+        end = self._input_end
         try:
-            data = self.recv(self.recv_buffer_size)
+            num = self.recv_into(memoryview(self._input_buffer)[end:end + size],
+                                 size)
         except socket.error as err:
             self.handle_error()
             return
+        self._input_end += num
+        self.stats['received_bytes'] += num
+        self.stats['recv_calls'] += 1
+        if num:
+            self._adapt_recv_buffer_size(num, size)
 
-        if self.use_encoding and not isinstance():
-            data = data.decode(self.encoding)
-
-        self._input_buffer += data
-
-        while self._input_buffer:
+        while self._input_start < self._input_end:
             terminator = self.terminator
             if not terminator:
                 handler = self._lookup_none_terminator
             elif isinstance(terminator, (int, long)):
                 handler = self._lookup_int_terminator
-            elif isinstance(terminator, str):
+            elif isinstance(terminator, basestring):
                 handler = self._lookup_str_terminator
+                terminator = b(terminator)
             else:
                 handler = self._lookup_list_terminator
-            res = handler(self.terminator)
+            res = handler(terminator)
             if res is None:
                 break
 
+        if self.inbox and self._inbox_size() > self.inbox_high_watermark:
+            self._inbox_paused = True
+            self.update_interest()
+
+        buf = self._input_buffer
+        if self._input_start == self._input_end \
+                and len(buf) > self.recv_buffer_size:
+            # release memory of the large buffer once traffic goes down
+            self._input_start = self._input_end = 0
+            del buf[self.recv_buffer_size:]
+
+    def _adapt_recv_buffer_size(self, num, size):
+        if num >= size:
+            self._small_reads = 0
+            new_size = min(size * 2, self.recv_buffer_max_size)
+            if new_size <= size:
+                return
+        elif num < size // 2:
+            self._small_reads += 1
+            if self._small_reads < 2:
+                return
+            self._small_reads = 0
+            new_size = max(size // 2, self.recv_buffer_min_size)
+            if new_size >= size:
+                return
+        else:
+            self._small_reads = 0
+            return
+        self.recv_buffer_size = self.stats['recv_buffer_size'] = new_size
+
+    def _reserve_input_buffer(self, size):
+        # Makes room for `size` bytes at the input buffer tail. Unprocessed
+        # data is moved to the buffer head only when there is no room left,
+        # so it's copied once per buffer length of consumed data.
+        buf = self._input_buffer
+        start, end = self._input_start, self._input_end
+        if start == end:
+            start = end = 0
+        elif len(buf) - end < size and start:
+            buf[:end - start] = buf[start:end]
+            end -= start
+            start = 0
+        self._input_start, self._input_end = start, end
+        if len(buf) - end < size:
+            buf.extend(bytearray(size - len(buf) + end))
+
+    def _pull_input(self, stop, skip=0):
+        # Pulls unprocessed data till `stop` position and consumes `skip`
+        # more bytes after it. Should be called before found_terminator()
+        # since that may discard input buffers.
+        start = self._input_start
+        self._input_start = stop + skip
+        if stop > start:
+            self.pull(bytes(self._input_buffer[start:stop]))
+
     def _lookup_none_terminator(self, terminator):
-        self.pull(self._input_buffer)
-        self._input_buffer = ''
+        self._pull_input(self._input_end)
         return False
 
     def _lookup_int_terminator(self, terminator):
-        if len(self._input_buffer) < terminator:
-            self.pull(self._input_buffer)
-            self._input_buffer = ''
+        start, end = self._input_start, self._input_end
+        if end - start < terminator:
+            self._pull_input(end)
             return False
         else:
-            self.pull(self._input_buffer[:terminator])
-            self._input_buffer = self._input_buffer[terminator:]
+            self._pull_input(start + terminator)
             self.found_terminator()
             return True
 
     def _lookup_list_terminator(self, terminator):
+        buf, start, end = self._input_buffer, self._input_start, self._input_end
         for item in terminator:
-            if self._input_buffer.find(item) != -1:
-                return self._lookup_str_terminator(item)
+            item = b(item)
+            index = buf.find(item, start, end)
+            if index != -1:
+                return self._found_str_terminator(item, index)
         return self._lookup_none_terminator(terminator)
 
     def _lookup_str_terminator(self, terminator):
@@ -825,33 +1478,35 @@ class AsyncChat(Dispatcher):
         #    collect data to the prefix
         # 3) end of buffer does not match any prefix:
         #    collect data
-        terminator_len = len(terminator)
-        index = self._input_buffer.find(terminator)
+        # Data before the prefix is always collected, so the next lookup
+        # starts right from the last scanned position.
+        buf, start, end = self._input_buffer, self._input_start, self._input_end
+        index = buf.find(terminator, start, end)
         if index != -1:
             # we found the terminator
-            if self.strip_terminator and index > 0:
-                self.pull(self._input_buffer[:index])
-            elif not self.strip_terminator:
-                self.pull(self._input_buffer[:index+terminator_len])
-            self._input_buffer = self._input_buffer[index+terminator_len:]
-            # This does the Right Thing if the terminator is changed here.
-            self.found_terminator()
-            return True
+            return self._found_str_terminator(terminator, index)
         else:
             # check for a prefix of the terminator
-            index = find_prefix_at_end(self._input_buffer, terminator)
+            index = find_prefix_at_end(buf, terminator, start, end)
             if index:
-                if index != len(self._input_buffer):
+                if index != end - start:
                     # we found a prefix, collect up to the prefix
-                    self.pull(self._input_buffer[:-index])
-                    self._input_buffer = self._input_buffer[-index:]
+                    self._pull_input(end - index)
                 return None
             else:
                 # no prefix, collect it all
-                self.pull(self._input_buffer)
-                self._input_buffer = ''
+                self._pull_input(end)
                 return False
 
+    def _found_str_terminator(self, terminator, index):
+        if self.strip_terminator:
+            self._pull_input(index, len(terminator))
+        else:
+            self._pull_input(index + len(terminator))
+        # This does the Right Thing if the terminator is changed here.
+        self.found_terminator()
+        return True
+
     def handle_write(self):
         self.flush()
 
@@ -861,12 +1516,10 @@ class AsyncChat(Dispatcher):
         This is all you need to do to have the channel write the data out to
         the network.
         """
-        sabs = self.send_buffer_size
-        if len(data) > sabs:
-            for i in range(0, len(data), sabs):
-                self.outbox.append(data[i:i+sabs])
-        else:
-            self.outbox.append(data)
+        if self.use_encoding and not isinstance(data, bytes):
+            data = data.encode(self.encoding)
+        self.outbox.append(data)
+        self._outbox_size += len(data)
         return self.flush()
 
     def push_with_producer(self, producer):
@@ -874,9 +1527,39 @@ class AsyncChat(Dispatcher):
         return self.flush()
 
     def readable(self):
-        """Predicate for inclusion in the readable for select()"""
+        """Predicate for inclusion in the readable for select(). Reading is
+        paused while outgoing or incoming queue is above the high watermark
+        till it goes below the low one."""
+        if self.writing_paused:
+            return False
+        if self._inbox_paused:
+            if self._inbox_size() > self.inbox_low_watermark:
+                return False
+            self._inbox_paused = False
         return True
 
+    def pause_writing(self):
+        """Called when the outgoing queue goes above
+        :attr:`outbox_high_watermark`. Stop producing data to push till
+        :meth:`resume_writing` call."""
+
+    def resume_writing(self):
+        """Called when the outgoing queue goes below
+        :attr:`outbox_low_watermark` after :meth:`pause_writing` call."""
+
+    def _inbox_size(self):
+        return sum(len(item) for item in self.inbox if item is not None)
+
+    def _check_outbox_watermarks(self):
+        size = self._outbox_size - self._outbox_offset
+        if not self.writing_paused:
+            if size > self.outbox_high_watermark:
+                self.writing_paused = True
+                self.pause_writing()
+        elif size <= self.outbox_low_watermark:
+            self.writing_paused = False
+            self.resume_writing()
+
     def writable(self):
         """Predicate for inclusion in the writable for select()"""
         # For nonblocking sockets connect() will not set self.connected flag,
@@ -887,38 +1570,76 @@ class AsyncChat(Dispatcher):
     def close_when_done(self):
         """Automatically close this channel once the outgoing queue is empty."""
         self.outbox.append(None)
+        self.update_interest()
 
     def flush(self):
-        """Sends all data from outgoing queue."""
-        while self.outbox and self.connected:
-            self._send_chunky(self.outbox.popleft())
-
-    def _send_chunky(self, data):
-        """Sends data as chunks sized by ``send_buffer_size`` value.
-
-        Returns ``True`` on success, ``False`` on error and ``None`` on closing
-        event.
-        """
-        if self.use_encoding and not isinstance(data, bytes):
-            data = data.encode(self.encoding)
-        while True:
-            if data is None:
+        """Sends data from outgoing queue until it's empty or the socket
+        would block. Queued items are sent as :class:`memoryview` slices
+        without copying and, if possible, several items at once with
+        :meth:`~Dispatcher.sendmsg`."""
+        sent = calls = 0
+        outbox = self.outbox
+        while outbox and self.connected:
+            if outbox[0] is None:
+                outbox.popleft()
                 self.handle_close()
-                return
-
-            obs = self.send_buffer_size
-            bdata = buffer(data, 0, obs)
-
+                break
             try:
-                num_sent = self.send(bdata)
+                num, size = self._send_outbox()
             except socket.error:
                 self.handle_error()
-                return False
-
-            if num_sent and num_sent < len(bdata) or obs < len(data):
-                data = data[num_sent:]
-            else:
-                return True
+                break
+            calls += 1
+            sent += num
+            if not num and size:
+                break
+        stats = self.stats
+        stats['sent_bytes'] += sent
+        stats['send_calls'] += calls
+        stats['flushes'] += 1
+        stats['last_flush_bytes'] = sent
+        stats['last_flush_calls'] = calls
+        self._check_outbox_watermarks()
+        self.update_interest()
+
+    def _send_outbox(self):
+        """Sends queued items with a single call.
+
+        Returns the number of sent bytes and the number of bytes that were
+        tried to send.
+        """
+        limit = self.send_buffer_size
+        gather = self.send_gather_size if _HAS_SENDMSG else 1
+        offset = self._outbox_offset
+        views = []
+        size = 0
+        for item in self.outbox:
+            if item is None or len(views) >= gather or size >= limit:
+                break
+            view = memoryview(item)[offset:offset + limit - size]
+            offset = 0
+            views.append(view)
+            size += len(view)
+        if not size:
+            num = 0
+        elif len(views) == 1:
+            num = self.send(views[0])
+        else:
+            num = self.sendmsg(views)
+        self._consume_outbox(num)
+        return num, size
+
+    def _consume_outbox(self, num):
+        outbox = self.outbox
+        offset = self._outbox_offset + num
+        size = self._outbox_size
+        while outbox and outbox[0] is not None and offset >= len(outbox[0]):
+            item = outbox.popleft()
+            offset -= len(item)
+            size -= len(item)
+        self._outbox_offset = offset
+        # items could be queued directly, not only by push()
+        self._outbox_size = max(size, offset)
 
     def discard_buffers(self):
         """In emergencies this method will discard any data held in the input
@@ -927,15 +1648,136 @@ class AsyncChat(Dispatcher):
         self.discard_output_buffers()
 
     def discard_input_buffers(self):
-        self._input_buffer = b('')
+        self._input_buffer = bytearray()
+        self._input_start = self._input_end = 0
         self.inbox.clear()
 
     def discard_output_buffers(self):
         self.outbox.clear()
+        self._outbox_offset = self._outbox_size = 0
+        self._check_outbox_watermarks()
+        self.update_interest()
+
+
+class _Waker(Dispatcher):
+    """Channel that runs queued calls within the loop. The loop is woken up
+    by a byte written into the socket pair."""
+
+    def __init__(self, calls, map=None):
+        reader, self._writer = socket.socketpair()
+        self._writer.setblocking(0)
+        self._calls = calls
+        super(_Waker, self).__init__(reader, map)
+
+    def __repr__(self):
+        return '<%s.%s at %#x>' % (self.__class__.__module__,
+                                   self.__class__.__name__, id(self))
+
+    def wakeup(self):
+        """Interrupts waiting for I/O events. Safe to use from any thread."""
+        try:
+            self._writer.send(b'\0')
+        except socket.error:
+            # the socket buffer is full or the waker is closed, so wakeup is
+            # either already pending or not needed
+            pass
+
+    def readable(self):
+        return True
 
+    def writable(self):
+        return False
 
-def find_prefix_at_end(haystack, needle):
+    def handle_read(self):
+        try:
+            while self.socket.recv(4096):
+                pass
+        except socket.error as err:
+            if err.args[0] not in (EWOULDBLOCK, EAGAIN):
+                raise
+        calls = self._calls
+        while calls:
+            callback, args, kwargs = calls.popleft()
+            try:
+                callback(*args, **kwargs)
+            except _RERAISEABLE_EXC:
+                raise
+            except Exception:
+                log.exception('Error occurred in %r call', callback)
+
+    def close(self):
+        if self._fileno is not None:
+            super(_Waker, self).close()
+        self._writer.close()
+
+
+def call_soon_threadsafe(callback, *args, **kwargs):
+    """Schedules the call of `callback` within the :func:`loop` thread. Unlike
+    other functions of this module, it's safe to use from any thread: to
+    push data to the channel, schedule :class:`call_later`, etc.::
+
+        def poll_database():
+            while True:
+                for record in fetch_new_records():
+                    call_soon_threadsafe(client.send_record, record)
+
+    Waiting for I/O events is interrupted, so the call is made immediately.
+    If the loop is not running, the call is made once it starts.
+
+    Pass ``_map`` keyword argument to schedule the call within the loop of
+    the specific socket map. Other arguments are passed to the `callback`.
+    """
+    map = kwargs.pop('_map', None)
+    if map is None:
+        map = _SOCKET_MAP
+    with _WAKERS_LOCK:
+        entry = _WAKERS.get(id(map))
+        if entry is None:
+            # map reference is kept to not let its id be reused
+            entry = _WAKERS[id(map)] = [map, deque(), None]
+        entry[1].append((callback, args, kwargs))
+        waker = entry[2]
+    if waker is not None:
+        waker.wakeup()
+
+
+def _get_waker(map):
+    # Returns wakeup channel of `map`. It's created by the first loop and
+    # stays within the map for the next ones while there are other channels,
+    # so stepping the loop doesn't create sockets every time.
+    with _WAKERS_LOCK:
+        entry = _WAKERS.get(id(map))
+        if entry is None:
+            entry = _WAKERS[id(map)] = [map, deque(), None]
+        waker = entry[2]
+        if waker is not None and map.get(waker._fileno) is waker:
+            return waker
+        waker = entry[2] = _Waker(entry[1], map)
+        if entry[1]:
+            waker.wakeup()
+        return waker
+
+
+def _stop_waker(map, waker):
+    with _WAKERS_LOCK:
+        entry = _WAKERS.get(id(map))
+        if entry is not None and entry[2] is waker:
+            entry[2] = None
+            if not entry[1]:
+                del _WAKERS[id(map)]
+    waker.close()
+
+
+def _has_channels(map, waker):
+    if waker is not None and map.get(waker._fileno) is waker:
+        return len(map) > 1
+    return bool(map)
+
+
+def find_prefix_at_end(haystack, needle, start=0, end=None):
+    if end is None:
+        end = len(haystack)
     l = len(needle) - 1
-    while l and not haystack.endswith(needle[:l]):
+    while l and not haystack.endswith(needle[:l], start, end):
         l -= 1
     return l
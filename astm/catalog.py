@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+"""Persistent secondary index of archived ASTM sessions.
+
+Catalog is a SQLite database which maps patient IDs, specimen barcodes and
+test codes to the numbers of archive sessions where they were met, and
+keeps Header record timestamp of every session::
+
+    catalog = Catalog('lis.catalog')
+    with CaptureReader('lis.capture') as reader:
+        catalog.update(reader)
+        for num in catalog.find('barcode', '0123456789'):
+            for message in reader.messages(num):
+                ...
+
+:meth:`Catalog.update` indexes only sessions that were added to archive
+since the last update. Keys are extracted from records by field paths in
+the same notation as for :mod:`astm.columnar`. Default paths follow the
+ASTM specification and they could be overridden for the specific instrument,
+e.g. for Mindray, which sends barcode as Instrument Specimen ID and within
+Query record :class:`~astm.mindray.server.Specimen`::
+
+    keys = dict(DEFAULT_KEYS, barcode=['O.4', 'Q.3.2'], test=['R.3.1'])
+    catalog = Catalog('lis.catalog', keys)
+
+Messages that couldn't be decoded are skipped and their errors are kept per
+session, see :meth:`Catalog.errors`.
+
+To index sessions as soon as the server stores them wrap the server sink by
+:class:`CatalogSink`::
+
+    catalog = Catalog('lis.catalog')
+    with BlockArchiveReader('lis.archive') as reader:
+        catalog.update(reader)
+    sink = CatalogSink(catalog, BlockArchiveWriter('lis.archive'))
+    server = Server(sink=sink)
+"""
+
+import logging
+from .codec import get_codec, get_header_delimiters, make_projection
+from .columnar import parse_path
+from .compat import unicode
+from .constants import ENCODING
+from .parallel import iter_messages
+
+try:
+    import sqlite3
+except ImportError:  # pragma: no cover
+    sqlite3 = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Catalog', 'CatalogSink', 'DEFAULT_KEYS']
+
+#: Default field paths of indexed keys.
+DEFAULT_KEYS = {
+    'patient_id': ['P.3'],
+    'barcode': ['O.3.1'],
+    'test': ['R.3.4'],
+}
+
+#: Header record message date and time field path.
+TIMESTAMP_PATH = 'H.14'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session INTEGER PRIMARY KEY,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_timestamp ON sessions (timestamp);
+CREATE TABLE IF NOT EXISTS keys (
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    PRIMARY KEY (name, value, session)
+);
+CREATE TABLE IF NOT EXISTS errors (
+    session INTEGER PRIMARY KEY,
+    error TEXT NOT NULL
+);
+'''
+
+
+class Catalog(object):
+    """SQLite backed index of archive sessions.
+
+    :param path: Database file path.
+    :type path: str
+
+    :param keys: Mapping of key name to the list of field paths to extract
+                 its values from.
+    :type keys: dict
+
+    :param encoding: Archived data encoding.
+    :type encoding: str
+    """
+
+    def __init__(self, path, keys=None, encoding=ENCODING):
+        if sqlite3 is None:
+            raise ImportError('sqlite3 is required')
+        self.path = path
+        self.keys = keys or DEFAULT_KEYS
+        self.encoding = encoding
+        self._paths = []
+        for name, paths in self.keys.items():
+            for field_path in paths:
+                rtype, field, component = parse_path(field_path)
+                self._paths.append((name, rtype.decode(), field, component))
+        rtype, field, component = parse_path(TIMESTAMP_PATH)
+        self._paths.append((None, rtype.decode(), field, component))
+        spec = {}
+        for name, rtype, field, component in self._paths:
+            spec.setdefault(rtype, set()).add(field)
+        self._projection = make_projection(spec)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        cursor = self._conn.execute('SELECT count(*) FROM sessions')
+        return cursor.fetchone()[0]
+
+    def close(self):
+        """Closes database connection."""
+        self._conn.close()
+
+    def update(self, reader):
+        """Indexes complete sessions of the archive that were added since
+        the last update.
+
+        :param reader: Archive reader.
+        :type reader: :class:`~astm.archive.BaseArchiveReader`
+
+        :returns: Number of indexed sessions.
+        :rtype: int
+        """
+        start = len(self)
+        stop = reader.closed_sessions_count
+        if stop < start:
+            raise ValueError('Catalog contains %d sessions, but archive has'
+                             ' only %d' % (start, stop))
+        with self._conn:
+            for num in range(start, stop):
+                self._index(num, reader.messages(num))
+        return stop - start
+
+    def add(self, data):
+        """Indexes raw session data from ENQ till EOT as the next archive
+        session.
+
+        :param data: Session data.
+        :type data: bytes
+
+        :returns: Session number.
+        :rtype: int
+        """
+        num = len(self)
+        with self._conn:
+            self._index(num, iter_messages(data))
+        return num
+
+    def find(self, name, value):
+        """Returns numbers of sessions which contains key value.
+
+        :param name: Key name.
+        :type name: str
+
+        :param value: Key value.
+        :type value: str
+
+        :rtype: list
+        """
+        cursor = self._conn.execute(
+            'SELECT session FROM keys WHERE name = ? AND value = ?'
+            ' ORDER BY session', (name, value))
+        return [row[0] for row in cursor]
+
+    def between(self, start=None, stop=None):
+        """Returns numbers of sessions which Header timestamp is within
+        range.
+
+        :param start: Start timestamp in ASTM format (``YYYYMMDDHHMMSS``),
+                      inclusive.
+        :type start: str
+
+        :param stop: Stop timestamp, exclusive.
+        :type stop: str
+
+        :rtype: list
+        """
+        query = 'SELECT session FROM sessions WHERE timestamp IS NOT NULL'
+        args = []
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            args.append(start)
+        if stop is not None:
+            query += ' AND timestamp < ?'
+            args.append(stop)
+        cursor = self._conn.execute(query + ' ORDER BY session', args)
+        return [row[0] for row in cursor]
+
+    def errors(self):
+        """Returns numbers of sessions which have messages that couldn't be
+        decoded with the first error of each.
+
+        :rtype: list
+        """
+        cursor = self._conn.execute('SELECT session, error FROM errors'
+                                    ' ORDER BY session')
+        return [tuple(row) for row in cursor]
+
+    def timestamp(self, num):
+        """Returns Header timestamp of the session."""
+        row = self._conn.execute('SELECT timestamp FROM sessions'
+                                 ' WHERE session = ?', (num,)).fetchone()
+        if row is None:
+            raise KeyError(num)
+        return row[0]
+
+    def _index(self, num, messages):
+        timestamp, keys, errors = self._extract(messages)
+        self._conn.execute('INSERT INTO sessions VALUES (?, ?)',
+                           (num, timestamp))
+        self._conn.executemany('INSERT OR IGNORE INTO keys VALUES (?, ?, ?)',
+                               ((name, value, num) for name, value in keys))
+        if errors:
+            log.warning('Session %d has %d broken messages: %s',
+                        num, len(errors), errors[0])
+            self._conn.execute('INSERT INTO errors VALUES (?, ?)',
+                               (num, errors[0]))
+
+    def _extract(self, messages):
+        codec = get_codec()
+        timestamp = None
+        keys = set()
+        errors = []
+        for message in messages:
+            try:
+                delimiters = get_header_delimiters(message)
+                if delimiters is not None:
+                    codec = get_codec(delimiters)
+                seq, records, cs = codec.decode_message(
+                    message, self.encoding, projection=self._projection)
+            except (AssertionError, ValueError) as err:
+                errors.append(str(err) or repr(err))
+                continue
+            for record in records:
+                for name, rtype, field, component in self._paths:
+                    if record[0] != rtype:
+                        continue
+                    value = _get_value(record, field, component)
+                    if value is None:
+                        continue
+                    if name is None:
+                        timestamp = timestamp or value
+                    else:
+                        keys.add((name, value))
+        return timestamp, keys, errors
+
+
+class CatalogSink(object):
+    """:class:`~astm.server.RequestHandler` sink which writes sessions to the
+    wrapped `sink` and indexes them by `catalog` at once. Catalog should be
+    up to date with the archive before, e.g. by :meth:`Catalog.update` call.
+
+    :param catalog: Catalog of the archive.
+    :type catalog: :class:`Catalog`
+
+    :param sink: Archive writer, e.g.
+                 :class:`~astm.archive.BlockArchiveWriter`.
+    """
+
+    def __init__(self, catalog, sink):
+        self.catalog = catalog
+        self.sink = sink
+
+    def write(self, data):
+        """Writes session data to the sink and indexes it. The sink is flushed
+        before indexing, so catalog never refers to sessions which are not
+        stored in the archive yet."""
+        self.sink.write(data)
+        self.flush()
+        self.catalog.add(data)
+
+    def flush(self):
+        """Flushes the sink."""
+        if hasattr(self.sink, 'flush'):
+            self.sink.flush()
+
+    def close(self):
+        """Closes the sink and the catalog."""
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+        self.catalog.close()
+
+
+def _get_value(record, field, component):
+    if field >= len(record):
+        return None
+    value = record[field]
+    if isinstance(value, list):
+        if value and isinstance(value[0], list):  # repeated field
+            value = value[0]
+        index = component or 0
+        value = value[index] if index < len(value) else None
+    elif component:
+        return None
+    return value if isinstance(value, unicode) else None
@@ -10,7 +10,7 @@
 import logging
 import socket
 from .asynclib import loop
-from .codec import encode
+from .codec import encode_into, iter_split
 from .constants import ENQ, EOT
 from .exceptions import NotAccepted
 from .mapping import Record
@@ -128,6 +128,16 @@ class Emitter(object):
             self.throw(type(err), err.args)
         return record
 
+    def _encode(self, records, seq):
+        if self.chunk_size is not None:
+            return list(iter_split(records, self.chunk_size, self.encoding,
+                                   seq))
+        # frame stays queued till it's sent, so it's pushed as is without
+        # copying instead of sharing single buffer between frames
+        buf = bytearray()
+        encode_into(buf, seq, records, self.encoding)
+        return [buf]
+
     def _send_record(self, record):
         if self.bulk_mode:
             records = [record]
@@ -136,11 +146,10 @@ class Emitter(object):
                 records.append(record)
                 if record[0] == 'L':
                     break
-            chunks = encode(records, self.encoding, self.chunk_size)
+            chunks = self._encode(records, 1)
         else:
             self.last_seq += 1
-            chunks = encode([record], self.encoding,
-                            self.chunk_size, self.last_seq)
+            chunks = self._encode([record], self.last_seq)
 
         self.buffer.extend(chunks)
         data = self.buffer.pop(0)
@@ -191,7 +200,87 @@ class Emitter(object):
         self._emitter.close()
 
 
-class Client(ASTMProtocol):
+class ClientMixIn(object):
+    """Drives the emitter of ASTM client by server responses. Shared by
+    :class:`Client` and :class:`astm.aio.client.Client`, which provide
+    transport specific :meth:`_close_session`."""
+
+    #: Wrapper of emitter to provide session context and system logic about
+    #: sending head and tail data.
+    emitter_wrapper = Emitter
+    _deferred_value = None
+
+    def _open_session(self):
+        self.push(ENQ)
+
+    def _close_session(self, close_connection=False):
+        raise NotImplementedError
+
+    def on_enq(self):
+        """Raises :class:`NotAccepted` exception."""
+        raise NotAccepted('Client should not receive ENQ.')
+
+    def on_ack(self):
+        """Handles ACK response from server.
+
+        Provides callback value :const:`True` to the emitter and sends next
+        message to server.
+        """
+        self._send_next(True)
+
+    def on_nak(self):
+        """Handles NAK response from server.
+
+        If it was received on ENQ request, the client tries to repeat last
+        request for allowed amount of attempts. For others it send callback
+        value :const:`False` to the emitter."""
+        if self._last_sent_data == ENQ:
+            return self.push(ENQ)
+
+        self._send_next(False)
+
+    def _send_next(self, value):
+        # don't pull records from the emitter while the outgoing queue is
+        # full, resume_writing() continues the session
+        if self.writing_paused:
+            self._deferred_value = value
+            return
+        try:
+            message = self.emitter.send(value)
+        except StopIteration:
+            self._close_session(True)
+        except Exception:
+            if not value:
+                self._close_session(True)
+            raise
+        else:
+            self.push(message)
+            if message == EOT:
+                self._open_session()
+
+    def resume_writing(self):
+        """Sends next message produced by the emitter if it was deferred
+        while the outgoing queue was full."""
+        super(ClientMixIn, self).resume_writing()
+        value, self._deferred_value = self._deferred_value, None
+        if value is not None:
+            self._send_next(value)
+
+    def on_eot(self):
+        """Raises :class:`NotAccepted` exception."""
+        raise NotAccepted('Client should not receive EOT.')
+
+    def on_message(self):
+        """Raises :class:`NotAccepted` exception."""
+        raise NotAccepted('Client should not receive ASTM message.')
+
+    def on_timeout(self):
+        """Sends final EOT message and closes connection after his receiving."""
+        super(ClientMixIn, self).on_timeout()
+        self._close_session(True)
+
+
+class Client(ClientMixIn, ASTMProtocol):
     """Common ASTM client implementation.
 
     :param emitter: Generator function that will produce ASTM records.
@@ -249,10 +338,6 @@ class Client(ASTMProtocol):
     ended by Terminator one) within limited time frame (commonly 10-15 sec.).
     """
 
-    #: Wrapper of emitter to provide session context and system logic about
-    #: sending head and tail data.
-    emitter_wrapper = Emitter
-
     def __init__(self, emitter, host='localhost', port=15200,
                  encoding=None, timeout=20, flow_map=DEFAULT_RECORDS_FLOW_MAP,
                  chunk_size=None, bulk_mode=False):
@@ -277,9 +362,6 @@ class Client(ASTMProtocol):
         self.emitter.close()
         super(Client, self).handle_close()
 
-    def _open_session(self):
-        self.push(ENQ)
-
     def _close_session(self, close_connection=False):
         self.push(EOT)
         if close_connection:
@@ -289,56 +371,3 @@ class Client(ASTMProtocol):
         """Enters into the :func:`polling loop <astm.asynclib.loop>` to let
         client send outgoing requests."""
         loop(timeout, *args, **kwargs)
-
-    def on_enq(self):
-        """Raises :class:`NotAccepted` exception."""
-        raise NotAccepted('Client should not receive ENQ.')
-
-    def on_ack(self):
-        """Handles ACK response from server.
-
-        Provides callback value :const:`True` to the emitter and sends next
-        message to server.
-        """
-        try:
-            message = self.emitter.send(True)
-        except StopIteration:
-            self._close_session(True)
-        else:
-            self.push(message)
-            if message == EOT:
-                self._open_session()
-
-    def on_nak(self):
-        """Handles NAK response from server.
-
-        If it was received on ENQ request, the client tries to repeat last
-        request for allowed amount of attempts. For others it send callback
-        value :const:`False` to the emitter."""
-        if self._last_sent_data == ENQ:
-            return self.push(ENQ)
-
-        try:
-            message = self.emitter.send(False)
-        except StopIteration:
-            self._close_session(True)
-        except Exception:
-            self._close_session(True)
-            raise
-        else:
-            self.push(message)
-            if message == EOT:
-                self._open_session()
-
-    def on_eot(self):
-        """Raises :class:`NotAccepted` exception."""
-        raise NotAccepted('Client should not receive EOT.')
-
-    def on_message(self):
-        """Raises :class:`NotAccepted` exception."""
-        raise NotAccepted('Client should not receive ASTM message.')
-
-    def on_timeout(self):
-        """Sends final EOT message and closes connection after his receiving."""
-        super(Client, self).on_timeout()
-        self._close_session(True)
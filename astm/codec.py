@@ -7,16 +7,13 @@
 # you should have received as part of this distribution.
 #
 
-from collections import Iterable
-from .compat import unicode
+import re
+from collections import Iterable, OrderedDict
+from .compat import b, unicode
 from .constants import (
-    STX, ETX, ETB, CR, LF, CRLF,
-    FIELD_SEP, COMPONENT_SEP, RECORD_SEP, REPEAT_SEP, ENCODING
+    STX, ETX, ETB, ENQ, ACK, NAK, EOT, CR, LF, CRLF,
+    FIELD_SEP, COMPONENT_SEP, RECORD_SEP, REPEAT_SEP, ESCAPE_SEP, ENCODING
 )
-try:
-    from itertools import izip_longest
-except ImportError:  # Python 3
-    from itertools import zip_longest as izip_longest
 
 
 def decode(data, encoding=ENCODING):
@@ -36,7 +33,7 @@ def decode(data, encoding=ENCODING):
     `encoding`.
 
     :param data: ASTM data object.
-    :type data: bytes
+    :type data: bytes or memoryview
 
     :param encoding: Data encoding.
     :type encoding: str
@@ -44,29 +41,32 @@ def decode(data, encoding=ENCODING):
     :return: List of ASTM records with unicode data.
     :rtype: list
     """
-    if not isinstance(data, bytes):
-        raise TypeError('bytes expected, got %r' % data)
-    if data.startswith(STX):  # may be decode message \x02...\x03CS\r\n
-        seq, records, cs = decode_message(data, encoding)
-        return records
-    byte = data[:1].decode()
-    if  byte.isdigit():
-        seq, records = decode_frame(data, encoding)
-        return records
-    return [decode_record(data, encoding)]
+    return _DEFAULT_CODEC.decode(data, encoding)
 
 
-def decode_message(message, encoding):
+def decode_message(message, encoding, lazy=False, cache=None,
+                   projection=None):
     """Decodes complete ASTM message that is sent or received due
     communication routines. It should contains checksum that would be
     additionally verified.
 
     :param message: ASTM message.
-    :type message: bytes
+    :type message: bytes or memoryview
 
     :param encoding: Data encoding.
     :type encoding: str
 
+    :param lazy: Return records as :class:`LazyRecord` views instead of lists.
+    :type lazy: bool
+
+    :param cache: Cache to share decoded values of repeated fields.
+    :type cache: :class:`InternCache`
+
+    :param projection: Record types and field indexes to decode. See
+                       :func:`make_projection`. Checksum is verified for the
+                       whole message anyway.
+    :type projection: dict
+
     :returns: Tuple of three elements:
 
         * :class:`int` frame sequence number.
@@ -77,64 +77,765 @@ def decode_message(message, encoding):
         * :exc:`ValueError` if ASTM message is malformed.
         * :exc:`AssertionError` if checksum verification fails.
     """
-    if not isinstance(message, bytes):
-        raise TypeError('bytes expected, got %r' % message)
-    if not (message.startswith(STX) and message.endswith(CRLF)):
-        raise ValueError('Malformed ASTM message. Expected that it will started'
-                         ' with %x and followed by %x%x characters. Got: %r'
-                         ' ' % (ord(STX), ord(CR), ord(LF), message))
-    stx, frame_cs = message[0], message[1:-2]
-    frame, cs = frame_cs[:-2], frame_cs[-2:]
-    ccs = make_checksum(frame)
-    assert cs == ccs, 'Checksum failure: expected %r, calculated %r' % (cs, ccs)
-    seq, records = decode_frame(frame, encoding)
-    return seq, records, cs.decode()
-
-
-def decode_frame(frame, encoding):
-    """Decodes ASTM frame: list of records followed by sequence number."""
-    if not isinstance(frame, bytes):
-        raise TypeError('bytes expected, got %r' % frame)
-    if frame.endswith(CR + ETX):
-        frame = frame[:-2]
-    elif frame.endswith(ETB):
-        frame = frame[:-1]
-    else:
-        raise ValueError('Incomplete frame data %r.'
-                         ' Expected trailing <CR><ETX> or <ETB> chars' % frame)
-    seq = frame[:1].decode()
-    if not seq.isdigit():
-        raise ValueError('Malformed ASTM frame. Expected leading seq number %r'
-                         '' % frame)
-    seq, records = int(seq), frame[1:]
-    return seq, [decode_record(record, encoding)
-                 for record in records.split(RECORD_SEP)]
-
-
-def decode_record(record, encoding):
+    return _DEFAULT_CODEC.decode_message(message, encoding, lazy, cache,
+                                         projection)
+
+
+def decode_frame(frame, encoding, lazy=False, cache=None, projection=None):
+    """Decodes ASTM frame: list of records followed by sequence number.
+
+    If `lazy` is :const:`True` records are returned as :class:`LazyRecord`
+    views over the `frame` data. If `cache` is specified, values are decoded
+    through it. If `projection` is specified, records of other types are
+    skipped and only projected fields are decoded.
+    """
+    return _DEFAULT_CODEC.decode_frame(frame, encoding, lazy, cache,
+                                       projection)
+
+
+class _Projection(dict):
+    """Normalized projection, so it's not normalized again on decoding."""
+
+
+def make_projection(spec):
+    """Makes projection that defines which records and fields should be
+    decoded.
+
+    :param spec: Mapping of record type to list of field indexes to decode.
+                 Indexes are the same as for decoded record list, record type
+                 field is always decoded. :const:`None` instead of indexes
+                 means the whole record. Records of types that are not in
+                 mapping are skipped.
+    :type spec: dict
+
+    :returns: Normalized projection mapping.
+    :rtype: dict
+    """
+    projection = _Projection()
+    for rtype, fields in spec.items():
+        if fields is not None:
+            fields = frozenset(fields) | frozenset([0])
+        projection[b(rtype)] = fields
+    return projection
+
+
+def decode_record(record, encoding, cache=None):
     """Decodes ASTM record message."""
-    fields = []
-    for item in record.split(FIELD_SEP):
-        if REPEAT_SEP in item:
-            item = decode_repeated_component(item, encoding)
-        elif COMPONENT_SEP in item:
-            item = decode_component(item, encoding)
-        else:
-            item = item.decode(encoding)
-        fields.append([None, item][bool(item)])
-    return fields
+    return _DEFAULT_CODEC.decode_record(record, encoding, cache)
 
 
-def decode_component(field, encoding):
+def decode_component(field, encoding, cache=None):
     """Decodes ASTM field component."""
-    return [[None, item.decode(encoding)][bool(item)]
-            for item in field.split(COMPONENT_SEP)]
+    return _DEFAULT_CODEC.decode_component(field, encoding, cache)
 
 
-def decode_repeated_component(component, encoding):
+def decode_repeated_component(component, encoding, cache=None):
     """Decodes ASTM field repeated component."""
-    return [decode_component(item, encoding)
-            for item in component.split(REPEAT_SEP)]
+    return _DEFAULT_CODEC.decode_repeated_component(component, encoding,
+                                                    cache)
+
+
+class Codec(object):
+    r"""ASTM codec for the specific set of delimiters.
+
+    ASTM Header record defines delimiters used within the session by his
+    second field, e.g. ``H|\^&|...``. The codec is built for such definition
+    and decodes and encodes data with these delimiters directly, so there is
+    no need to replace them with the default ones before decoding. Module
+    level functions use the codec for the default delimiters.
+
+    Use :func:`get_codec` to get codec instance: it caches them per
+    delimiters set.
+
+    :param delimiters: Delimiters definition: field, repeat, component and
+                       escape delimiters in this order. If :const:`None` the
+                       default ones are used.
+    :type delimiters: bytes
+
+    :raises: :exc:`ValueError` if delimiters definition is invalid.
+    """
+
+    def __init__(self, delimiters=None):
+        if delimiters is None:
+            delimiters = DEFAULT_DELIMITERS
+        if not isinstance(delimiters, bytes):
+            raise TypeError('bytes expected, got %r' % delimiters)
+        seps = [delimiters[idx:idx + 1] for idx in range(len(delimiters))]
+        if len(seps) != 4 or len(set(seps)) != 4:
+            raise ValueError('Invalid delimiters definition %r: four unique'
+                             ' delimiters expected' % delimiters)
+        for sep in seps:
+            if sep.isalnum() or sep in (STX, ETX, ETB, CR, LF, RECORD_SEP):
+                raise ValueError('Invalid delimiters definition %r: %r could'
+                                 ' not be used as delimiter'
+                                 '' % (delimiters, sep))
+        self.delimiters = delimiters
+        #: Record fields delimiter.
+        self.field_sep = seps[0]
+        #: Delimiter for repeated fields.
+        self.repeat_sep = seps[1]
+        #: Field components delimiter.
+        self.component_sep = seps[2]
+        #: Escape delimiter.
+        self.escape_sep = seps[3]
+        # precompiled joins for encoding
+        self._join_fields = self.field_sep.join
+        self._join_components = self.component_sep.join
+        self._join_repeats = self.repeat_sep.join
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.delimiters)
+
+    def __reduce__(self):
+        return get_codec, (self.delimiters,)
+
+    def decode(self, data, encoding=ENCODING):
+        """Same as :func:`decode`, but uses codec delimiters."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not isinstance(data, bytes):
+            raise TypeError('bytes expected, got %r' % data)
+        if data.startswith(STX):  # may be decode message \x02...\x03CS\r\n
+            seq, records, cs = self.decode_message(data, encoding)
+            return records
+        byte = data[:1].decode()
+        if  byte.isdigit():
+            seq, records = self.decode_frame(data, encoding)
+            return records
+        return [self.decode_record(data, encoding)]
+
+    def decode_message(self, message, encoding, lazy=False, cache=None,
+                       projection=None):
+        """Same as :func:`decode_message`, but uses codec delimiters."""
+        if isinstance(message, memoryview):
+            message = message.tobytes()
+        if not isinstance(message, bytes):
+            raise TypeError('bytes expected, got %r' % message)
+        if not (message.startswith(STX) and message.endswith(CRLF)):
+            raise ValueError('Malformed ASTM message. Expected that it will'
+                             ' started with %x and followed by %x%x'
+                             ' characters. Got: %r'
+                             ' ' % (ord(STX), ord(CR), ord(LF), message))
+        stx, frame_cs = message[0], message[1:-2]
+        frame, cs = frame_cs[:-2], frame_cs[-2:]
+        ccs = make_checksum(frame)
+        assert cs == ccs, ('Checksum failure: expected %r, calculated %r'
+                           '' % (cs, ccs))
+        seq, records = self.decode_frame(frame, encoding, lazy, cache,
+                                         projection)
+        return seq, records, cs.decode()
+
+    def decode_frame(self, frame, encoding, lazy=False, cache=None,
+                     projection=None):
+        """Same as :func:`decode_frame`, but uses codec delimiters."""
+        if isinstance(frame, memoryview):
+            frame = frame.tobytes()
+        if not isinstance(frame, bytes):
+            raise TypeError('bytes expected, got %r' % frame)
+        if frame.endswith(CR + ETX):
+            frame = frame[:-2]
+        elif frame.endswith(ETB):
+            frame = frame[:-1]
+        else:
+            raise ValueError('Incomplete frame data %r.'
+                             ' Expected trailing <CR><ETX> or <ETB> chars'
+                             '' % frame)
+        seq = frame[:1].decode()
+        if not seq.isdigit():
+            raise ValueError('Malformed ASTM frame. Expected leading seq'
+                             ' number %r' % frame)
+        if projection is not None:
+            if not isinstance(projection, _Projection):
+                projection = make_projection(projection)
+            return int(seq), self._decode_projected(frame, encoding, lazy,
+                                                    cache, projection)
+        if lazy:
+            return int(seq), self._make_lazy_records(frame, encoding, cache)
+        seq, records = int(seq), frame[1:]
+        return seq, [self.decode_record(record, encoding, cache)
+                     for record in records.split(RECORD_SEP)]
+
+    def decode_record(self, record, encoding, cache=None):
+        """Same as :func:`decode_record`, but uses codec delimiters."""
+        field_sep = self.field_sep
+        repeat_sep = self.repeat_sep
+        component_sep = self.component_sep
+        fields = []
+        for item in record.split(field_sep):
+            if repeat_sep in item:
+                item = self.decode_repeated_component(item, encoding, cache)
+            elif component_sep in item:
+                item = self.decode_component(item, encoding, cache)
+            elif cache is not None:
+                item = cache.decode(item, encoding)
+            else:
+                item = item.decode(encoding)
+            fields.append([None, item][bool(item)])
+        return fields
+
+    def decode_component(self, field, encoding, cache=None):
+        """Same as :func:`decode_component`, but uses codec delimiters."""
+        if cache is not None:
+            decode = cache.decode
+            return [[None, decode(item, encoding)][bool(item)]
+                    for item in field.split(self.component_sep)]
+        return [[None, item.decode(encoding)][bool(item)]
+                for item in field.split(self.component_sep)]
+
+    def decode_repeated_component(self, component, encoding, cache=None):
+        """Same as :func:`decode_repeated_component`, but uses codec
+        delimiters."""
+        return [self.decode_component(item, encoding, cache)
+                for item in component.split(self.repeat_sep)]
+
+    def _decode_field(self, item, encoding, cache=None):
+        if self.repeat_sep in item:
+            item = self.decode_repeated_component(item, encoding, cache)
+        elif self.component_sep in item:
+            item = self.decode_component(item, encoding, cache)
+        elif cache is not None:
+            item = cache.decode(item, encoding)
+        else:
+            item = item.decode(encoding)
+        return [None, item][bool(item)]
+
+    def _decode_projected(self, frame, encoding, lazy, cache, projection):
+        records = []
+        pos, stop = 1, len(frame)  # skip seq number
+        while pos <= stop:
+            idx = frame.find(RECORD_SEP, pos)
+            if idx == -1:
+                idx = stop
+            rtype = frame[pos:pos + 1]
+            if rtype in projection:
+                fields = projection[rtype]
+                if lazy:
+                    records.append(LazyRecord(frame, encoding, pos, idx, self,
+                                              cache))
+                elif fields is None:
+                    records.append(self.decode_record(frame[pos:idx],
+                                                      encoding, cache))
+                else:
+                    record = frame[pos:idx].split(self.field_sep)
+                    for index, item in enumerate(record):
+                        if index in fields:
+                            record[index] = self._decode_field(item, encoding,
+                                                               cache)
+                        else:
+                            record[index] = None
+                    records.append(record)
+            pos = idx + 1
+        return records
+
+    def _make_lazy_records(self, frame, encoding, cache=None):
+        records = []
+        pos, stop = 1, len(frame)  # skip seq number
+        while True:
+            idx = frame.find(RECORD_SEP, pos)
+            if idx == -1:
+                records.append(LazyRecord(frame, encoding, pos, stop, self,
+                                          cache))
+                return records
+            records.append(LazyRecord(frame, encoding, pos, idx, self, cache))
+            pos = idx + 1
+
+    def encode(self, records, encoding=ENCODING, size=None, seq=1):
+        """Same as :func:`encode`, but uses codec delimiters."""
+        if size is not None:
+            return list(self.iter_split(records, size, encoding, seq))
+        return [self.encode_message(seq, records, encoding)]
+
+    def iter_encode(self, records, encoding=ENCODING, size=None, seq=1):
+        """Same as :func:`iter_encode`, but uses codec delimiters."""
+        for record in records:
+            msg = self.encode_message(seq, [record], encoding)
+            if size is not None and len(msg) > size:
+                for chunk in split(msg, size):
+                    seq += 1
+                    yield chunk
+            else:
+                seq += 1
+                yield msg
+
+    def encode_message(self, seq, records, encoding):
+        """Same as :func:`encode_message`, but uses codec delimiters."""
+        data = RECORD_SEP.join(self.encode_record(record, encoding)
+                               for record in records)
+        data = b''.join((str(seq % 8).encode(), data, CR, ETX))
+        return b''.join([STX, data, make_checksum(data), CR, LF])
+
+    def encode_into(self, buf, seq, records, encoding, offset=0):
+        """Same as :func:`encode_into`, but uses codec delimiters."""
+        if isinstance(buf, bytearray):
+            start = len(buf)
+            write = buf.extend
+        else:
+            pos = [offset]
+            def write(data):
+                buf[pos[0]:pos[0] + len(data)] = data
+                pos[0] += len(data)
+        checksum = Checksum()
+        write(STX)
+        data = _SEQ_NUMBERS[seq % 8]
+        write(data)
+        checksum.update(data)
+        for idx, record in enumerate(records):
+            if idx:
+                write(RECORD_SEP)
+                checksum.update(RECORD_SEP)
+            data = self.encode_record(record, encoding)
+            write(data)
+            checksum.update(data)
+        write(CR + ETX)
+        checksum.update(CR + ETX)
+        write(checksum.digest())
+        write(CRLF)
+        if isinstance(buf, bytearray):
+            return len(buf) - start
+        return pos[0] - offset
+
+    def iter_split(self, records, size, encoding=ENCODING, seq=1):
+        """Same as :func:`iter_split`, but uses codec delimiters."""
+        assert size is not None and size >= 7
+        step = size - 7
+        buf = bytearray()
+        for idx, record in enumerate(records):
+            if idx:
+                buf += RECORD_SEP
+            buf += self.encode_record(record, encoding)
+            if len(buf) > step:
+                last = (len(buf) - 1) // step * step
+                for offset in range(0, last, step):
+                    yield _make_chunk(seq, bytes(buf[offset:offset + step]),
+                                      ETB)
+                    seq += 1
+                del buf[:last]
+        yield _make_chunk(seq, bytes(buf), CR + ETX)
+
+    def encode_record(self, record, encoding):
+        """Same as :func:`encode_record`, but uses codec delimiters."""
+        fields = []
+        _append = fields.append
+        for field in record:
+            if isinstance(field, bytes):
+                _append(field)
+            elif isinstance(field, unicode):
+                _append(field.encode(encoding))
+            elif isinstance(field, Iterable):
+                _append(self.encode_component(field, encoding))
+            elif field is None:
+                _append(b'')
+            else:
+                _append(unicode(field).encode(encoding))
+        return self._join_fields(fields)
+
+    def encode_component(self, component, encoding):
+        """Same as :func:`encode_component`, but uses codec delimiters."""
+        items = []
+        _append = items.append
+        for item in component:
+            if isinstance(item, bytes):
+                _append(item)
+            elif isinstance(item, unicode):
+                _append(item.encode(encoding))
+            elif isinstance(item, Iterable):
+                return self.encode_repeated_component(component, encoding)
+            elif item is None:
+                _append(b'')
+            else:
+                _append(unicode(item).encode(encoding))
+
+        return self._join_components(items).rstrip(self.component_sep)
+
+    def encode_repeated_component(self, components, encoding):
+        """Same as :func:`encode_repeated_component`, but uses codec
+        delimiters."""
+        return self._join_repeats(self.encode_component(item, encoding)
+                                  for item in components)
+
+
+#: Default delimiters definition.
+DEFAULT_DELIMITERS = FIELD_SEP + REPEAT_SEP + COMPONENT_SEP + ESCAPE_SEP
+
+_CODECS = {}
+
+
+def get_codec(delimiters=None):
+    """Returns :class:`Codec` instance for the specified delimiters definition.
+    Codecs are created once and cached per delimiters set.
+
+    :param delimiters: Delimiters definition. If :const:`None` the default
+                       ones are used.
+    :type delimiters: bytes
+
+    :rtype: :class:`Codec`
+    """
+    if delimiters is None:
+        delimiters = DEFAULT_DELIMITERS
+    try:
+        return _CODECS[delimiters]
+    except KeyError:
+        codec = _CODECS[delimiters] = Codec(delimiters)
+        return codec
+
+
+def get_header_delimiters(message):
+    """Extracts delimiters definition from the message that starts with ASTM
+    Header record. Returns :const:`None` if the message has no Header record.
+
+    :param message: ASTM message.
+    :type message: bytes
+
+    :rtype: bytes
+    """
+    if message[2:3] == b'H':
+        return message[3:7]
+
+
+_DEFAULT_CODEC = get_codec()
+
+
+class LazyRecord(object):
+    """Lazy view of ASTM record over the original frame data.
+
+    On creation it only lookups for the fields offsets. Field value is decoded
+    on first access by index and cached then, so the fields that are never
+    used are never decoded. Decoded values are the same as
+    :func:`decode_record` produces and the view compares equal to the list
+    returned by it::
+
+        >>> record = LazyRecord(b'R|1|^^^GLU|5.4|mmol/L', 'ascii')
+        >>> record[0], record[3]
+        ('R', '5.4')
+        >>> record == decode_record(b'R|1|^^^GLU|5.4|mmol/L', 'ascii')
+        True
+
+    :param data: Data that contains record.
+    :type data: bytes or bytearray
+
+    :param encoding: Data encoding.
+    :type encoding: str
+
+    :param start: Record start offset within `data`.
+    :type start: int
+
+    :param stop: Record end offset within `data`. If :const:`None` the record
+                 ends with the `data`.
+    :type stop: int
+
+    :param codec: Codec to decode fields with. If :const:`None` the default
+                  one is used.
+    :type codec: :class:`Codec`
+
+    :param cache: Cache to share decoded values of repeated fields.
+    :type cache: :class:`InternCache`
+    """
+
+    __slots__ = ('_data', '_encoding', '_offsets', '_values', '_codec',
+                 '_cache')
+
+    def __init__(self, data, encoding, start=0, stop=None, codec=None,
+                 cache=None):
+        if codec is None:
+            codec = _DEFAULT_CODEC
+        if stop is None:
+            stop = len(data)
+        # offsets of fields separators, including imaginary ones around record
+        offsets = [start - 1]
+        _append = offsets.append
+        find = data.find
+        field_sep = codec.field_sep
+        pos = find(field_sep, start, stop)
+        while pos != -1:
+            _append(pos)
+            pos = find(field_sep, pos + 1, stop)
+        _append(stop)
+        self._data = data
+        self._encoding = encoding
+        self._offsets = offsets
+        self._values = {}
+        self._codec = codec
+        self._cache = cache
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        size = len(self._offsets) - 1
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('record field index out of range')
+        values = self._values
+        if index not in values:
+            offsets = self._offsets
+            item = self._data[offsets[index] + 1:offsets[index + 1]]
+            values[index] = self._codec._decode_field(item, self._encoding,
+                                                      self._cache)
+        return values[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyRecord, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<LazyRecord %r>' % list(self)
+
+    def to_list(self):
+        """Decodes all the record fields and returns them as list."""
+        return list(self)
+
+
+class InternCache(object):
+    """Size-capped cache of decoded field values keyed by their raw bytes.
+
+    Same assay codes, units, instrument names and flags are repeated within
+    every result record. When records are decoded through the cache, each
+    such value is decoded once and then the same string object is shared by
+    all the records instead of creating new one for each of them::
+
+        cache = InternCache(1024)
+        seq, records, cs = decode_message(message, 'latin-1', cache=cache)
+
+    When cache is full, the least recently used values are evicted. Since
+    values are keyed by raw bytes, single cache should be used with single
+    encoding.
+
+    :param maxsize: Maximum number of cached values.
+    :type maxsize: int
+
+    :param max_length: Values longer than this number of bytes are not cached
+                       since free text values are rarely repeated.
+    :type max_length: int
+    """
+
+    def __init__(self, maxsize=1024, max_length=64):
+        self.maxsize = maxsize
+        self.max_length = max_length
+        #: Number of values taken from the cache.
+        self.hits = 0
+        #: Number of values that were not found in the cache.
+        self.misses = 0
+        self._values = OrderedDict()
+        # OrderedDict.move_to_end is missing on Python 2
+        self._move_to_end = getattr(self._values, 'move_to_end',
+                                    self._reinsert)
+
+    def __len__(self):
+        return len(self._values)
+
+    def decode(self, raw, encoding):
+        """Decodes `raw` bytes with `encoding` returning cached value if it's
+        available."""
+        try:
+            value = self._values[raw]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._move_to_end(raw)
+            return value
+        self.misses += 1
+        value = raw.decode(encoding)
+        if len(raw) <= self.max_length:
+            if len(self._values) >= self.maxsize:
+                self._values.popitem(last=False)
+            self._values[raw] = value
+        return value
+
+    def _reinsert(self, raw):
+        self._values[raw] = self._values.pop(raw)
+
+    @property
+    def hit_rate(self):
+        """Ratio of lookups that were served from the cache."""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        """Returns cache usage statistics.
+
+        :rtype: dict
+        """
+        return {'size': len(self._values), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate}
+
+    def clear(self):
+        """Drops all cached values and resets statistics."""
+        self._values.clear()
+        self.hits = self.misses = 0
+
+
+#: Lookup pattern for the message frame end: <ETX> or <ETB> byte.
+_FRAME_END_RE = re.compile(b'[' + ETX + ETB + b']')
+
+
+def find_frame_end(data, pos, end=None):
+    """Looks for the end of ASTM frame within ``data[pos:end]``. Shared by
+    stream scanners, so frames are delimited the same way everywhere.
+
+    :param data: ASTM byte stream.
+    :type data: bytes, :class:`bytearray` or :class:`mmap.mmap`
+
+    :param pos: Position to start lookup from, commonly the frame ``STX``.
+    :type pos: int
+
+    :param end: Position to look for the frame end till.
+    :type end: int
+
+    :return: Tuple of the frame end position, including checksum and CRLF,
+             and flag whether the frame is the last one of the message:
+             ended by ``ETX`` rather than ``ETB``. :const:`None` if there is
+             no ``ETX`` or ``ETB`` byte. Returned position may be greater
+             than `end` if the frame tail is not received yet.
+    :rtype: tuple
+    """
+    if end is None:
+        match = _FRAME_END_RE.search(data, pos)
+    else:
+        match = _FRAME_END_RE.search(data, pos, end)
+    if match is None:
+        return None
+    return match.end() + 4, match.group() == ETX  # checksum and CRLF
+
+
+#: Control characters that are emitted by :class:`StreamDecoder` as is.
+_CONTROL_CHARS = dict((ord(c), c) for c in (ENQ, ACK, NAK, EOT))
+_STX = ord(STX)
+
+
+class StreamDecoder(object):
+    """Incremental decoder of raw ASTM data stream.
+
+    Unlike :func:`decode_message` it doesn't expect complete messages: it may
+    be fed by arbitrary slices of bytes as they come from the socket or
+    capture file and returns decoded items as soon as the complete
+    ``STX ... CRLF`` units are available. Received data is scanned only once::
+
+        decoder = StreamDecoder()
+        for data in iter(lambda: fobj.read(4096), b''):
+            for item in decoder.feed(data):
+                ...
+
+    Control characters (``ENQ``, ``ACK``, ``NAK`` and ``EOT``) are emitted
+    as is, while messages are emitted as ``(seq, records, checksum)`` tuples,
+    just like :func:`decode_message` returns them. Chunked messages are
+    collected and emitted as single one after the last chunk receiving.
+    Bytes that are out of any message or control character are ignored.
+
+    :param encoding: Data encoding.
+    :type encoding: str
+
+    :param codec: Codec to decode messages with. If :const:`None` the default
+                  one is used.
+    :type codec: :class:`Codec`
+    """
+
+    def __init__(self, encoding=ENCODING, codec=None):
+        self.encoding = encoding
+        #: Codec to decode messages with.
+        self.codec = codec or _DEFAULT_CODEC
+        self._buffer = bytearray()
+        # position to continue lookup of pending message end from
+        self._scan_pos = 0
+        self._chunks = []
+        self._pending = []
+
+    def feed(self, data):
+        """Feeds `data` to the decoder.
+
+        If some message fails checksum verification or is malformed, the
+        related exception is raised after the whole message is consumed, so
+        decoder remains usable. Items that were decoded before the failure
+        are returned by next :meth:`feed` call.
+
+        :param data: Raw ASTM data.
+        :type data: bytes
+
+        :return: List of decoded items.
+        :rtype: list
+
+        :raises:
+            * :exc:`ValueError` if ASTM message is malformed.
+            * :exc:`AssertionError` if checksum verification fails.
+        """
+        buf = self._buffer
+        buf.extend(data)
+        items, self._pending = self._pending, []
+        pos, end = 0, len(buf)
+        try:
+            while pos < end:
+                byte = buf[pos]
+                if byte != _STX:
+                    if byte in _CONTROL_CHARS:
+                        items.append(_CONTROL_CHARS[byte])
+                    pos += 1
+                    continue
+                frame = find_frame_end(buf, pos + 1 + self._scan_pos)
+                if frame is None:
+                    self._scan_pos = end - pos - 1
+                    break
+                tail = frame[0]
+                if tail > end:
+                    # rescan from the frame terminator
+                    self._scan_pos = tail - 5 - pos - 1
+                    break
+                message, pos = bytes(buf[pos:tail]), tail
+                self._scan_pos = 0
+                item = self._decode(message)
+                if item is not None:
+                    items.append(item)
+        except Exception:
+            self._pending = items
+            raise
+        finally:
+            del buf[:pos]
+        return items
+
+    def _decode(self, message):
+        if not message.endswith(CRLF):
+            self._chunks = []
+            raise ValueError('Malformed ASTM message. Expected that it will'
+                             ' be followed by %x%x characters. Got: %r'
+                             '' % (ord(CR), ord(LF), message))
+        frame, cs = message[1:-4], message[-4:-2]
+        ccs = make_checksum(frame)
+        if cs != ccs:
+            self._chunks = []
+            raise AssertionError('Checksum failure: expected %r, calculated %r'
+                                 '' % (cs, ccs))
+        if frame.endswith(ETB):
+            self._chunks.append(frame[:-1])
+            return None
+        if self._chunks:
+            chunks, self._chunks = self._chunks, []
+            frame = b''.join([chunks[0]] + [c[1:] for c in chunks[1:]] +
+                             [frame[1:]])
+        seq, records = self.codec.decode_frame(frame, self.encoding)
+        return seq, records, cs.decode()
+
+    def reset(self):
+        """Drops all the buffered data and collected chunks."""
+        del self._buffer[:]
+        self._scan_pos = 0
+        self._chunks = []
+        self._pending = []
 
 
 def encode(records, encoding=ENCODING, size=None, seq=1):
@@ -162,10 +863,7 @@ def encode(records, encoding=ENCODING, size=None, seq=1):
     :return: List of ASTM message chunks.
     :rtype: list
     """
-    msg = encode_message(seq, records, encoding)
-    if size is not None and len(msg) > size:
-        return list(split(msg, size))
-    return [msg]
+    return _DEFAULT_CODEC.encode(records, encoding, size, seq)
 
 
 def iter_encode(records, encoding=ENCODING, size=None, seq=1):
@@ -177,15 +875,7 @@ def iter_encode(records, encoding=ENCODING, size=None, seq=1):
     :yields: ASTM message chunks.
     :rtype: str
     """
-    for record in records:
-        msg = encode_message(seq, [record], encoding)
-        if size is not None and len(msg) > size:
-            for chunk in split(msg, size):
-                seq += 1
-                yield chunk
-        else:
-            seq += 1
-            yield msg
+    return _DEFAULT_CODEC.iter_encode(records, encoding, size, seq)
 
 
 def encode_message(seq, records, encoding):
@@ -203,10 +893,43 @@ def encode_message(seq, records, encoding):
     :return: ASTM complete message with checksum and other control characters.
     :rtype: str
     """
-    data = RECORD_SEP.join(encode_record(record, encoding)
-                           for record in records)
-    data = b''.join((str(seq % 8).encode(), data, CR, ETX))
-    return b''.join([STX, data, make_checksum(data), CR, LF])
+    return _DEFAULT_CODEC.encode_message(seq, records, encoding)
+
+
+def encode_into(buf, seq, records, encoding, offset=0):
+    """Encodes ASTM message directly into the `buf` instead of creating new
+    bytes object for it. This allows to reuse single buffer for all messages
+    of the connection.
+
+    The result is the same as :func:`encode_message` returns. Each record is
+    encoded by :func:`encode_record` and written into the buffer with
+    the message control characters and the checksum, that is calculated
+    while data is written.
+
+    :param buf: Target buffer. Message is appended to :class:`bytearray`
+                buffer, while for :class:`memoryview` it is written starting
+                from the `offset`.
+    :type buf: bytearray or memoryview
+
+    :param seq: Frame sequence number.
+    :type seq: int
+
+    :param records: List of ASTM records.
+    :type records: list
+
+    :param encoding: Data encoding.
+    :type encoding: str
+
+    :param offset: Write position within :class:`memoryview` buffer.
+    :type offset: int
+
+    :return: Number of written bytes.
+    :rtype: int
+
+    :raises: :exc:`ValueError` if :class:`memoryview` buffer has not enough
+             space for the message.
+    """
+    return _DEFAULT_CODEC.encode_into(buf, seq, records, encoding, offset)
 
 
 def encode_record(record, encoding):
@@ -223,45 +946,23 @@ def encode_record(record, encoding):
     :returns: Encoded ASTM record.
     :rtype: str
     """
-    fields = []
-    _append = fields.append
-    for field in record:
-        if isinstance(field, bytes):
-            _append(field)
-        elif isinstance(field, unicode):
-            _append(field.encode(encoding))
-        elif isinstance(field, Iterable):
-            _append(encode_component(field, encoding))
-        elif field is None:
-            _append(b'')
-        else:
-            _append(unicode(field).encode(encoding))
-    return FIELD_SEP.join(fields)
+    return _DEFAULT_CODEC.encode_record(record, encoding)
 
 
 def encode_component(component, encoding):
     """Encodes ASTM record field components."""
-    items = []
-    _append = items.append
-    for item in component:
-        if isinstance(item, bytes):
-            _append(item)
-        elif isinstance(item, unicode):
-            _append(item.encode(encoding))
-        elif isinstance(item, Iterable):
-            return encode_repeated_component(component, encoding)
-        elif item is None:
-            _append(b'')
-        else:
-            _append(unicode(item).encode(encoding))
-
-    return COMPONENT_SEP.join(items).rstrip(COMPONENT_SEP)
+    return _DEFAULT_CODEC.encode_component(component, encoding)
 
 
 def encode_repeated_component(components, encoding):
     """Encodes repeated components."""
-    return REPEAT_SEP.join(encode_component(item, encoding)
-                           for item in components)
+    return _DEFAULT_CODEC.encode_repeated_component(components, encoding)
+
+
+#: Precomputed two-byte hex forms of all possible checksum values.
+_CHECKSUM_TABLE = tuple(('%02X' % value).encode() for value in range(256))
+#: Reversed :data:`_CHECKSUM_TABLE` lookup for the hex digits.
+_HEX_DIGITS = dict((ord(c), int(c, 16)) for c in '0123456789ABCDEF')
 
 
 def make_checksum(message):
@@ -275,13 +976,112 @@ def make_checksum(message):
     """
     if not isinstance(message[0], int):
         message = map(ord, message)
-    return hex(sum(message) & 0xFF)[2:].upper().zfill(2).encode()
+    return _CHECKSUM_TABLE[sum(message) & 0xFF]
+
+
+class Checksum(object):
+    """Running checksum which could be updated incrementally as data arrives.
+
+    :param data: Initial data.
+    :type data: bytes
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, data=None):
+        #: Current checksum value as integer.
+        self.value = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """Updates checksum with `data` bytes."""
+        if data and not isinstance(data[0], int):
+            data = map(ord, data)
+        self.value = (self.value + sum(data)) & 0xFF
+
+    def digest(self):
+        """Returns checksum value in same form as :func:`make_checksum` does.
+
+        :rtype: bytes
+        """
+        return _CHECKSUM_TABLE[self.value]
+
+    def copy(self):
+        """Returns copy of the checksum object."""
+        obj = type(self)()
+        obj.value = self.value
+        return obj
+
+    def reset(self):
+        """Resets checksum value."""
+        self.value = 0
+
+
+def verify_many(messages, use_numpy=None):
+    """Verifies checksums of the many complete ASTM messages at once.
+
+    If NumPy is available all the messages are checked with single vectorized
+    pass, otherwise they are verified one by one.
+
+    :param messages: Complete ASTM messages, started by STX and followed by
+                     checksum and CRLF.
+    :type messages: list
+
+    :param use_numpy: Whether NumPy should be used. If :const:`None` it will be
+                      used if available.
+    :type use_numpy: bool
+
+    :return: List of verification results for each message.
+    :rtype: list
+    """
+    if use_numpy is None or use_numpy:
+        try:
+            import numpy
+        except ImportError:
+            if use_numpy:
+                raise
+            numpy = None
+        if numpy is not None and messages:
+            return _verify_many_numpy(numpy, messages)
+    return [_verify_checksum(message) for message in messages]
+
+
+def _verify_checksum(message):
+    if len(message) < 6 or not (message.startswith(STX)
+                                and message.endswith(CRLF)):
+        return False
+    return make_checksum(message[1:-4]) == message[-4:-2]
+
+
+def _verify_many_numpy(numpy, messages):
+    lengths = numpy.fromiter(map(len, messages), dtype=numpy.int64,
+                             count=len(messages))
+    ends = numpy.cumsum(lengths)
+    starts = ends - lengths
+    data = numpy.frombuffer(b''.join(messages), dtype=numpy.uint8)
+    # prefix sums turns summing of each message bytes into single subtraction
+    sums = numpy.zeros(len(data) + 1, dtype=numpy.int64)
+    numpy.cumsum(data, out=sums[1:])
+    valid = lengths >= 6
+    starts, ends = starts[valid], ends[valid]
+    hexmap = numpy.full(256, -1, dtype=numpy.int64)
+    for byte, value in _HEX_DIGITS.items():
+        hexmap[byte] = value
+    high, low = hexmap[data[ends - 4]], hexmap[data[ends - 3]]
+    computed = (sums[ends - 4] - sums[starts + 1]) & 0xFF
+    result = numpy.zeros(len(messages), dtype=bool)
+    result[valid] = ((data[starts] == ord(STX)) &
+                     (data[ends - 2] == ord(CR)) &
+                     (data[ends - 1] == ord(LF)) &
+                     (high >= 0) & (low >= 0) &
+                     (high * 16 + low == computed))
+    return result.tolist()
 
 
 def make_chunks(s, n):
-    iter_bytes = (s[i:i + 1] for i in range(len(s)))
-    return [b''.join(item)
-            for item in izip_longest(*[iter_bytes] * n, fillvalue=b'')]
+    """Splits `s` into chunks of `n` size. The last chunk may be shorter."""
+    return [s[i:i + n] for i in range(0, len(s), n)]
 
 
 def split(msg, size):
@@ -304,15 +1104,45 @@ def split(msg, size):
     assert frame.isdigit()
     assert tail.endswith(CRLF)
     assert size is not None and size >= 7
-    frame = int(frame)
-    chunks = make_chunks(msg, size - 7)
-    chunks, last = chunks[:-1], chunks[-1]
-    idx = 0
-    for idx, chunk in enumerate(chunks):
-        item = b''.join([str((idx + frame) % 8).encode(), chunk, ETB])
-        yield b''.join([STX, item, make_checksum(item), CRLF])
-    item = b''.join([str((idx + frame + 1) % 8).encode(), last, CR, ETX])
-    yield b''.join([STX, item, make_checksum(item), CRLF])
+    frame, step = int(frame), size - 7
+    # the last chunk is never empty, so it could be terminated by <CR><ETX>
+    last = (len(msg) - 1) // step * step if msg else 0
+    for idx, offset in enumerate(range(0, last, step)):
+        yield _make_chunk(frame + idx, msg[offset:offset + step], ETB)
+    yield _make_chunk(frame + last // step, msg[last:], CR + ETX)
+
+
+def iter_split(records, size, encoding=ENCODING, seq=1):
+    """Encodes `records` and emits them as chunks with specified `size`.
+
+    Unlike :func:`split` it doesn't build the whole message first: chunks are
+    emitted as soon as encoded records fill them, so only the data for the
+    next chunk is kept in memory. The result is the same as :func:`encode`
+    returns for the same arguments.
+
+    :param records: Iterable of ASTM records.
+    :type records: iterable
+
+    :param size: Chunk size in bytes.
+    :type size: int
+
+    :param encoding: Data encoding.
+    :type encoding: str
+
+    :param seq: Frame start sequence number.
+    :type seq: int
+
+    :yield: `bytes`
+    """
+    return _DEFAULT_CODEC.iter_split(records, size, encoding, seq)
+
+
+_SEQ_NUMBERS = tuple(str(seq).encode() for seq in range(8))
+
+
+def _make_chunk(seq, data, tail):
+    item = b''.join([_SEQ_NUMBERS[seq % 8], data, tail])
+    return b''.join([STX, item, make_checksum(item), CRLF])
 
 
 def join(chunks):
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+"""Bulk decoding of stored ASTM messages into column oriented data.
+
+Instead of building nested lists for every record, only configured fields of
+records of configured types are extracted during the scan::
+
+    >>> columns = decode_columns(messages, ['R.3.4', 'R.4', 'R.5'],
+    ...                          types={'R.4': 'd'})
+    >>> columns['R.4']
+    array('d', [5.4, 140.0, ...])
+
+Field paths follows the ASTM specification numbering: ``R.4`` is the fourth
+field of Result record (the first one is record type) and ``R.3.4`` is the
+fourth component of the third field. For repeated fields the first value is
+taken.
+"""
+
+from array import array
+from .codec import InternCache, get_codec, make_checksum
+from .constants import CR, ETB, ETX, STX, RECORD_SEP, ENCODING
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__all__ = ['decode_columns', 'parse_path']
+
+_FLOAT_TYPECODES = frozenset('fd')
+
+
+def parse_path(path):
+    """Parses field path.
+
+    :param path: Field path like ``R.4`` or ``R.3.4``.
+    :type path: str
+
+    :returns: Tuple of record type code, zero based field index and zero based
+              component index or :const:`None` if path points to the whole
+              field.
+    :rtype: tuple
+    """
+    parts = path.split('.')
+    if len(parts) not in (2, 3) or len(parts[0]) != 1:
+        raise ValueError('Invalid field path %r' % path)
+    try:
+        indexes = [int(part) - 1 for part in parts[1:]]
+    except ValueError:
+        raise ValueError('Invalid field path %r' % path)
+    if min(indexes) < 0:
+        raise ValueError('Field path numbers starts from 1: %r' % path)
+    if len(indexes) == 1:
+        indexes.append(None)
+    return (parts[0].encode('ascii'),) + tuple(indexes)
+
+
+def decode_columns(messages, fields, encoding=ENCODING, types=None,
+                   codec=None, verify=True, use_numpy=None):
+    """Decodes configured fields of many ASTM messages into columns.
+
+    :param messages: Iterable of complete ASTM messages, frames or records.
+                     Chunked messages should be joined first with
+                     :func:`~astm.codec.join`.
+    :type messages: iterable
+
+    :param fields: Field paths to extract. See :func:`parse_path`.
+    :type fields: list
+
+    :param encoding: Data encoding.
+    :type encoding: str
+
+    :param types: Mapping of field path to :mod:`array` typecode for numeric
+                  columns. Empty values of float columns are stored as NaN.
+    :type types: dict
+
+    :param codec: Codec to split records with. If :const:`None` the codec is
+                  picked by delimiters definition of each Header record.
+    :type codec: :class:`~astm.codec.Codec`
+
+    :param verify: Verify checksums of messages.
+    :type verify: bool
+
+    :param use_numpy: Return numeric columns as NumPy arrays. By default
+                      NumPy is used if it's available.
+    :type use_numpy: bool
+
+    :returns: Mapping of field path to column. Numeric columns are
+              :class:`array.array` or :class:`numpy.ndarray` instances,
+              others are lists of unicode strings with :const:`None` for
+              empty values. Each column has a value for every record of
+              its type.
+    :rtype: dict
+    """
+    types = types or {}
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError('numpy is required')
+    wanted = {}
+    raw_columns = {}
+    for path in fields:
+        rtype, field, component = parse_path(path)
+        column = raw_columns[path] = []
+        wanted.setdefault(rtype, []).append((field, component, column.append))
+    auto_codec = codec is None
+    codec = codec or get_codec()
+    for data in messages:
+        for record in _iter_records(data, verify):
+            rtype = record[:1]
+            if rtype == b'H' and auto_codec:
+                codec = get_codec(record[1:5])
+            specs = wanted.get(rtype)
+            if specs is None:
+                continue
+            values = record.split(codec.field_sep)
+            size = len(values)
+            for field, component, append in specs:
+                value = values[field] if field < size else b''
+                if component is not None:
+                    value = value.split(codec.repeat_sep, 1)[0]
+                    components = value.split(codec.component_sep)
+                    if component < len(components):
+                        value = components[component]
+                    else:
+                        value = b''
+                append(value)
+    columns = {}
+    for path, values in raw_columns.items():
+        typecode = types.get(path)
+        if typecode is None:
+            columns[path] = _make_text_column(values, encoding)
+        else:
+            column = _make_numeric_column(path, values, typecode)
+            if use_numpy:
+                column = numpy.frombuffer(column, dtype=typecode).copy()
+            columns[path] = column
+    return columns
+
+
+def _iter_records(data, verify):
+    if not isinstance(data, bytes):
+        raise TypeError('bytes expected, got %r' % data)
+    if data.startswith(STX):
+        frame, cs = data[1:-4], data[-4:-2]
+        if verify:
+            ccs = make_checksum(frame)
+            assert cs == ccs, ('Checksum failure: expected %r, calculated %r'
+                               '' % (cs, ccs))
+        data = frame
+    if data.endswith(CR + ETX):
+        data = data[:-2]
+    elif data.endswith(ETB):
+        raise ValueError('Chunked message should be joined before decoding:'
+                         ' %r' % data)
+    if data[:1].isdigit():
+        data = data[1:]
+    return data.split(RECORD_SEP)
+
+
+def _make_text_column(values, encoding):
+    cache = InternCache()
+    decode = cache.decode
+    return [decode(value, encoding) if value else None for value in values]
+
+
+def _make_numeric_column(path, values, typecode):
+    column = array(typecode)
+    append = column.append
+    if typecode in _FLOAT_TYPECODES:
+        nan = float('nan')
+        for value in values:
+            append(float(value) if value else nan)
+    else:
+        for value in values:
+            if not value:
+                raise ValueError('Empty value in integer column %r' % path)
+            append(int(value))
+    return column
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+"""Decoding of stored ASTM traffic with a pool of processes.
+
+Stored traffic is split on message boundaries in the calling process, while
+messages are decoded and wrapped by records dispatcher mappings in the worker
+processes::
+
+    from astm.mindray.server import RecordsDispatcher
+
+    for records in decode_archive(['day1.astm', 'day2.astm'], workers=4,
+                                  dispatcher=RecordsDispatcher):
+        ...
+
+Dispatcher mappings are built dynamically and couldn't be pickled, so wrapped
+records are converted by `transform` callable inside the worker before they
+are sent back. By default they are turned into dicts with :func:`to_dict`.
+"""
+
+import logging
+import mmap
+from collections import deque
+from .codec import find_frame_end, get_codec, get_header_delimiters, join
+from .constants import STX
+from .mapping import Mapping
+from .server import BaseRecordsDispatcher
+
+try:
+    from concurrent.futures import (
+        FIRST_COMPLETED, ProcessPoolExecutor, wait
+    )
+except ImportError:  # pragma: no cover
+    ProcessPoolExecutor = None
+
+try:
+    from multiprocessing import cpu_count
+except ImportError:  # pragma: no cover
+    cpu_count = lambda: 1
+
+log = logging.getLogger(__name__)
+
+__all__ = ['decode_archive', 'iter_messages', 'to_dict']
+
+#: Records dispatchers instances of the worker process.
+_DISPATCHERS = {}
+
+
+def iter_messages(data):
+    """Yields complete ASTM messages from stored traffic. Chunked messages
+    are joined, control characters and any other data between messages are
+    skipped.
+
+    :param data: Stored ASTM traffic.
+    :type data: bytes or :class:`mmap.mmap`
+    """
+    chunks = []
+    pos, size = 0, len(data)
+    while pos < size:
+        start = data.find(STX, pos)
+        if start == -1:
+            break
+        frame = find_frame_end(data, start)
+        if frame is None:
+            break
+        pos, last = frame
+        message = bytes(data[start:pos])
+        if not last:
+            chunks.append(message)
+            continue
+        if chunks:
+            chunks.append(message)
+            message = join(chunks)
+            chunks = []
+        yield message
+
+
+def to_dict(record):
+    """Converts wrapped record to the dict which could be sent between
+    processes. Nested mappings are converted as well, records without
+    mapping are returned as is."""
+    if isinstance(record, Mapping):
+        return dict((key, to_dict(value)) for key, value in record.items())
+    if isinstance(record, list):
+        return [to_dict(item) for item in record]
+    return record
+
+
+def decode_archive(sources, workers=None, ordered=True,
+                   dispatcher=BaseRecordsDispatcher, encoding=None,
+                   transform=to_dict, batch_size=100):
+    """Decodes stored ASTM traffic in parallel.
+
+    :param sources: List of file paths or buffers with stored traffic. On
+                    Python 2 :class:`str` is treated as a path unless it
+                    contains STX character.
+    :type sources: list
+
+    :param workers: Number of worker processes. By default the number of
+                    CPUs is used. If ``0`` messages are decoded within the
+                    current process.
+    :type workers: int
+
+    :param ordered: Yield results in order of messages. Otherwise they are
+                    yielded as soon as they are ready.
+    :type ordered: bool
+
+    :param dispatcher: Records dispatcher class which codec options and
+                       :attr:`~astm.server.BaseRecordsDispatcher.wrappers`
+                       are used. Should be importable by workers.
+    :type dispatcher: type
+
+    :param encoding: Data encoding. Dispatcher one is used by default.
+    :type encoding: str
+
+    :param transform: Importable callable that converts each wrapped record
+                      before it's sent back from worker.
+    :type transform: callable
+
+    :param batch_size: Number of messages sent to worker at once.
+    :type batch_size: int
+
+    :returns: Iterator over lists of records, one list per message.
+              Messages that couldn't be decoded, e.g. retransmitted frames
+              with broken checksum, are logged and skipped.
+    """
+    batches = _iter_batches(sources, batch_size)
+    if workers == 0:
+        for delimiters, messages in batches:
+            for records in _decode_batch(dispatcher, encoding, transform,
+                                         delimiters, messages):
+                yield records
+        return
+    if ProcessPoolExecutor is None:
+        raise ImportError('concurrent.futures is required')
+    workers = workers or cpu_count()
+    executor = ProcessPoolExecutor(workers)
+    pending = deque()
+    try:
+        for delimiters, messages in batches:
+            pending.append(executor.submit(_decode_batch, dispatcher,
+                                           encoding, transform, delimiters,
+                                           messages))
+            if len(pending) < workers * 2:
+                continue
+            for records in _pop_results(pending, ordered):
+                yield records
+        while pending:
+            for records in _pop_results(pending, ordered):
+                yield records
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def _pop_results(pending, ordered):
+    if ordered:
+        done = [pending.popleft()]
+    else:
+        done = wait(pending, return_when=FIRST_COMPLETED).done
+        for future in done:
+            pending.remove(future)
+    for future in done:
+        for records in future.result():
+            yield records
+
+
+def _iter_batches(sources, batch_size):
+    delimiters = None
+    for source in sources:
+        data, close = _open_source(source)
+        try:
+            batch = []
+            batch_delimiters = delimiters
+            for message in iter_messages(data):
+                try:
+                    codec = _header_codec(message)
+                except ValueError:  # worker skips this message
+                    codec = None
+                if codec is not None:
+                    delimiters = codec.delimiters
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    yield batch_delimiters, batch
+                    batch = []
+                    batch_delimiters = delimiters
+            if batch:
+                yield batch_delimiters, batch
+        finally:
+            close()
+
+
+def _header_codec(message):
+    delimiters = get_header_delimiters(message)
+    if delimiters is not None:
+        return get_codec(delimiters)
+
+
+def _is_data(source):
+    if bytes is str and isinstance(source, str):
+        # Python 2 str is both path and data type, but paths have no frames
+        return STX in source
+    return isinstance(source, (bytes, bytearray, mmap.mmap))
+
+
+def _open_source(source):
+    if _is_data(source):
+        return source, lambda: None
+    if isinstance(source, memoryview):
+        return source.tobytes(), lambda: None
+    fobj = open(source, 'rb')
+    try:
+        data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # empty file could not be mapped
+        fobj.close()
+        return b'', lambda: None
+    def close():
+        data.close()
+        fobj.close()
+    return data, close
+
+
+def _decode_batch(dispatcher_class, encoding, transform, delimiters,
+                  messages):
+    key = (dispatcher_class, encoding)
+    dispatcher = _DISPATCHERS.get(key)
+    if dispatcher is None:
+        dispatcher = _DISPATCHERS[key] = dispatcher_class(encoding)
+    codec = dispatcher.codec
+    if delimiters is not None:
+        codec = get_codec(delimiters)
+    results = []
+    for message in messages:
+        try:
+            codec = _header_codec(message) or codec
+            seq, records, cs = codec.decode_message(message,
+                                                    dispatcher.encoding,
+                                                    False,
+                                                    dispatcher.intern_cache,
+                                                    dispatcher.projection)
+        except (AssertionError, ValueError) as err:
+            log.warning('Message %r is skipped: %s', message, err)
+            continue
+        results.append([transform(dispatcher.wrap(record))
+                        for record in records])
+    return results
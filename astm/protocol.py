@@ -8,7 +8,7 @@
 #
 
 import logging
-from .asynclib import AsyncChat, call_later
+from .asynclib import AsyncChat, call_timeout
 from .records import HeaderRecord, TerminatorRecord
 from .constants import STX,  ENQ, ACK, NAK, EOT, ENCODING
 
@@ -37,7 +37,7 @@ class ASTMProtocol(AsyncChat):
     def __init__(self, sock=None, map=None, timeout=None):
         super(ASTMProtocol, self).__init__(sock, map)
         if timeout is not None:
-            self.timer = call_later(timeout, self.on_timeout)
+            self.timer = call_timeout(timeout, self.on_timeout)
 
     def found_terminator(self):
         while self.inbox:
@@ -8,16 +8,31 @@
 #
 
 import logging
+import os
+import signal
 import socket
-from .asynclib import Dispatcher, loop
-from .codec import decode_message, is_chunked_message, join
-from .constants import ACK, CRLF, EOT, NAK, ENCODING
+import time
+import weakref
+from collections import deque
+from errno import ECHILD, EINTR
+from .asynclib import Dispatcher, call_soon_threadsafe, loop
+from .codec import (
+    InternCache, get_codec, get_header_delimiters, is_chunked_message, join,
+    make_projection
+)
+from .constants import ACK, CRLF, ENQ, EOT, NAK, ENCODING
 from .exceptions import InvalidState, NotAccepted
 from .protocol import ASTMProtocol
 
 log = logging.getLogger(__name__)
 
-__all__ = ['BaseRecordsDispatcher', 'RequestHandler', 'Server']
+try:
+    from multiprocessing import cpu_count
+except ImportError:  # pragma: no cover
+    cpu_count = lambda: 1
+
+__all__ = ['BaseRecordsDispatcher', 'RequestHandler', 'Server',
+           'PreforkServer']
 
 
 class BaseRecordsDispatcher(object):
@@ -57,9 +72,33 @@ class BaseRecordsDispatcher(object):
 
     #: Encoding of received messages.
     encoding = ENCODING
+    #: Pass records to handlers as :class:`~astm.codec.LazyRecord` views which
+    #: decode fields on demand. Useful when handlers read only few fields.
+    lazy = False
+    #: Maximum number of decoded values in the :class:`~astm.codec.InternCache`
+    #: that shares repeated values (assay codes, units, flags, etc.) between
+    #: decoded records. If :const:`None` no cache is used.
+    intern_cache_size = None
+    #: Record types and field indexes which handlers consume, e.g.
+    #: ``{'O': None, 'R': [2, 3, 4]}``. Records of other types are skipped
+    #: without decoding and fields not listed are set to :const:`None`.
+    #: See :func:`~astm.codec.make_projection`. If :const:`None` all records
+    #: are decoded and dispatched.
+    projection = None
 
     def __init__(self, encoding=None):
         self.encoding = encoding or self.encoding
+        #: :class:`~astm.codec.Codec` to decode messages with. Request handler
+        #: switches it to the one that matches delimiters definition of the
+        #: session Header record.
+        self.codec = get_codec()
+        #: :class:`~astm.codec.InternCache` instance, if enabled by
+        #: :attr:`intern_cache_size`. Use it to check the cache hit rate.
+        self.intern_cache = None
+        if self.intern_cache_size:
+            self.intern_cache = InternCache(self.intern_cache_size)
+        if self.projection is not None:
+            self.projection = make_projection(self.projection)
         self.dispatch = {
             'H': self.on_header,
             'C': self.on_comment,
@@ -73,7 +112,10 @@ class BaseRecordsDispatcher(object):
         self.wrappers = {}
 
     def __call__(self, message):
-        seq, records, cs = decode_message(message, self.encoding)
+        seq, records, cs = self.codec.decode_message(message, self.encoding,
+                                                     self.lazy,
+                                                     self.intern_cache,
+                                                     self.projection)
         for record in records:
             self.dispatch.get(record[0], self.on_unknown)(self.wrap(record))
 
@@ -123,6 +165,43 @@ class BaseRecordsDispatcher(object):
         self._default_handler(record)
 
 
+def collect_message(handler, message):
+    """Joins chunked `message` received by request `handler` and switches its
+    codec by the Header record delimiters. Header record is looked for only in
+    the frame that starts a message, not in the continuation chunks.
+
+    :param handler: Request handler with ``codec``, ``dispatcher`` and
+                    ``_chunks`` attributes.
+
+    :param message: Received ASTM frame.
+    :type message: bytes
+
+    :returns: Complete message or :const:`None` while chunks are collected.
+
+    :raises: :exc:`~astm.exceptions.NotAccepted` if Header record defines
+             invalid delimiters.
+    """
+    if not handler._chunks:
+        delimiters = get_header_delimiters(message)
+        if delimiters is not None:
+            try:
+                codec = get_codec(delimiters)
+            except ValueError as err:
+                raise NotAccepted('Header record is rejected: %s' % err)
+            handler.codec = codec
+            if hasattr(handler.dispatcher, 'codec'):
+                handler.dispatcher.codec = codec
+    handler.is_chunked_transfer = is_chunked_message(message)
+    if handler.is_chunked_transfer:
+        handler._chunks.append(message)
+        return None
+    elif handler._chunks:
+        handler._chunks.append(message)
+        message = join(handler._chunks)
+        handler._chunks = []
+    return message
+
+
 class RequestHandler(ASTMProtocol):
     """ASTM protocol request handler.
 
@@ -134,9 +213,37 @@ class RequestHandler(ASTMProtocol):
     :param timeout: Number of seconds to wait for incoming data before
                     connection closing.
     :type timeout: int
+
+    :param sink: Object with ``write(data)`` method, e.g.
+                 :class:`~astm.archive.BlockArchiveWriter`, to store received
+                 sessions. Session data from ENQ till EOT with accepted
+                 messages only is written at once when session ends and the
+                 sink is flushed then, if it has ``flush()`` method, so the
+                 acknowledged data isn't lost on crash. Sessions which are
+                 cut off before EOT are not stored.
+
+    :param executor: :class:`concurrent.futures.Executor` to call `dispatcher`
+                     in, so slow handlers don't block the loop and other
+                     connections. Message is ACKed or NAKed once the call is
+                     done; till then the connection is not read and the rest of
+                     already received data waits, so the order is preserved.
+                     With process pool the `dispatcher` should be picklable
+                     and its state changes are not sent back.
     """
-    def __init__(self, sock, dispatcher, timeout=None):
+
+    #: :class:`~astm.codec.Codec` for the delimiters defined by the Header
+    #: record of the current session.
+    codec = get_codec()
+
+    def __init__(self, sock, dispatcher, timeout=None, sink=None,
+                 executor=None):
         super(RequestHandler, self).__init__(sock, timeout=timeout)
+        self.sink = sink
+        self.executor = executor
+        # future of offloaded dispatcher call and data received meanwhile
+        self._pending = None
+        self._backlog = deque()
+        self._session = []
         self._chunks = []
         host, port = sock.getpeername() if sock is not None else (None, None)
         self.client_info = {'host': host, 'port': port}
@@ -148,6 +255,7 @@ class RequestHandler(ASTMProtocol):
         if not self._is_transfer_state:
             self._is_transfer_state = True
             self.terminator = [CRLF, EOT]
+            self._session = [ENQ]
             return ACK
         else:
             log.error('ENQ is not expected')
@@ -163,34 +271,102 @@ class RequestHandler(ASTMProtocol):
         if self._is_transfer_state:
             self._is_transfer_state = False
             self.terminator = 1
+            if self.sink is not None:
+                self._session.append(EOT)
+                self.sink.write(b''.join(self._session))
+                if hasattr(self.sink, 'flush'):
+                    self.sink.flush()
+            self._session = []
         else:
             raise InvalidState('Server is not ready to accept EOT message.')
 
+    def close(self):
+        if self.sink is not None and len(self._session) > 1:
+            log.warning('Session of %s:%s is cut off before EOT, %d accepted'
+                        ' messages are not stored', self.client_info['host'],
+                        self.client_info['port'], len(self._session) - 1)
+        self._session = []
+        self._is_transfer_state = False
+        super(RequestHandler, self).close()
+
+    def dispatch(self, data):
+        if self._pending is not None:
+            self._backlog.append(data)
+            return
+        return super(RequestHandler, self).dispatch(data)
+
     def on_message(self):
         if not self._is_transfer_state:
             self.discard_input_buffers()
             return NAK
+        elif self.executor is not None:
+            return self._offload_message(self._last_recv_data)
         else:
             try:
                 self.handle_message(self._last_recv_data)
+                if self.sink is not None:
+                    self._session.append(self._last_recv_data)
                 return ACK
+            except NotAccepted as err:
+                log.error('Message is not accepted: %s', err)
+                return NAK
             except Exception:
                 log.exception('Error occurred on message handling.')
                 return NAK
 
     def handle_message(self, message):
-        self.is_chunked_transfer = is_chunked_message(message)
-        if self.is_chunked_transfer:
-            self._chunks.append(message)
-        elif self._chunks:
-            self._chunks.append(message)
-            self.dispatcher(join(self._chunks))
-            self._chunks = []
-        else:
+        message = self._collect_message(message)
+        if message is not None:
             self.dispatcher(message)
 
+    def _collect_message(self, message):
+        return collect_message(self, message)
+
+    def _offload_message(self, data):
+        try:
+            message = self._collect_message(data)
+        except NotAccepted as err:
+            log.error('Message is not accepted: %s', err)
+            return NAK
+        except Exception:
+            log.exception('Error occurred on message handling.')
+            return NAK
+        if message is None:
+            if self.sink is not None:
+                self._session.append(data)
+            return ACK
+        future = self.executor.submit(self.dispatcher, message)
+        self._pending = future
+        self.update_interest()
+        future.add_done_callback(
+            lambda future: call_soon_threadsafe(self._on_dispatched, future,
+                                                data, _map=self._map))
+
+    def _on_dispatched(self, future, data):
+        self._pending = None
+        self.update_interest()
+        if not self.connected:
+            return
+        exc = future.exception()
+        if exc is not None:
+            log.error('Error occurred on message handling.',
+                      exc_info=(type(exc), exc,
+                                getattr(exc, '__traceback__', None)))
+            self.push(NAK)
+        else:
+            if self.sink is not None:
+                self._session.append(data)
+            self.push(ACK)
+        while self._backlog and self._pending is None and self.connected:
+            self.dispatch(self._backlog.popleft())
+
+    def readable(self):
+        return (self._pending is None
+                and super(RequestHandler, self).readable())
+
     def discard_input_buffers(self):
         self._chunks = []
+        self._backlog.clear()
         return super(RequestHandler, self).discard_input_buffers()
 
     def on_timeout(self):
@@ -221,6 +397,19 @@ class Server(Dispatcher):
 
     :param encoding: :class:`Dispatcher <BaseRecordsDispatcher>`\'s encoding.
     :type encoding: str
+
+    :param sink: :class:`RequestHandler` sink to store received sessions.
+                 It's closed on :meth:`shutdown`, if it has ``close()``
+                 method.
+
+    :param executor: :class:`RequestHandler` executor to call dispatcher in.
+
+    :param backlog: Maximum number of queued connections.
+    :type backlog: int
+
+    :param reuse_port: Bind with ``SO_REUSEPORT`` option to share the port
+                       with other servers. See :class:`PreforkServer`.
+    :type reuse_port: bool
     """
 
     request = RequestHandler
@@ -228,15 +417,22 @@ class Server(Dispatcher):
 
     def __init__(self, host='localhost', port=15200,
                  request=None, dispatcher=None,
-                 timeout=None, encoding=None):
+                 timeout=None, encoding=None, sink=None,
+                 backlog=5, reuse_port=False, executor=None):
         super(Server, self).__init__()
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         self.set_reuse_addr()
+        if reuse_port:
+            self.set_reuse_port()
         self.bind((host, port))
-        self.listen(5)
+        self.listen(backlog)
         self.pool = []
+        # connections accepted by this server
+        self._handlers = weakref.WeakSet()
         self.timeout = timeout
         self.encoding = encoding
+        self.sink = sink
+        self.executor = executor
         if request is not None:
             self.request = request
         if dispatcher is not None:
@@ -247,10 +443,183 @@ class Server(Dispatcher):
         if pair is None:
             return
         sock, addr = pair
-        self.request(sock, self.dispatcher(self.encoding), timeout=self.timeout)
+        kwargs = {}
+        if self.sink is not None:
+            kwargs['sink'] = self.sink
+        if self.executor is not None:
+            kwargs['executor'] = self.executor
+        handler = self.request(sock, self.dispatcher(self.encoding),
+                               timeout=self.timeout, **kwargs)
+        self._handlers.add(handler)
         super(Server, self).handle_accept()
 
     def serve_forever(self, *args, **kwargs):
         """Enters into the :func:`polling loop <asynclib.loop>` to let server
-        handle incoming requests."""
+        handle incoming requests. Pass ``backend='selectors'`` to use epoll,
+        kqueue, etc. instead of :func:`select.select` for the large number of
+        connections. Call :meth:`shutdown` to stop the server."""
         loop(*args, **kwargs)
+
+    def shutdown(self):
+        """Closes the server, connections accepted by it and the sink."""
+        self.close()
+        for handler in list(self._handlers):
+            if handler._fileno is not None:
+                handler.close()
+        self._handlers.clear()
+        if self.sink is not None and hasattr(self.sink, 'close'):
+            self.sink.close()
+            self.sink = None
+
+
+class _StopWorker(BaseException):
+    """Leaves the worker loop on signal."""
+
+
+def _stop_worker(signum, frame):
+    # ignore repeated signals while the server is shut down
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise _StopWorker()
+
+
+class PreforkServer(object):
+    """Supervisor of :class:`Server` worker processes which share the same
+    port with ``SO_REUSEPORT`` option, so the kernel balances incoming
+    connections between them and decoding of the received data uses several
+    CPU cores::
+
+        server = PreforkServer(workers=4, port=15200, dispatcher=Dispatcher)
+        server.serve_forever()
+
+    Each worker runs its own :func:`polling loop <asynclib.loop>`. Died
+    workers are restarted. Supervisor stops workers on ``SIGTERM`` or
+    ``SIGINT`` and exits once all of them are finished. Worker leaves the
+    loop on ``SIGTERM`` and :meth:`shuts down <Server.shutdown>` its server,
+    so the connections and the sink are closed properly.
+
+    Available only on platforms with :func:`os.fork` and ``SO_REUSEPORT``
+    support.
+
+    :param workers: Number of worker processes. By default the number of CPUs
+                    is used.
+    :type workers: int
+
+    Other keyword arguments are passed to the :class:`Server`, except
+    `sink` and `executor`: objects created before the fork would be shared
+    by all workers, so they should be created per worker by
+    :meth:`make_server`.
+    """
+
+    #: Server class to run within workers.
+    server = Server
+    #: Minimal number of seconds between the start of worker and its restart.
+    #: Keeps supervisor from restarting constantly failing worker too often.
+    restart_delay = 1.0
+
+    def __init__(self, workers=None, **kwargs):
+        if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+            raise NotImplementedError('PreforkServer requires fork and'
+                                      ' SO_REUSEPORT support')
+        for name in ('sink', 'executor'):
+            if kwargs.get(name) is not None:
+                raise ValueError('%s could not be shared between workers,'
+                                 ' create it within make_server' % name)
+        self.workers = workers or cpu_count()
+        self.kwargs = kwargs
+        #: Mapping of worker process id to its number and start time.
+        self.pids = {}
+        self._stopping = False
+
+    def make_server(self, worker):
+        """Creates server within worker process. Override it to set worker
+        specific options, e.g. own sink, since sink objects couldn't be
+        shared between processes::
+
+            class Supervisor(PreforkServer):
+
+                def make_server(self, worker):
+                    server = super(Supervisor, self).make_server(worker)
+                    server.sink = BlockArchiveWriter('lis%d.archive' % worker)
+                    return server
+
+        :param worker: Worker number starting from zero.
+        :type worker: int
+        """
+        return self.server(reuse_port=True, **self.kwargs)
+
+    def serve_forever(self, *args, **kwargs):
+        """Starts workers and supervises them until :meth:`stop` call.
+        Arguments are passed to :meth:`Server.serve_forever` of every
+        worker."""
+        self._stopping = False
+        handlers = {}
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            handlers[signum] = signal.signal(signum, self._handle_signal)
+        try:
+            for worker in range(self.workers):
+                self._spawn(worker, args, kwargs)
+            while self.pids:
+                try:
+                    pid, status = os.wait()
+                except OSError as err:
+                    if err.args[0] == EINTR:
+                        continue
+                    if err.args[0] == ECHILD:
+                        break
+                    raise
+                if pid not in self.pids:
+                    continue
+                worker, started = self.pids.pop(pid)
+                if self._stopping:
+                    continue
+                log.error('Worker %d (pid %d) exited with status %d',
+                          worker, pid, status)
+                delay = started + self.restart_delay - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self._stopping:
+                    self._spawn(worker, args, kwargs)
+        finally:
+            self.stop()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def stop(self):
+        """Stops all workers."""
+        self._stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.pids.pop(pid, None)
+
+    def _handle_signal(self, signum, frame):
+        self.stop()
+
+    def _spawn(self, worker, args, kwargs):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = (worker, time.time())
+            return pid
+        code = 0
+        server = None
+        try:
+            signal.signal(signal.SIGTERM, _stop_worker)
+            signal.signal(signal.SIGINT, _stop_worker)
+            self.pids.clear()
+            server = self.make_server(worker)
+            server.serve_forever(*args, **kwargs)
+        except _StopWorker:
+            pass
+        except BaseException:
+            log.exception('Worker %d failed', worker)
+            code = 1
+        try:
+            if server is not None:
+                server.shutdown()
+        except BaseException:
+            log.exception('Worker %d failed to shut down', worker)
+            code = 1
+        finally:
+            os._exit(code)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+from io import BytesIO
+from astm import codec, constants
+
+try:
+    import asyncio
+    from astm import aio
+except (ImportError, SyntaxError):
+    asyncio = None
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.written = []
+        self.paused = False
+        self.closing = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+
+def emitter():
+    assert (yield ['H', '\\^&'])
+    assert (yield ['P', '1'])
+    assert (yield ['O', '1', 'sample'])
+    assert (yield ['R', '1', ['', '', '', 'GLU'], '5.4'])
+    yield ['L']
+
+
+def message(seq, *records):
+    return codec.encode_message(seq, records, 'ascii')
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class AsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until(self, future, timeout=5):
+        return self.loop.run_until_complete(asyncio.wait_for(future, timeout))
+
+    def connect(self, protocol):
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        return transport
+
+
+class ProtocolTestCase(AsyncTestCase):
+
+    def test_dispatch_control_characters(self):
+        proto = aio.ASTMProtocol()
+        calls = []
+        proto.on_enq = lambda: calls.append('enq') or constants.ACK
+        proto.on_eot = lambda: calls.append('eot')
+        transport = self.connect(proto)
+        proto.data_received(constants.ENQ + constants.EOT)
+        self.assertEqual(['enq', 'eot'], calls)
+        self.assertEqual([constants.ACK], transport.written)
+
+    def test_join_message_chunks(self):
+        proto = aio.ASTMProtocol()
+        received = []
+        proto.on_message = lambda: received.append(proto._last_recv_data)
+        self.connect(proto)
+        data = message(1, ['H', '\\^&'])
+        proto.data_received(data[:5])
+        self.assertEqual([], received)
+        proto.data_received(data[5:] + constants.EOT)
+        self.assertEqual([data], received)
+
+    def test_pause_reading_while_handling(self):
+        proto = aio.ASTMProtocol()
+        future = self.loop.create_future()
+        calls = []
+        proto.on_enq = lambda: future
+        proto.on_eot = lambda: calls.append('eot')
+        transport = self.connect(proto)
+        proto.data_received(constants.ENQ + constants.EOT)
+        self.assertTrue(transport.paused)
+        self.assertEqual([], calls)
+        future.set_result(constants.ACK)
+        self.run_until(asyncio.sleep(0))
+        self.assertFalse(transport.paused)
+        self.assertEqual([constants.ACK], transport.written)
+        self.assertEqual(['eot'], calls)
+
+    def test_close_on_error(self):
+        proto = aio.ASTMProtocol()
+        transport = self.connect(proto)
+        proto.data_received(b'foo')
+        self.assertTrue(transport.closing)
+
+    def test_timeout(self):
+        proto = aio.ASTMProtocol(timeout=0.1)
+        timeouts = []
+        proto.on_timeout = lambda: timeouts.append(self.loop.time())
+        self.connect(proto)
+        start = self.loop.time()
+        self.run_until(asyncio.sleep(0.05))
+        proto.data_received(constants.ENQ)
+        self.run_until(asyncio.sleep(0.3))
+        self.assertEqual(1, len(timeouts))
+        self.assertTrue(timeouts[0] - start >= 0.15)
+
+
+class RequestHandlerTestCase(AsyncTestCase):
+
+    def test_reject_message_on_invalid_state(self):
+        handler = aio.RequestHandler(aio.AsyncRecordsDispatcher())
+        transport = self.connect(handler)
+        handler.data_received(message(1, ['H', '\\^&']))
+        self.assertEqual([constants.NAK], transport.written)
+
+    def test_acknowledge_after_handling(self):
+        dispatcher = aio.AsyncRecordsDispatcher()
+        records = []
+        def on_result(record):
+            records.append(record)
+            return asyncio.sleep(0.01)
+        dispatcher.dispatch['R'] = on_result
+        handler = aio.RequestHandler(dispatcher)
+        transport = self.connect(handler)
+        handler.data_received(constants.ENQ + message(1, ['R', '1']))
+        self.assertEqual([constants.ACK], transport.written)
+        self.assertTrue(transport.paused)
+        self.run_until(handler._pending)
+        self.assertEqual([['R', '1']], records)
+        self.assertEqual([constants.ACK, constants.ACK], transport.written)
+        self.assertFalse(transport.paused)
+
+    def test_sync_dispatcher(self):
+        handler = aio.RequestHandler(lambda message: None)
+        transport = self.connect(handler)
+        handler.data_received(constants.ENQ + message(1, ['H', '\\^&']))
+        self.run_until(handler._pending)
+        self.assertEqual([constants.ACK, constants.ACK], transport.written)
+
+    def test_reject_message_on_dispatch_error(self):
+        def dispatcher(message):
+            raise ValueError(message)
+        handler = aio.RequestHandler(dispatcher)
+        transport = self.connect(handler)
+        handler.data_received(constants.ENQ + message(1, ['H', '\\^&']))
+        self.run_until(handler._pending)
+        self.assertEqual([constants.ACK, constants.NAK], transport.written)
+
+    def test_keep_codec_on_chunk_continuation(self):
+        handler = aio.RequestHandler(lambda message: None)
+        transport = self.connect(handler)
+        chunks = codec.encode([['H', '\\^&', '', '', '123456789HAAAAxyz']],
+                              size=24)
+        handler.data_received(constants.ENQ)
+        for chunk in chunks:
+            handler.data_received(chunk)
+            self.run_until(handler._pending)
+        self.assertEqual([constants.ACK] * 3, transport.written)
+        self.assertTrue(handler.codec is codec.get_codec())
+
+    def test_reject_invalid_header_delimiters(self):
+        handler = aio.RequestHandler(lambda message: None)
+        transport = self.connect(handler)
+        handler.data_received(constants.ENQ + message(1, ['H', '|^&']))
+        self.run_until(handler._pending)
+        self.assertEqual([constants.ACK, constants.NAK], transport.written)
+
+
+class ClientTestCase(AsyncTestCase):
+
+    def test_open_session(self):
+        client = aio.Client(emitter)
+        transport = self.connect(client)
+        self.assertEqual([constants.ENQ], transport.written)
+
+    def test_retry_enq(self):
+        client = aio.Client(emitter)
+        transport = self.connect(client)
+        client.data_received(constants.NAK)
+        self.assertEqual([constants.ENQ, constants.ENQ], transport.written)
+
+    def test_send_records(self):
+        client = aio.Client(emitter)
+        transport = self.connect(client)
+        client.data_received(constants.ACK)
+        self.assertEqual(b'1H', transport.written[-1][1:3])
+        client.data_received(constants.ACK)
+        self.assertEqual(b'2P', transport.written[-1][1:3])
+
+    def test_defer_records_while_writing_paused(self):
+        client = aio.Client(emitter)
+        transport = self.connect(client)
+        client.pause_writing()
+        self.assertTrue(transport.paused)
+        client.data_received(constants.ACK)
+        self.assertEqual([constants.ENQ], transport.written)
+        client.resume_writing()
+        self.assertFalse(transport.paused)
+        self.assertEqual(b'1H', transport.written[-1][1:3])
+
+
+class ServerClientTestCase(AsyncTestCase):
+
+    def test_session(self):
+        results = []
+        handlers = []
+
+        class Dispatcher(aio.AsyncRecordsDispatcher):
+            def on_header(self, record):
+                pass
+            def on_patient(self, record):
+                pass
+            def on_order(self, record):
+                pass
+            def on_result(self, record):
+                results.append(record[2][3])
+                return asyncio.sleep(0)
+            def on_terminator(self, record):
+                pass
+
+        class Handler(aio.RequestHandler):
+            def __init__(self, *args, **kwargs):
+                super(Handler, self).__init__(*args, **kwargs)
+                handlers.append(self)
+
+        sink = BytesIO()
+        server = self.run_until(aio.start_server(
+            port=0, request=Handler, dispatcher=Dispatcher, sink=sink))
+        try:
+            port = server.sockets[0].getsockname()[1]
+            client = self.run_until(aio.start_client(emitter, port=port))
+            self.run_until(client.wait_closed())
+            self.run_until(handlers[0].wait_closed())
+        finally:
+            server.close()
+            self.run_until(server.wait_closed())
+        self.assertEqual(['GLU'], results)
+        session = sink.getvalue()
+        self.assertTrue(session.startswith(constants.ENQ))
+        self.assertTrue(session.endswith(constants.EOT))
+        self.assertEqual(5, session.count(constants.STX))
+
+
+if __name__ == '__main__':
+    unittest.main()
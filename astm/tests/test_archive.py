@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from astm import codec
+from astm.archive import (
+    BlockArchiveReader, BlockArchiveWriter, CaptureReader, FrameIndex
+)
+from astm.constants import ACK, ENQ, EOT
+from astm.tests.utils import make_session
+
+
+class FrameIndexTestCase(unittest.TestCase):
+
+    def test_scan(self):
+        data = make_session(['P', '1']) + ACK + make_session(['P', '2'])
+        index = FrameIndex()
+        index.scan(data)
+        self.assertEqual(2, index.sessions_count)
+        self.assertEqual(2, len(index))
+        self.assertEqual(1, index.offsets[0])
+        self.assertEqual(b'H', index.frame_type(0))
+        self.assertEqual([0, 1], list(index.sessions))
+        self.assertEqual(len(data), index.position)
+        self.assertEqual(len(data), index.session_ends[1])
+
+    def test_chunks_share_record_type(self):
+        message = codec.encode_message(1, [['R', '1', 'x' * 100]], 'ascii')
+        data = ENQ + b''.join(codec.split(message, 32)) + EOT
+        index = FrameIndex()
+        index.scan(data)
+        self.assertTrue(len(index) > 1)
+        self.assertEqual(b'R' * len(index), bytes(index.rtypes))
+
+    def test_incomplete_frame_is_left_for_next_scan(self):
+        data = (ENQ + codec.encode_message(1, [['H']], 'ascii')
+                + codec.encode_message(2, [['L', '1']], 'ascii') + EOT)
+        index = FrameIndex()
+        index.scan(data, len(data) - 3)
+        self.assertEqual(1, len(index))
+        index.scan(data)
+        self.assertEqual(2, len(index))
+        self.assertEqual(1, index.sessions_count)
+
+    def test_frames_out_of_session(self):
+        data = codec.encode_message(1, [['P', '1']], 'ascii')
+        index = FrameIndex()
+        index.scan(data)
+        self.assertEqual(1, index.sessions_count)
+        self.assertEqual(0, index.session_starts[0])
+
+
+class CaptureReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'capture')
+        self.sessions = [make_session(['P', str(i)], ['R', '1', 'GLU'])
+                         for i in range(5)]
+        with open(self.path, 'wb') as fobj:
+            fobj.write(b''.join(self.sessions))
+
+    def test_session(self):
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(5, reader.sessions_count)
+            frames = reader.session(3)
+            self.assertTrue(isinstance(frames[0], memoryview))
+            seq, records, cs = codec.decode_message(frames[0], 'ascii')
+            self.assertEqual(['P', '3'], records[1])
+            self.assertEqual(self.sessions[3],
+                             reader.session_data(3).tobytes())
+            self.assertRaises(IndexError, reader.session, 5)
+
+    def test_frames_between_offsets(self):
+        size = len(self.sessions[0])
+        with CaptureReader(self.path) as reader:
+            frames = list(reader.frames(size, size * 3))
+            self.assertEqual(2, len(frames))
+            self.assertEqual(5, len(list(reader.frames(rtype=b'H'))))
+            self.assertEqual(0, len(list(reader.frames(rtype=b'Q'))))
+
+    def test_messages(self):
+        message = codec.encode_message(1, [['R', '1', 'x' * 100]], 'ascii')
+        with open(self.path, 'ab') as fobj:
+            fobj.write(ENQ + b''.join(codec.split(message, 32)) + EOT)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual([message], reader.messages(5))
+
+    def test_reuse_index(self):
+        CaptureReader(self.path).close()
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+        index = FrameIndex.load(self.path + '.idx',
+                                os.path.getsize(self.path),
+                                os.path.getmtime(self.path))
+        self.assertEqual(5, index.sessions_count)
+
+    def test_stale_index(self):
+        CaptureReader(self.path).close()
+        self.assertTrue(FrameIndex.load(self.path + '.idx', 1, 0) is None)
+        with open(self.path + '.idx', 'wb') as fobj:
+            fobj.write(b'garbage')
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(5, reader.sessions_count)
+
+    def test_refresh(self):
+        reader = CaptureReader(self.path)
+        self.addCleanup(reader.close)
+        with open(self.path, 'ab') as fobj:
+            fobj.write(make_session(['P', '5']))
+        reader.refresh()
+        self.assertEqual(6, reader.sessions_count)
+        seq, records, cs = codec.decode_message(reader.session(5)[0],
+                                                'ascii')
+        self.assertEqual(['P', '5'], records[1])
+        with CaptureReader(self.path) as other:
+            self.assertEqual(6, other.sessions_count)
+
+    def test_empty_capture(self):
+        open(self.path, 'wb').close()
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(0, reader.sessions_count)
+            self.assertEqual([], list(reader.frames()))
+
+
+class BlockArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'archive')
+        self.sessions = [make_session(['P', str(i)], ['R', '1', 'GLU'])
+                         for i in range(20)]
+
+    def write(self, sessions, **kwargs):
+        kwargs.setdefault('block_size', 200)
+        with BlockArchiveWriter(self.path, **kwargs) as writer:
+            for session in sessions:
+                writer.write(session)
+
+    def test_read_sessions(self):
+        self.write(self.sessions)
+        self.assertTrue(os.path.getsize(self.path)
+                        < len(b''.join(self.sessions)))
+        with BlockArchiveReader(self.path) as reader:
+            self.assertEqual(20, reader.sessions_count)
+            self.assertTrue(len(reader.block_offsets) > 1)
+            for num in (0, 7, 19):
+                self.assertEqual(self.sessions[num],
+                                 reader.session_data(num).tobytes())
+                seq, records, cs = codec.decode_message(
+                    reader.session(num)[0], 'ascii')
+                self.assertEqual(['P', str(num)], records[1])
+
+    def test_decompress_only_needed_blocks(self):
+        self.write(self.sessions)
+        with BlockArchiveReader(self.path, cache_size=2) as reader:
+            reader._cache.clear()
+            reader.session(10)
+            self.assertTrue(len(reader._cache) <= 2)
+            self.assertTrue(all(reader.block_offsets[num]
+                                <= reader.index.session_ends[10]
+                                for num in reader._cache))
+
+    def test_lzma(self):
+        try:
+            import lzma
+        except ImportError:
+            raise unittest.SkipTest('lzma is not available')
+        self.write(self.sessions, compression='lzma')
+        with BlockArchiveReader(self.path) as reader:
+            self.assertEqual(self.sessions[3],
+                             reader.session_data(3).tobytes())
+
+    def test_append(self):
+        self.write(self.sessions[:10])
+        reader = BlockArchiveReader(self.path)
+        self.addCleanup(reader.close)
+        self.assertEqual(10, reader.sessions_count)
+        self.write(self.sessions[10:], compression='lzma')
+        reader.refresh()
+        self.assertEqual(20, reader.sessions_count)
+        self.assertEqual(self.sessions[15],
+                         reader.session_data(15).tobytes())
+        with BlockArchiveReader(self.path) as other:
+            self.assertEqual(20, other.sessions_count)
+
+    def test_truncate_incomplete_block(self):
+        self.write(self.sessions[:10])
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as fobj:
+            fobj.write(b'\0' * 10)
+        self.write(self.sessions[10:])
+        with BlockArchiveReader(self.path) as reader:
+            self.assertEqual(20, reader.sessions_count)
+        self.assertTrue(os.path.getsize(self.path) > size)
+
+    def test_detect_corruption(self):
+        self.write(self.sessions)
+        with open(self.path, 'r+b') as fobj:
+            fobj.seek(30)
+            fobj.write(b'\xff' * 4)
+        self.assertRaises(Exception, BlockArchiveReader, self.path)
+
+    def test_not_archive(self):
+        with open(self.path, 'wb') as fobj:
+            fobj.write(self.sessions[0])
+        self.assertRaises(ValueError, BlockArchiveWriter, self.path)
+        self.assertRaises(ValueError, BlockArchiveReader, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 from astm import asynclib
+from astm.compat import u
+from astm.tests.utils import track_call
 import unittest
 import select
 import os
@@ -240,6 +242,11 @@ class HelperFunctionTests(unittest.TestCase):
         for c in l:
             self.assertEqual(c.socket.closed, True)
 
+    def test_make_backend_by_unicode_name(self):
+        self.assertTrue(isinstance(asynclib.make_backend(u('select')),
+                                   asynclib.SelectBackend))
+        self.assertRaises(ValueError, asynclib.make_backend, u('foo'))
+
 
 class DispatcherTests(unittest.TestCase):
     def setUp(self):
@@ -316,6 +323,308 @@ class DispatcherWithSendTests_UsePoll(DispatcherWithSendTests):
     usepoll = True
 
 
+class recordingdispatcher(asynclib.Dispatcher):
+
+    def __init__(self, sock=None, map=None):
+        super(recordingdispatcher, self).__init__(sock, map)
+        self.received = []
+        self.want_write = False
+        self.write_events = 0
+        self.interest_checks = 0
+
+    def handle_read(self):
+        self.received.append(self.recv(1024))
+
+    def handle_write(self):
+        self.write_events += 1
+        self.want_write = False
+        self.update_interest()
+
+    def request_write(self):
+        self.want_write = True
+        self.update_interest()
+
+    def writable(self):
+        self.interest_checks += 1
+        return self.want_write
+
+
+def tcp_socketpair():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    client = socket.create_connection(server.getsockname())
+    conn, addr = server.accept()
+    server.close()
+    return conn, client
+
+
+@unittest.skipIf(asynclib.selectors is None, 'selectors module is required')
+class SelectorsBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.map = {}
+        self.left, self.right = tcp_socketpair()
+        self.channel = recordingdispatcher(self.left, self.map)
+        self.backend = asynclib.make_backend('selectors')
+
+    def tearDown(self):
+        self.backend.close()
+        asynclib.close_all(self.map)
+        self.right.close()
+
+    def test_read(self):
+        self.right.send(b'foo')
+        asynclib.loop(0.1, self.map, count=1, backend=self.backend)
+        self.assertEqual([b'foo'], self.channel.received)
+
+    def test_persistent_registration(self):
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        key = self.backend.selector.get_key(self.channel._fileno)
+        self.assertEqual(asynclib.selectors.EVENT_READ, key.events)
+        self.channel.request_write()
+        key = self.backend.selector.get_key(self.channel._fileno)
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        self.assertEqual(1, self.channel.write_events)
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        key = self.backend.selector.get_key(self.channel._fileno)
+        self.assertEqual(asynclib.selectors.EVENT_READ, key.events)
+
+    def test_check_interest_only_on_change(self):
+        for _ in range(3):
+            asynclib.loop(0, self.map, count=1, backend=self.backend)
+        self.assertEqual(1, self.channel.interest_checks)
+        self.channel.request_write()
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        self.assertEqual(2, self.channel.interest_checks)
+
+    def test_detect_unnotified_channels(self):
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        fd = self.channel._fileno
+        del self.map[fd]
+        self.backend.poll(0, self.map)
+        self.assertRaises(KeyError, self.backend.selector.get_key, fd)
+        self.map[fd] = self.channel
+        self.backend.poll(0, self.map)
+        self.assertTrue(self.backend.selector.get_key(fd).data
+                        is self.channel)
+
+    def test_unregister_closed_channel(self):
+        asynclib.loop(0, self.map, count=1, backend=self.backend)
+        fd = self.channel._fileno
+        self.channel.close()
+        other = recordingdispatcher(socket.socket(), {})
+        self.addCleanup(other.close)
+        self.backend.poll(0, {})
+        self.assertRaises(KeyError, self.backend.selector.get_key, fd)
+
+    def test_make_backend(self):
+        self.assertTrue(isinstance(asynclib.make_backend(),
+                                   asynclib.SelectBackend))
+        self.assertTrue(asynclib.make_backend(self.backend) is self.backend)
+        self.assertRaises(ValueError, asynclib.make_backend, 'foo')
+
+    def test_loop_by_backend_name(self):
+        self.right.send(b'foo')
+        asynclib.loop(0.1, self.map, count=1, backend='selectors')
+        self.assertEqual([b'foo'], self.channel.received)
+
+
+class terminatingchat(asynclib.AsyncChat):
+
+    def __init__(self, sock=None, map=None):
+        super(terminatingchat, self).__init__(sock, map)
+        self.messages = []
+
+    def found_terminator(self):
+        self.messages.append(b''.join(self.inbox))
+        self.inbox.clear()
+
+
+class AsyncChatReadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.map = {}
+        left, self.right = tcp_socketpair()
+        self.chat = terminatingchat(left, self.map)
+
+    def tearDown(self):
+        self.chat.close()
+        self.right.close()
+
+    def receive(self, data):
+        self.right.sendall(data)
+        select.select([self.chat.socket], [], [], 1)
+        self.chat.handle_read()
+
+    def test_str_terminator(self):
+        self.chat.terminator = b'\r\n'
+        self.receive(b'foo\r\nbar\r')
+        self.assertEqual([b'foo'], self.chat.messages)
+        self.assertEqual(1, self.chat._input_end - self.chat._input_start)
+        self.receive(b'\nbaz')
+        self.assertEqual([b'foo', b'bar'], self.chat.messages)
+        self.assertEqual([b'baz'], list(self.chat.inbox))
+
+    def test_keep_terminator(self):
+        self.chat.strip_terminator = False
+        self.chat.terminator = b'\r\n'
+        self.receive(b'foo\r\nbar\r\n')
+        self.assertEqual([b'foo\r\n', b'bar\r\n'], self.chat.messages)
+
+    def test_int_terminator(self):
+        self.chat.terminator = 3
+        self.receive(b'abcdefg')
+        self.assertEqual([b'abc', b'def'], self.chat.messages)
+        self.assertEqual([b'g'], list(self.chat.inbox))
+
+    def test_list_terminator(self):
+        self.chat.strip_terminator = False
+        self.chat.terminator = [b'\r\n', b'\x04']
+        self.receive(b'foo\r\n\x04')
+        self.assertEqual([b'foo\r\n', b'\x04'], self.chat.messages)
+
+    def test_reuse_buffer(self):
+        self.chat.recv_buffer_size = 8
+        self.chat.terminator = b'\r\n'
+        for i in range(20):
+            self.receive(b'foo\r')
+            self.receive(b'\n')
+        self.assertEqual([b'foo'] * 20, self.chat.messages)
+        self.assertTrue(len(self.chat._input_buffer) <= 16)
+
+    def test_grow_recv_buffer(self):
+        self.chat.recv_buffer_size = 1024
+        self.chat.recv_buffer_max_size = 2048
+        self.right.sendall(b'x' * 8192)
+        for size in [2048, 2048]:
+            select.select([self.chat.socket], [], [], 1)
+            self.chat.handle_read()
+            self.assertEqual(size, self.chat.recv_buffer_size)
+            self.assertEqual(size, self.chat.stats['recv_buffer_size'])
+        self.assertEqual(1024 + 2048, self.chat.stats['received_bytes'])
+        self.assertEqual(2, self.chat.stats['recv_calls'])
+
+    def test_shrink_recv_buffer(self):
+        self.chat.recv_buffer_size = 4096
+        self.chat.recv_buffer_min_size = 1024
+        self.chat.terminator = b'\r\n'
+        for size in [4096, 2048, 2048, 1024, 1024, 1024]:
+            self.receive(b'foo\r\n')
+            self.assertEqual(size, self.chat.recv_buffer_size)
+        self.assertEqual(1024, len(self.chat._input_buffer))
+
+    def test_discard_input_on_terminator(self):
+        def found_terminator():
+            self.chat.messages.append(b''.join(self.chat.inbox))
+            self.chat.discard_input_buffers()
+        self.chat.found_terminator = found_terminator
+        self.chat.terminator = b'\r\n'
+        self.receive(b'foo\r\nbar\r\n')
+        self.assertEqual([b'foo'], self.chat.messages)
+        self.assertEqual(b'', self.chat._input_buffer)
+
+    def test_pause_reading_on_inbox_high_watermark(self):
+        self.chat.inbox_high_watermark = 4
+        self.chat.inbox_low_watermark = 2
+        self.chat.terminator = b'\r\n'
+        self.receive(b'foo')
+        self.assertTrue(self.chat.readable())
+        self.receive(b'bar')
+        self.assertFalse(self.chat.readable())
+        self.chat.inbox.clear()
+        self.assertTrue(self.chat.readable())
+
+
+class AsyncChatSendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.map = {}
+        left, self.right = tcp_socketpair()
+        self.chat = terminatingchat(left, self.map)
+
+    def tearDown(self):
+        self.chat.close()
+        self.right.close()
+
+    def received(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.right.recv(size - len(data))
+        return data
+
+    def test_push(self):
+        self.chat.push(b'foo')
+        self.assertEqual(b'foo', self.received(3))
+        self.assertFalse(self.chat.outbox)
+        self.assertEqual(3, self.chat.stats['sent_bytes'])
+        self.assertEqual(1, self.chat.stats['last_flush_calls'])
+
+    def test_gather_queued_items(self):
+        self.chat.outbox.extend([b'foo', b'bar', b'baz'])
+        self.chat.flush()
+        self.assertEqual(b'foobarbaz', self.received(9))
+        self.assertEqual(9, self.chat.stats['last_flush_bytes'])
+        calls = 1 if asynclib._HAS_SENDMSG else 3
+        self.assertEqual(calls, self.chat.stats['last_flush_calls'])
+
+    def test_limit_send_size(self):
+        self.chat.send_buffer_size = 4
+        self.chat.outbox.extend([b'foo', b'barbaz'])
+        self.chat.flush()
+        self.assertEqual(b'foobarbaz', self.received(9))
+        self.assertEqual(3, self.chat.stats['last_flush_calls'])
+
+    def test_partial_send(self):
+        sent = []
+        def send(data):
+            sent.append(data[:2].tobytes())
+            return min(2, len(data)) if len(sent) < 4 else 0
+        self.chat.send = send
+        self.chat.send_gather_size = 1
+        self.chat.outbox.extend([b'foo', b'bar'])
+        self.chat.flush()
+        self.assertEqual([b'fo', b'o', b'ba', b'r'], sent)
+        self.assertEqual([b'bar'], list(self.chat.outbox))
+        self.assertEqual(2, self.chat._outbox_offset)
+        self.assertEqual(5, self.chat.stats['last_flush_bytes'])
+        self.assertTrue(self.chat.writable())
+
+    def test_skip_empty_items(self):
+        self.chat.outbox.extend([b'', b'foo', b''])
+        self.chat.flush()
+        self.assertEqual(b'foo', self.received(3))
+        self.assertFalse(self.chat.outbox)
+
+    def test_close_when_done(self):
+        self.chat.handle_close = track_call(self.chat.handle_close)
+        self.chat.outbox.append(b'foo')
+        self.chat.close_when_done()
+        self.chat.flush()
+        self.assertEqual(b'foo', self.received(3))
+        self.assertTrue(self.chat.handle_close.was_called)
+
+    def test_outbox_watermarks(self):
+        calls = []
+        self.chat.pause_writing = lambda: calls.append('pause')
+        self.chat.resume_writing = lambda: calls.append('resume')
+        self.chat.outbox_high_watermark = 4
+        self.chat.outbox_low_watermark = 2
+        send = self.chat.send
+        self.chat.send = lambda data: 0
+        self.chat.send_gather_size = 1
+        self.chat.push(b'foo')
+        self.assertEqual([], calls)
+        self.chat.push(b'bar')
+        self.assertEqual(['pause'], calls)
+        self.assertFalse(self.chat.readable())
+        self.chat.send = send
+        self.chat.flush()
+        self.assertEqual(b'foobar', self.received(6))
+        self.assertEqual(['pause', 'resume'], calls)
+        self.assertTrue(self.chat.readable())
+
+
 class CallLaterTests(unittest.TestCase):
     """Tests for CallLater class."""
 
@@ -387,10 +696,255 @@ class CallLaterTests(unittest.TestCase):
         self.assertEqual(l, [0.02, 0.03, 0.04])
 
 
+class TimingWheelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = asynclib.TimingWheel(0.1, 8)
+        self.calls = []
+
+    def call_later(self, seconds):
+        return self.wheel.call_later(seconds, self.calls.append, seconds)
+
+    def run_wheel(self, seconds):
+        self.wheel.run(time.time() + seconds)
+
+    def test_interface(self):
+        fun = lambda: 0
+        self.assertRaises(AssertionError, self.wheel.call_later, -1, fun)
+        x = self.wheel.call_later(3, fun)
+        self.assertEqual(1, len(self.wheel))
+        self.assertRaises(AssertionError, x.delay, -1)
+        self.assertTrue(x.cancelled is False)
+        x.cancel()
+        self.assertTrue(x.cancelled is True)
+        self.assertEqual(0, len(self.wheel))
+        self.assertRaises(AssertionError, x.call)
+        self.assertRaises(AssertionError, x.reset)
+        self.assertRaises(AssertionError, x.delay, 2)
+        self.assertRaises(AssertionError, x.cancel)
+
+    def test_order(self):
+        for x in [0.5, 0.4, 0.3, 0.2, 0.1]:
+            self.call_later(x)
+        self.run_wheel(0.25)
+        self.assertEqual([0.1, 0.2], self.calls)
+        self.run_wheel(1.0)
+        self.assertEqual([0.1, 0.2, 0.3, 0.4, 0.5], self.calls)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_error_in_call(self):
+        def fail():
+            raise ValueError('boom')
+        self.wheel.call_later(0.1, fail)
+        self.call_later(0.1)
+        self.call_later(0.2)
+        self.run_wheel(0.3)
+        self.assertEqual([0.1, 0.2], sorted(self.calls))
+        self.assertEqual(0, len(self.wheel))
+
+    def test_interrupted_run(self):
+        def interrupt():
+            raise KeyboardInterrupt
+        self.wheel.call_later(0.1, interrupt)
+        self.call_later(0.2)
+        self.call_later(0.3)
+        self.assertRaises(KeyboardInterrupt, self.run_wheel, 0.35)
+        self.assertEqual([], self.calls)
+        self.run_wheel(0.35)
+        self.assertEqual([0.2, 0.3], self.calls)
+
+    def test_fired_timer_is_cancelled(self):
+        x = self.call_later(0.1)
+        self.run_wheel(0.2)
+        self.assertTrue(x.cancelled)
+        self.assertRaises(AssertionError, x.reset)
+
+    def test_timeouts_longer_than_wheel(self):
+        self.call_later(2.0)
+        self.run_wheel(1.0)
+        self.assertEqual([], self.calls)
+        self.run_wheel(1.5)
+        self.assertEqual([], self.calls)
+        self.run_wheel(2.5)
+        self.assertEqual([2.0], self.calls)
+
+    def test_reset(self):
+        x = self.call_later(0.2)
+        tick = x._tick
+        x.timeout -= 1  # pretend it was armed a second ago
+        x.reset()
+        self.assertEqual(tick, x._tick)
+        self.run_wheel(0.1)
+        self.assertEqual([], self.calls)
+        self.run_wheel(0.3)
+        self.assertEqual([0.2], self.calls)
+
+    def test_postpone_by_reset(self):
+        x = self.call_later(0.2)
+        self.run_wheel(0.1)
+        x.timeout += 0.5
+        self.run_wheel(0.3)
+        self.assertEqual([], self.calls)
+        self.run_wheel(0.8)
+        self.assertEqual([0.2], self.calls)
+
+    def test_delay(self):
+        self.call_later(0.5).delay(0.1)
+        self.call_later(0.2).delay(0.7)
+        self.run_wheel(0.3)
+        self.assertEqual([0.5], self.calls)
+        self.run_wheel(1.0)
+        self.assertEqual([0.5, 0.2], self.calls)
+
+    def test_cancel(self):
+        self.call_later(0.1).cancel()
+        self.call_later(0.2)
+        self.call_later(0.3).cancel()
+        self.run_wheel(1.0)
+        self.assertEqual([0.2], self.calls)
+
+    def test_clear(self):
+        x = self.call_later(0.1)
+        self.wheel.clear()
+        self.assertTrue(x.cancelled)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_loop(self):
+        self.call_later(0.1)
+        asynclib.loop(0.1, {}, [], wheel=self.wheel)
+        self.assertEqual([0.1], self.calls)
+
+    def test_next_deadline(self):
+        self.assertTrue(self.wheel.next_deadline() is None)
+        x = self.call_later(0.5)
+        deadline = self.wheel.next_deadline()
+        self.assertTrue(deadline <= x.timeout)
+        self.assertTrue(deadline > x.timeout - 0.2)
+        x.cancel()
+        self.assertTrue(self.wheel.next_deadline() is None)
+
+    def test_closeall(self):
+        x = asynclib.call_timeout(1, lambda: 0)
+        asynclib.close_all()
+        self.assertTrue(x.cancelled)
+        self.assertEqual(0, len(asynclib._TIMING_WHEEL))
+
+
+class NextDeadlineTests(unittest.TestCase):
+
+    def setUp(self):
+        asynclib.close_all()
+        self.tasks = []
+        self.wheel = asynclib.TimingWheel(0.01)
+
+    def tearDown(self):
+        asynclib.close_all(tasks=self.tasks, wheel=self.wheel)
+
+    def call_later(self, seconds, *args):
+        return asynclib.call_later(seconds, *args, _tasks=self.tasks)
+
+    def test_no_calls(self):
+        self.assertTrue(asynclib.next_deadline(self.tasks, self.wheel) is None)
+
+    def test_earliest_call(self):
+        x = self.call_later(0.5, lambda: 0)
+        self.assertEqual(x.timeout,
+                         asynclib.next_deadline(self.tasks, self.wheel))
+        y = self.wheel.call_later(0.05, lambda: 0)
+        deadline = asynclib.next_deadline(self.tasks, self.wheel)
+        self.assertTrue(deadline <= y.timeout)
+
+    def test_global_calls(self):
+        x = asynclib.call_later(0.5, lambda: 0)
+        self.assertEqual(x.timeout, asynclib.next_deadline())
+
+    def test_sleep_without_channels(self):
+        calls = []
+        self.call_later(0.05, calls.append, 1)
+        start = time.time()
+        while not calls and time.time() - start < 1:
+            asynclib.loop(10, {}, self.tasks, count=1, wheel=self.wheel)
+        self.assertEqual([1], calls)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_poll_till_deadline(self):
+        calls = []
+        left, right = tcp_socketpair()
+        map = {}
+        channel = recordingdispatcher(left, map)
+        try:
+            self.wheel.call_later(0.05, calls.append, 1)
+            start = time.time()
+            while not calls and time.time() - start < 1:
+                asynclib.loop(10, map, self.tasks, count=1, wheel=self.wheel)
+            self.assertEqual([1], calls)
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            channel.close()
+            right.close()
+
+
+class CallSoonThreadsafeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.map = {}
+        self.calls = []
+        left, self.right = tcp_socketpair()
+        self.channel = recordingdispatcher(left, self.map)
+
+    def tearDown(self):
+        asynclib.close_all(self.map)
+        self.right.close()
+
+    def call(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    def test_wakeup_loop(self):
+        def producer():
+            time.sleep(0.05)
+            asynclib.call_soon_threadsafe(self.call, 1, foo='bar',
+                                          _map=self.map)
+        thread = threading.Thread(target=producer)
+        thread.start()
+        start = time.time()
+        asynclib.loop(10, self.map, count=1)
+        thread.join()
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual([((1,), {'foo': 'bar'})], self.calls)
+
+    def test_call_queued_before_loop(self):
+        asynclib.call_soon_threadsafe(self.call, 1, _map=self.map)
+        asynclib.loop(10, self.map, count=1)
+        self.assertEqual([((1,), {})], self.calls)
+
+    def test_waker_does_not_keep_loop(self):
+        map = {}
+        start = time.time()
+        asynclib.loop(10, map)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual({}, map)
+        self.assertFalse(id(map) in asynclib._WAKERS)
+
+    def test_reuse_waker(self):
+        asynclib.loop(0.01, self.map, count=1)
+        channels = set(self.map.values())
+        self.assertEqual(2, len(channels))
+        asynclib.loop(0.01, self.map, count=1)
+        self.assertEqual(channels, set(self.map.values()))
+
+    def test_waker_is_removed_after_loop(self):
+        asynclib.loop(0.01, self.map, count=1)
+        self.channel.close()
+        asynclib.loop(0.01, self.map)
+        self.assertEqual({}, self.map)
+        self.assertFalse(id(self.map) in asynclib._WAKERS)
+
 
 def test_main():
     tests = [HelperFunctionTests, DispatcherTests, DispatcherWithSendTests,
-             CallLaterTests, DispatcherWithSendTests_UsePoll]
+             AsyncChatReadTests, AsyncChatSendTests, CallLaterTests,
+             TimingWheelTests, NextDeadlineTests, CallSoonThreadsafeTests,
+             DispatcherWithSendTests_UsePoll, SelectorsBackendTests]
 
     run_unittest(*tests)
 
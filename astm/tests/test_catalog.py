@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from astm import codec
+from astm.archive import BlockArchiveReader, BlockArchiveWriter, CaptureReader
+from astm.catalog import Catalog, CatalogSink, DEFAULT_KEYS
+from astm.constants import ENQ, EOT
+from astm.tests.utils import make_session
+
+
+def make_order_session(timestamp, patient_id, barcode, tests):
+    header = ['H', [[None], [None, '&']]] + [None] * 11 + [timestamp]
+    records = [['P', '1', patient_id],
+               ['O', '1', [barcode, '1'], 'S' + barcode]]
+    for idx, test in enumerate(tests):
+        records.append(['R', str(idx + 1), [None, None, None, test], '1'])
+    return make_session(*records, header=header)
+
+
+class CatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'capture')
+        with open(self.path, 'wb') as fobj:
+            fobj.write(make_order_session('20130101100000', 'PID1', '001',
+                                    ['GLU', 'NA']))
+            fobj.write(make_order_session('20130102100000', 'PID2', '002',
+                                    ['GLU']))
+            fobj.write(make_order_session('20130103100000', 'PID1', '003',
+                                    ['K']))
+        self.reader = CaptureReader(self.path)
+        self.addCleanup(self.reader.close)
+        self.catalog = Catalog(os.path.join(self.tmpdir, 'catalog'))
+        self.addCleanup(self.catalog.close)
+
+    def test_find(self):
+        self.assertEqual(3, self.catalog.update(self.reader))
+        self.assertEqual([0, 2], self.catalog.find('patient_id', 'PID1'))
+        self.assertEqual([1], self.catalog.find('barcode', '002'))
+        self.assertEqual([0, 1], self.catalog.find('test', 'GLU'))
+        self.assertEqual([], self.catalog.find('test', 'CL'))
+
+    def test_timestamps(self):
+        self.catalog.update(self.reader)
+        self.assertEqual('20130102100000', self.catalog.timestamp(1))
+        self.assertEqual([1, 2], self.catalog.between('20130102'))
+        self.assertEqual([0], self.catalog.between(stop='20130102'))
+        self.assertRaises(KeyError, self.catalog.timestamp, 3)
+
+    def test_incremental_update(self):
+        self.catalog.update(self.reader)
+        with open(self.path, 'ab') as fobj:
+            fobj.write(make_order_session('20130104100000', 'PID3', '004', ['K']))
+            fobj.write(ENQ)
+        self.reader.refresh()
+        self.assertEqual(1, self.catalog.update(self.reader))
+        self.assertEqual(4, len(self.catalog))
+        self.assertEqual([2, 3], self.catalog.find('test', 'K'))
+        self.assertEqual(0, self.catalog.update(self.reader))
+
+    def test_persistent(self):
+        self.catalog.update(self.reader)
+        path = self.catalog.path
+        with Catalog(path) as catalog:
+            self.assertEqual(3, len(catalog))
+            self.assertEqual([2], catalog.find('barcode', '003'))
+
+    def test_custom_keys(self):
+        keys = dict(DEFAULT_KEYS, barcode=['O.4'])
+        with Catalog(':memory:', keys) as catalog:
+            catalog.update(self.reader)
+            self.assertEqual([1], catalog.find('barcode', 'S002'))
+
+    def test_skip_broken_messages(self):
+        with open(self.path, 'ab') as fobj:
+            message = codec.encode_message(1, [['P', '1', 'PID4']], 'ascii')
+            fobj.write(ENQ + message[:-4] + b'00\r\n' + EOT)
+            fobj.write(make_order_session('20130105100000', 'PID5', '005', ['K']))
+        self.reader.refresh()
+        self.assertEqual(5, self.catalog.update(self.reader))
+        self.assertEqual([3], [num for num, error in self.catalog.errors()])
+        self.assertEqual([4], self.catalog.find('patient_id', 'PID5'))
+        self.assertEqual(0, self.catalog.update(self.reader))
+
+    def test_sink(self):
+        path = os.path.join(self.tmpdir, 'archive')
+        sink = CatalogSink(self.catalog, BlockArchiveWriter(path))
+        sink.write(make_order_session('20130101100000', 'PID1', '001', ['GLU']))
+        sink.write(make_order_session('20130102100000', 'PID2', '002', ['K']))
+        sink.flush()
+        self.assertEqual([1], self.catalog.find('patient_id', 'PID2'))
+        with BlockArchiveReader(path) as reader:
+            self.assertEqual(0, self.catalog.update(reader))
+            self.assertEqual(2, reader.closed_sessions_count)
+        sink.sink.close()
+
+    def test_sink_flushes_before_indexing(self):
+        calls = []
+
+        class Sink(object):
+            def write(self, data):
+                calls.append('write')
+
+            def flush(self):
+                calls.append('flush')
+
+        add = self.catalog.add
+        def track_add(data):
+            calls.append('add')
+            return add(data)
+        self.catalog.add = track_add
+        sink = CatalogSink(self.catalog, Sink())
+        sink.write(make_order_session('20130101100000', 'PID1', '001', ['GLU']))
+        self.assertEqual(['write', 'flush', 'add'], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -300,6 +300,17 @@ class ClientTestCase(unittest.TestCase):
         self.assertEqual(client.outbox[-2], constants.EOT)
         self.assertEqual(client.outbox[-1], None)
 
+    def test_defer_records_while_writing_paused(self):
+        client = DummyClient(simple_emitter)
+        client.handle_connect()
+        client.writing_paused = True
+        client.on_ack()
+        self.assertEqual([constants.ENQ], list(client.outbox))
+        client.writing_paused = False
+        client.resume_writing()
+        self.assertEqual(2, len(client.outbox))
+        self.assertEqual(b'1H', client.outbox[-1][1:3])
+
     def test_chunked_response(self):
         def emitter():
             assert (yield ['H', 'foo', 'bar'])
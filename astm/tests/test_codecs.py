@@ -10,7 +10,12 @@
 import unittest
 from astm import codec
 from astm.compat import u
-from astm.constants import STX, ETX, ETB, CR, LF, CRLF
+from astm.tests.utils import track_call
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from astm.constants import STX, ETX, ETB, ENQ, EOT, CR, LF, CRLF
 
 def f(s, e='latin-1'):
     return u(s).format(STX=u(STX),
@@ -112,6 +117,262 @@ class DecodeRecordTestCase(unittest.TestCase):
         self.assertEqual(res, codec.decode_record(msg, 'utf8'))
 
 
+class CodecTestCase(unittest.TestCase):
+
+    def test_default_delimiters(self):
+        c = codec.get_codec()
+        self.assertEqual(b'|\\^&', c.delimiters)
+        msg = f('{STX}1A|B^C\\D^E|F{CR}{ETX}E6{CRLF}')
+        self.assertEqual(codec.decode(msg), c.decode(msg))
+
+    def test_custom_delimiters(self):
+        c = codec.get_codec(b'!~`#')
+        msg = c.encode_message(1, [['H', 'A'], ['R', ['B', 'C'], 'D|E']],
+                               'ascii')
+        self.assertEqual(f('{STX}1H!A{CR}R!B`C!D|E{CR}{ETX}76{CRLF}'), msg)
+        seq, records, cs = c.decode_message(msg, 'ascii')
+        self.assertEqual([['H', 'A'], ['R', ['B', 'C'], 'D|E']], records)
+
+    def test_custom_repeated_components(self):
+        c = codec.get_codec(b'!~`#')
+        record = ['A', [['B', 'C'], ['D', 'E']], 'F']
+        data = c.encode_record(record, 'ascii')
+        self.assertEqual(b'A!B`C~D`E!F', data)
+        self.assertEqual(record, c.decode_record(data, 'ascii'))
+        self.assertEqual(record, codec.LazyRecord(data, 'ascii', codec=c))
+
+    def test_cache_codecs(self):
+        self.assertTrue(codec.get_codec(b'!~`#') is codec.get_codec(b'!~`#'))
+        self.assertTrue(codec.get_codec() is codec.get_codec(b'|\\^&'))
+
+    def test_fail_on_invalid_delimiters(self):
+        self.assertRaises(ValueError, codec.Codec, b'|\\^')
+        self.assertRaises(ValueError, codec.Codec, b'|\\^|')
+        self.assertRaises(ValueError, codec.Codec, b'|\\^A')
+        self.assertRaises(ValueError, codec.Codec, b'|\\^\r')
+
+    def test_header_delimiters(self):
+        msg = codec.encode_message(1, [['H', [[None], [None, '&']]]], 'ascii')
+        self.assertEqual(b'|\\^&', codec.get_header_delimiters(msg))
+        msg = codec.encode_message(1, [['P', '1']], 'ascii')
+        self.assertTrue(codec.get_header_delimiters(msg) is None)
+
+
+class LazyRecordTestCase(unittest.TestCase):
+
+    def test_equal_to_decoded_record(self):
+        msg = f('P|1|2776833|||ABC^D\\E^F||||||||||||||||||||')
+        record = codec.LazyRecord(msg, 'ascii')
+        self.assertEqual(codec.decode_record(msg, 'ascii'), record)
+        self.assertEqual(record, codec.decode_record(msg, 'ascii'))
+
+    def test_decode_on_access(self):
+        msg = f('R|1|^^^GLU|5.4|mmol/L')
+        record = codec.LazyRecord(msg, 'ascii')
+        self.assertEqual(5, len(record))
+        self.assertEqual('5.4', record[3])
+        self.assertEqual([3], list(record._values))
+        self.assertEqual('mmol/L', record[-1])
+        self.assertEqual([None, None, None, 'GLU'], record[2])
+        self.assertEqual(['R', '1'], record[:2])
+        self.assertRaises(IndexError, record.__getitem__, 5)
+
+    def test_decode_message(self):
+        msg = f('{STX}1A|B|C|D{CR}E|F{CR}{ETX}BF{CRLF}')
+        frame = msg[1:-4]
+        seq, records = codec.decode_frame(frame, 'ascii', lazy=True)
+        self.assertEqual(1, seq)
+        self.assertTrue(isinstance(records[0], codec.LazyRecord))
+        self.assertEqual([['A', 'B', 'C', 'D'], ['E', 'F']], records)
+
+
+class ProjectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.message = codec.encode_message(1, [
+            ['H', [[None], [None, '&']]],
+            ['P', '1'],
+            ['R', '1', [None, None, None, 'GLU'], '5.4', 'mmol/L'],
+            ['C', '1', 'comment'],
+            ['L', '1', 'N']
+        ], 'ascii')
+
+    def test_skip_records(self):
+        seq, records, cs = codec.decode_message(self.message, 'ascii',
+                                                projection={'R': None})
+        self.assertEqual([['R', '1', [None, None, None, 'GLU'], '5.4',
+                           'mmol/L']], records)
+
+    def test_skip_fields(self):
+        seq, records, cs = codec.decode_message(self.message, 'ascii',
+                                                projection={'R': [3],
+                                                            'L': None})
+        self.assertEqual([['R', None, None, '5.4', None], ['L', '1', 'N']],
+                         records)
+
+    def test_lazy(self):
+        seq, records, cs = codec.decode_message(self.message, 'ascii', True,
+                                                projection={'P': [1]})
+        self.assertEqual(1, len(records))
+        self.assertTrue(isinstance(records[0], codec.LazyRecord))
+        self.assertEqual(['P', '1'], records[0])
+
+    def test_verify_checksum(self):
+        message = self.message[:-4] + b'00\r\n'
+        self.assertRaises(AssertionError, codec.decode_message, message,
+                          'ascii', projection={'R': None})
+
+    def test_frame(self):
+        seq, records = codec.decode_frame(b'1P|1\rR|1|A\r\x03', 'ascii',
+                                          projection={'R': [2]})
+        self.assertEqual(1, seq)
+        self.assertEqual([['R', None, 'A']], records)
+
+    def test_make_projection(self):
+        self.assertEqual({b'R': frozenset([0, 2]), b'O': None},
+                         codec.make_projection({'R': [2], 'O': None}))
+
+    def test_keep_normalized_projection(self):
+        projection = codec.make_projection({'R': [3]})
+        make_projection = codec.make_projection
+        codec.make_projection = track_call(make_projection)
+        try:
+            seq, records, cs = codec.decode_message(self.message, 'ascii',
+                                                    projection=projection)
+            self.assertFalse(codec.make_projection.was_called)
+        finally:
+            codec.make_projection = make_projection
+        self.assertEqual([['R', None, None, '5.4', None]], records)
+
+
+class InternCacheTestCase(unittest.TestCase):
+
+    def test_share_repeated_values(self):
+        cache = codec.InternCache()
+        msg = codec.encode_message(1, [['R', '1', 'GLU', 'mg/dL'],
+                                       ['R', '2', 'GLU', 'mg/dL']], 'ascii')
+        seq, records, cs = codec.decode_message(msg, 'ascii', cache=cache)
+        self.assertEqual([['R', '1', 'GLU', 'mg/dL'],
+                          ['R', '2', 'GLU', 'mg/dL']], records)
+        self.assertTrue(records[0][2] is records[1][2])
+        self.assertTrue(records[0][3] is records[1][3])
+        self.assertEqual(3, cache.hits)
+        self.assertEqual(5, cache.misses)
+        self.assertEqual(3 / 8., cache.hit_rate)
+
+    def test_components(self):
+        cache = codec.InternCache()
+        data = b'R|A^B\\A^B'
+        record = codec.decode_record(data, 'ascii', cache)
+        self.assertEqual(['R', [['A', 'B'], ['A', 'B']]], record)
+        self.assertTrue(record[1][0][0] is record[1][1][0])
+
+    def test_lazy_records(self):
+        cache = codec.InternCache()
+        msg = codec.encode_message(1, [['R', 'GLU'], ['R', 'GLU']], 'ascii')
+        seq, records, cs = codec.decode_message(msg, 'ascii', True, cache)
+        self.assertTrue(records[0][1] is records[1][1])
+
+    def test_maxsize(self):
+        cache = codec.InternCache(2)
+        for value in (b'A', b'B', b'C'):
+            cache.decode(value, 'ascii')
+        self.assertEqual(2, len(cache))
+        cache.decode(b'A', 'ascii')
+        self.assertEqual(0, cache.hits)
+        cache.decode(b'C', 'ascii')
+        self.assertEqual(1, cache.hits)
+
+    def test_evict_least_recently_used(self):
+        cache = codec.InternCache(2)
+        cache.decode(b'A', 'ascii')
+        cache.decode(b'B', 'ascii')
+        cache.decode(b'A', 'ascii')
+        cache.decode(b'C', 'ascii')
+        self.assertEqual(1, cache.hits)
+        cache.decode(b'A', 'ascii')
+        self.assertEqual(2, cache.hits)
+        cache.decode(b'B', 'ascii')
+        self.assertEqual(2, cache.hits)
+
+    def test_skip_long_values(self):
+        cache = codec.InternCache(max_length=4)
+        cache.decode(b'long text', 'ascii')
+        self.assertEqual(0, len(cache))
+
+    def test_stats(self):
+        cache = codec.InternCache(10)
+        cache.decode(b'A', 'ascii')
+        cache.decode(b'A', 'ascii')
+        self.assertEqual({'size': 1, 'maxsize': 10, 'hits': 1, 'misses': 1,
+                          'hit_rate': 0.5}, cache.stats())
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0.0, cache.hit_rate)
+
+
+class StreamDecoderTestCase(unittest.TestCase):
+
+    def test_decode_message(self):
+        decoder = codec.StreamDecoder('ascii')
+        msg = f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}')
+        self.assertEqual([(1, [['A', 'B', 'C', 'D']], 'BF')],
+                         decoder.feed(msg))
+
+    def test_decode_by_single_bytes(self):
+        decoder = codec.StreamDecoder('ascii')
+        msg = f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}')
+        res = []
+        for idx in range(len(msg)):
+            res.extend(decoder.feed(msg[idx:idx + 1]))
+        self.assertEqual([(1, [['A', 'B', 'C', 'D']], 'BF')], res)
+
+    def test_emit_control_chars(self):
+        decoder = codec.StreamDecoder('ascii')
+        data = ENQ + f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}') + EOT
+        res = decoder.feed(data)
+        self.assertEqual([ENQ, (1, [['A', 'B', 'C', 'D']], 'BF'), EOT], res)
+
+    def test_join_chunks(self):
+        decoder = codec.StreamDecoder()
+        recs = [['foo', '1'], ['bar', '24'], ['baz', ['1', '2', '3'], 'boo']]
+        chunks = codec.encode(recs, size=14)
+        res = []
+        for chunk in chunks:
+            res.extend(decoder.feed(chunk))
+        self.assertEqual(1, len(res))
+        self.assertEqual(recs, res[0][1])
+
+    def test_recover_after_checksum_failure(self):
+        decoder = codec.StreamDecoder('ascii')
+        data = (f('{STX}1A|B{CR}{ETX}40{CRLF}') + ENQ +
+                f('{STX}1A|B{CR}{ETX}00{CRLF}') +
+                f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}'))
+        self.assertRaises(AssertionError, decoder.feed, data)
+        res = decoder.feed(b'')
+        self.assertEqual(3, len(res))
+        self.assertEqual(ENQ, res[1])
+        self.assertEqual((1, [['A', 'B', 'C', 'D']], 'BF'), res[2])
+
+
+class FindFrameEndTestCase(unittest.TestCase):
+
+    def test_last_frame(self):
+        data = ENQ + f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}') + EOT
+        self.assertEqual((len(data) - 1, True), codec.find_frame_end(data, 1))
+
+    def test_intermediate_frame(self):
+        data = b''.join(codec.encode([['foo', '1'], ['bar', '24']], size=14))
+        stop, last = codec.find_frame_end(data, 0)
+        self.assertFalse(last)
+        self.assertEqual(f('{ETB}'), data[stop - 5:stop - 4])
+
+    def test_incomplete_frame(self):
+        data = f('{STX}1A|B|C|D{CR}{ETX}B')
+        self.assertEqual((len(data) + 3, True), codec.find_frame_end(data, 0))
+        self.assertEqual(None, codec.find_frame_end(data, 0, len(data) - 2))
+
+
 class EncodeTestCase(unittest.TestCase):
 
     def test_encode(self):
@@ -124,6 +385,23 @@ class EncodeTestCase(unittest.TestCase):
         seq, data, cs = codec.decode_message(msg, 'ascii')
         self.assertEqual(msg, codec.encode_message(seq, data, 'ascii'))
 
+    def test_encode_into(self):
+        records = [['A', 'B', 'C', 'D'], ['E', ['F', 'G']]]
+        msg = codec.encode_message(3, records, 'ascii')
+        buf = bytearray(b'foo')
+        self.assertEqual(len(msg), codec.encode_into(buf, 3, records, 'ascii'))
+        self.assertEqual(b'foo' + msg, bytes(buf))
+
+    def test_encode_into_memoryview(self):
+        records = [['A', 'B', 'C', 'D']]
+        msg = codec.encode_message(1, records, 'ascii')
+        buf = bytearray(len(msg) + 2)
+        size = codec.encode_into(memoryview(buf), 1, records, 'ascii', 2)
+        self.assertEqual(len(msg), size)
+        self.assertEqual(b'\x00\x00' + msg, bytes(buf))
+        self.assertRaises(ValueError, codec.encode_into,
+                          memoryview(buf), 1, records, 'ascii', 3)
+
     def test_encode_record(self):
         msg = b'A|B^C\D^E|F^G|H'
         record = codec.decode_record(msg, 'ascii')
@@ -191,6 +469,21 @@ class ChunkedEncodingTestCase(unittest.TestCase):
         self.assertEqual(res[3], f('{STX}43|boo{CR}{ETX}33{CRLF}'))
         self.assertLessEqual(len(res[3]), 14)
 
+    def test_iter_split(self):
+        recs = [['foo', 1], ['bar', 24], ['baz', [1, 2, 3], 'boo']]
+        msg = codec.encode_message(1, recs, 'ascii')
+        for size in range(8, 40):
+            self.assertEqual(list(codec.split(msg, size)),
+                             list(codec.iter_split(recs, size)))
+
+    def test_split_keeps_seq_for_single_chunk(self):
+        msg = codec.encode_message(1, [['foo', 1]], 'ascii')
+        self.assertEqual([msg], list(codec.split(msg, len(msg) - 1)))
+
+    def test_make_chunks(self):
+        self.assertEqual([b'abc', b'def', b'g'], codec.make_chunks(b'abcdefg', 3))
+        self.assertEqual([b'abc', b'def'], codec.make_chunks(b'abcdef', 3))
+        self.assertEqual([], codec.make_chunks(b'', 3))
 
     def test_decode_chunks(self):
         recs = [['foo', 1], ['bar', 24], ['baz', [1, 2, 3], 'boo']]
@@ -229,6 +522,37 @@ class ChecksummTestCase(unittest.TestCase):
     def test_short(self):
         self.assertEqual(b'02', codec.make_checksum('\x02'))
 
+    def test_running_checksum(self):
+        msg = u('2P|1|2776833|||王^大^明||||||||||||||||||||\x0D\x03').encode('utf8')
+        cs = codec.Checksum()
+        for idx in range(0, len(msg), 5):
+            cs.update(msg[idx:idx + 5])
+        self.assertEqual(b'4B', cs.digest())
+        self.assertEqual(codec.make_checksum(msg), cs.digest())
+
+    def test_verify_many(self):
+        msgs = [f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}'),
+                f('{STX}1A|B|C|D{CR}{ETX}00{CRLF}'),
+                f('{STX}1A|B|C|D{CR}{ETX}bf{CRLF}'),
+                f('{STX}2A|0{CR}{ETB}2F{CRLF}'),
+                f('{STX}2A|0{CR}{ETB}2F'),
+                f('{CRLF}'),
+                f('{STX}1A|B{CR}{ETX}40{CRLF}')]
+        res = [True, False, False, False, False, False, True]
+        self.assertEqual(res, codec.verify_many(msgs, use_numpy=False))
+
+    @unittest.skipIf(numpy is None, 'NumPy is not available')
+    def test_verify_many_numpy(self):
+        msgs = [f('{STX}1A|B|C|D{CR}{ETX}BF{CRLF}'),
+                f('{STX}1A|B|C|D{CR}{ETX}00{CRLF}'),
+                f('{STX}1A|B|C|D{CR}{ETX}bf{CRLF}'),
+                f('{STX}2A|0{CR}{ETB}2F{CRLF}'),
+                f('{STX}2A|0{CR}{ETB}2F'),
+                f('{CRLF}'),
+                f('{STX}1A|B{CR}{ETX}40{CRLF}')]
+        self.assertEqual(codec.verify_many(msgs, use_numpy=False),
+                         codec.verify_many(msgs, use_numpy=True))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import math
+import unittest
+from array import array
+from astm import codec
+from astm.columnar import decode_columns, parse_path
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MESSAGES = [
+    codec.encode_message(1, [
+        ['H', [[None], [None, '&']]],
+        ['P', '1', None, 'PID1'],
+        ['R', '1', [None, None, None, 'GLU'], '5.4', 'mmol/L'],
+        ['C', '1', 'comment'],
+        ['R', '2', [None, None, None, 'NA'], '140', 'mmol/L'],
+        ['L', '1', 'N']
+    ], 'ascii'),
+    codec.encode_message(1, [
+        ['R', '1', [None, None, None, 'K'], None],
+        ['P', '2', None, 'PID2'],
+    ], 'ascii')
+]
+
+
+class ParsePathTestCase(unittest.TestCase):
+
+    def test_field(self):
+        self.assertEqual((b'R', 3, None), parse_path('R.4'))
+
+    def test_component(self):
+        self.assertEqual((b'R', 2, 3), parse_path('R.3.4'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_path, 'R')
+        self.assertRaises(ValueError, parse_path, 'R.x')
+        self.assertRaises(ValueError, parse_path, 'R.0')
+        self.assertRaises(ValueError, parse_path, 'R.1.2.3')
+
+
+class DecodeColumnsTestCase(unittest.TestCase):
+
+    def test_text_columns(self):
+        columns = decode_columns(MESSAGES, ['R.3.4', 'R.5', 'P.4'])
+        self.assertEqual(['GLU', 'NA', 'K'], columns['R.3.4'])
+        self.assertEqual(['mmol/L', 'mmol/L', None], columns['R.5'])
+        self.assertEqual(['PID1', 'PID2'], columns['P.4'])
+
+    def test_share_repeated_values(self):
+        columns = decode_columns(MESSAGES, ['R.5'])
+        self.assertTrue(columns['R.5'][0] is columns['R.5'][1])
+
+    def test_float_column(self):
+        columns = decode_columns(MESSAGES, ['R.4'], types={'R.4': 'd'},
+                                 use_numpy=False)
+        column = columns['R.4']
+        self.assertTrue(isinstance(column, array))
+        self.assertEqual([5.4, 140.0], list(column[:2]))
+        self.assertTrue(math.isnan(column[2]))
+
+    def test_int_column(self):
+        columns = decode_columns(MESSAGES, ['R.2'], types={'R.2': 'i'},
+                                 use_numpy=False)
+        self.assertEqual(array('i', [1, 2, 1]), columns['R.2'])
+
+    def test_fail_on_empty_int_value(self):
+        self.assertRaises(ValueError, decode_columns, MESSAGES, ['R.4'],
+                          types={'R.4': 'i'}, use_numpy=False)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_column(self):
+        columns = decode_columns(MESSAGES, ['R.2'], types={'R.2': 'i'},
+                                 use_numpy=True)
+        self.assertTrue(isinstance(columns['R.2'], numpy.ndarray))
+        self.assertEqual([1, 2, 1], columns['R.2'].tolist())
+
+    def test_frames_and_records(self):
+        data = [b'1R|1|^^^GLU|5.4\rR|2|^^^NA|140\r\x03', b'R|3|^^^K|4']
+        columns = decode_columns(data, ['R.2', 'R.3.4'])
+        self.assertEqual(['1', '2', '3'], columns['R.2'])
+        self.assertEqual(['GLU', 'NA', 'K'], columns['R.3.4'])
+
+    def test_custom_header_delimiters(self):
+        c = codec.get_codec(b'!~`#')
+        message = c.encode_message(1, [
+            ['H', [[None], [None, '#']]],
+            ['R', '1', [None, None, None, 'GLU'], '5.4'],
+        ], 'ascii')
+        columns = decode_columns([message], ['R.3.4'])
+        self.assertEqual(['GLU'], columns['R.3.4'])
+
+    def test_fail_on_bad_checksum(self):
+        message = MESSAGES[1][:-4] + b'00\r\n'
+        self.assertRaises(AssertionError, decode_columns, [message], ['R.4'])
+        columns = decode_columns([message], ['R.2'], verify=False)
+        self.assertEqual(['1'], columns['R.2'])
+
+    def test_fail_on_chunks(self):
+        chunks = codec.split(MESSAGES[0], 20)
+        self.assertRaises(ValueError, decode_columns, chunks, ['R.4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
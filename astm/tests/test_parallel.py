@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+
+import os
+import tempfile
+import unittest
+from astm import codec
+from astm.constants import ACK, ENQ, EOT
+from astm.omnilab.server import RecordsDispatcher
+from astm.parallel import decode_archive, iter_messages, to_dict
+from astm.tests.utils import make_session
+
+try:
+    import concurrent.futures
+except ImportError:
+    concurrent = None
+
+
+def record_type(record):
+    return record[0]
+
+
+class IterMessagesTestCase(unittest.TestCase):
+
+    def test_skip_control_characters(self):
+        data = make_session(['P', '1']) + ACK + make_session(['P', '2'])
+        messages = list(iter_messages(data))
+        self.assertEqual(2, len(messages))
+        self.assertEqual([['H', [[None], [None, '&']]], ['P', '1'],
+                          ['L', '1', 'N']], codec.decode(messages[0]))
+
+    def test_join_chunks(self):
+        message = codec.encode_message(1, [['P', '1', 'x' * 100]], 'ascii')
+        data = ENQ + b''.join(codec.split(message, 32)) + EOT
+        self.assertEqual([message], list(iter_messages(data)))
+
+    def test_skip_incomplete_message(self):
+        message = codec.encode_message(1, [['P', '1']], 'ascii')
+        data = message + message[:-5]
+        self.assertEqual([message], list(iter_messages(bytearray(data))))
+
+
+class DecodeArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data = b''.join(make_session(['P', str(i)]) for i in range(10))
+
+    def test_decode_in_process(self):
+        results = list(decode_archive([self.data], workers=0,
+                                      transform=record_type))
+        self.assertEqual([['H', 'P', 'L']] * 10, results)
+
+    @unittest.skipIf(concurrent is None, 'concurrent.futures is required')
+    def test_decode_ordered(self):
+        results = list(decode_archive([self.data], workers=2,
+                                      transform=to_dict, batch_size=3))
+        self.assertEqual(10, len(results))
+        self.assertEqual([['P', str(i)] for i in range(10)],
+                         [records[1] for records in results])
+
+    @unittest.skipIf(concurrent is None, 'concurrent.futures is required')
+    def test_decode_unordered(self):
+        results = list(decode_archive([self.data], workers=2, ordered=False,
+                                      transform=record_type, batch_size=3))
+        self.assertEqual([['H', 'P', 'L']] * 10, results)
+
+    def test_decode_files(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(self.data)
+        results = list(decode_archive([path, memoryview(self.data)],
+                                      workers=0, transform=record_type))
+        self.assertEqual(20, len(results))
+
+    @unittest.skipIf(concurrent is None, 'concurrent.futures is required')
+    def test_wrap_records(self):
+        results = list(decode_archive([self.data], workers=1,
+                                      dispatcher=RecordsDispatcher))
+        patient = results[0][1]
+        self.assertTrue(isinstance(patient, dict))
+        self.assertEqual('P', patient['type'])
+        self.assertEqual(0, patient['seq'])
+
+    def test_skip_broken_messages(self):
+        broken = codec.encode_message(1, [['P', 'x']], 'ascii')
+        broken = broken[:-4] + b'00\r\n'
+        data = ENQ + broken + EOT + self.data
+        results = list(decode_archive([data], workers=0,
+                                      transform=record_type))
+        self.assertEqual([['H', 'P', 'L']] * 10, results)
+
+    def test_skip_invalid_header_delimiters(self):
+        header = codec.encode_message(1, [['H', 'AAA']], 'ascii')
+        data = self.data + ENQ + header + EOT + self.data
+        results = list(decode_archive([data], workers=0, batch_size=3,
+                                      transform=record_type))
+        self.assertEqual([['H', 'P', 'L']] * 20, results)
+
+    def test_custom_delimiters(self):
+        c = codec.get_codec(b'!~`#')
+        data = ENQ + c.encode_message(1, [['H', [[None], [None, '#']]],
+                                          ['P', '1', ['A', 'B']]],
+                                      'ascii') + EOT
+        results = list(decode_archive([data], workers=0))
+        self.assertEqual(['P', '1', ['A', 'B']], results[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,13 +8,28 @@
 #
 
 import os
+import select
+import shutil
+import signal
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from io import BytesIO
 from astm.exceptions import NotAccepted, InvalidState
-from astm.server import RequestHandler, BaseRecordsDispatcher
-from astm import codec, constants, records
+from astm.server import (
+    RequestHandler, BaseRecordsDispatcher, PreforkServer, Server
+)
+from astm import asynclib, codec, constants, records
 from astm.tests.utils import DummyMixIn, track_call
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 
 def null_dispatcher(*args, **kwargs):
     pass
@@ -33,8 +48,10 @@ class DummyRequestHandler(DummyMixIn, RequestHandler):
         self.dummy_dispatcher_called_time += 1
         return super(DummyRequestHandler, self).dispatch(data)
 
-    def recv(self, size):
-        return codec.encode([records.HeaderRecord().to_astm()])[0]
+    def recv_into(self, buffer, size=0):
+        data = codec.encode([records.HeaderRecord().to_astm()])[0]
+        buffer[:len(data)] = data
+        return len(data)
 
 
 class RequestHandlerTestCase(unittest.TestCase):
@@ -98,11 +115,58 @@ class RequestHandlerTestCase(unittest.TestCase):
         self.assertTrue(self.req.dispatcher.was_called)
         self.assertFalse(self.req._chunks)
 
+    def test_switch_codec_by_header(self):
+        dispatcher = BaseRecordsDispatcher()
+        dispatcher.dispatch['R'] = track_call(lambda record: record)
+        req = DummyRequestHandler(dispatcher)
+        req.on_enq()
+        c = codec.get_codec(b'!~`#')
+        req._last_recv_data = c.encode_message(1, [['H', '~`#']], 'ascii')
+        self.assertEqual(req.on_message(), constants.ACK)
+        self.assertTrue(req.codec is c)
+        self.assertTrue(dispatcher.codec is c)
+        req._last_recv_data = c.encode_message(2, [['R', '1', ['A', 'B']]],
+                                               'ascii')
+        self.assertEqual(req.on_message(), constants.ACK)
+        self.assertTrue(dispatcher.dispatch['R'].was_called)
+
+    def test_keep_codec_on_chunk_continuation(self):
+        req = DummyRequestHandler(BaseRecordsDispatcher())
+        req.on_enq()
+        chunks = codec.encode([['H', '\\^&', '', '', '123456789HAAAAxyz']],
+                              size=24)
+        self.assertEqual(b'2HAAAA', chunks[1][1:7])
+        for chunk in chunks:
+            req._last_recv_data = chunk
+            self.assertEqual(req.on_message(), constants.ACK)
+        self.assertTrue(req.codec is codec.get_codec())
+
+    def test_reject_invalid_header_delimiters(self):
+        req = DummyRequestHandler(BaseRecordsDispatcher())
+        req.on_enq()
+        req._last_recv_data = codec.encode_message(1, [['H', '|^&']], 'ascii')
+        self.assertEqual(req.on_message(), constants.NAK)
+        self.assertTrue(req.codec is codec.get_codec())
+
+    def test_write_session_to_sink(self):
+        req = DummyRequestHandler(BaseRecordsDispatcher())
+        req.sink = BytesIO()
+        req.on_enq()
+        message = codec.encode_message(1, [['H', '\\^&']], 'ascii')
+        req._last_recv_data = message
+        self.assertEqual(req.on_message(), constants.ACK)
+        req._last_recv_data = b'garbage'
+        self.assertEqual(req.on_message(), constants.NAK)
+        self.assertEqual(b'', req.sink.getvalue())
+        req.on_eot()
+        self.assertEqual(constants.ENQ + message + constants.EOT,
+                         req.sink.getvalue())
+
     def test_cleanup_input_buffer_on_message_reject(self):
         self.req.handle_read()
         self.assertEqual(self.req.dummy_dispatcher_called_time, 1)
         self.assertEqual(self.req.outbox[-1], constants.NAK)
-        self.assertEqual(self.req._input_buffer, '')
+        self.assertEqual(self.req._input_buffer, b'')
 
     def test_close_on_timeout(self):
         self.req.close = track_call(self.req.close)
@@ -171,12 +235,302 @@ class RecordsDispatcherTestCase(unittest.TestCase):
         self.dispatcher(message)
         self.assertTrue(self.dispatcher.dispatch['H'].was_called)
 
+    def test_dispatch_lazy_records(self):
+        def handler(record):
+            assert isinstance(record, codec.LazyRecord)
+            assert record == ['R', '1']
+        message = codec.encode_message(1, [['R', '1']], 'ascii')
+        self.dispatcher.lazy = True
+        self.dispatcher.dispatch['R'] = track_call(handler)
+        self.dispatcher(message)
+        self.assertTrue(self.dispatcher.dispatch['R'].was_called)
+
+    def test_intern_cache(self):
+        class Dispatcher(BaseRecordsDispatcher):
+            intern_cache_size = 16
+        dispatcher = Dispatcher()
+        message = codec.encode_message(1, [['R', '1', 'GLU'],
+                                           ['R', '2', 'GLU']], 'ascii')
+        dispatcher(message)
+        self.assertEqual(2, dispatcher.intern_cache.hits)
+        self.assertTrue(self.dispatcher.intern_cache is None)
+
+    def test_projection(self):
+        class Dispatcher(BaseRecordsDispatcher):
+            projection = {'R': [3]}
+        dispatcher = Dispatcher()
+        def handler(record):
+            assert record == ['R', None, None, '5.4']
+        dispatcher.dispatch['R'] = track_call(handler)
+        dispatcher.dispatch['C'] = track_call(dispatcher.dispatch['C'])
+        message = codec.encode_message(1, [['C', '1', 'text'],
+                                           ['R', '1', 'GLU', '5.4']], 'ascii')
+        dispatcher(message)
+        self.assertTrue(dispatcher.dispatch['R'].was_called)
+        self.assertFalse(dispatcher.dispatch['C'].was_called)
+
     def test_provide_default_handler_for_unknown_message_type(self):
         message = codec.encode_message(1, ['FOO'], 'ascii')
         self.dispatcher(message)
         self.assertTrue(self.dispatcher.on_unknown.was_called)
 
 
+def tcp_socketpair():
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+    client = socket.create_connection(server.getsockname())
+    sock, addr = server.accept()
+    server.close()
+    return sock, client
+
+
+@unittest.skipIf(ThreadPoolExecutor is None, 'concurrent.futures is required')
+class OffloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        asynclib.close_all()
+        self.map = asynclib._SOCKET_MAP
+        self.executor = ThreadPoolExecutor(2)
+        self.release = threading.Event()
+        self.messages = []
+        sock, self.client = tcp_socketpair()
+        self.client.settimeout(5)
+        self.req = RequestHandler(sock, self.dispatcher,
+                                  executor=self.executor)
+
+    def tearDown(self):
+        self.release.set()
+        asynclib.close_all(self.map)
+        self.client.close()
+        self.executor.shutdown()
+
+    def dispatcher(self, message):
+        self.release.wait(5)
+        seq, records, cs = codec.decode_message(message, 'ascii')
+        if records[0][0] == 'R' and records[0][1] == 'bad':
+            raise ValueError(records)
+        self.messages.append(records[0][1])
+
+    def receive(self, size):
+        data = b''
+        start = time.time()
+        while len(data) < size and time.time() - start < 5:
+            asynclib.loop(0.01, self.map, count=1)
+            try:
+                self.client.settimeout(0)
+                data += self.client.recv(size - len(data))
+            except socket.error:
+                pass
+        return data
+
+    def test_ack_when_done(self):
+        self.client.sendall(constants.ENQ + codec.encode_message(
+            1, [['R', '1']], 'ascii'))
+        self.assertEqual(constants.ACK, self.receive(1))
+        asynclib.loop(0.01, self.map, count=5)
+        self.assertFalse(self.req.readable())
+        self.assertEqual([], self.messages)
+        self.release.set()
+        self.assertEqual(constants.ACK, self.receive(1))
+        self.assertEqual(['1'], self.messages)
+        self.assertTrue(self.req.readable())
+
+    def test_preserve_order(self):
+        self.release.set()
+        self.client.sendall(
+            constants.ENQ
+            + codec.encode_message(1, [['R', '1']], 'ascii')
+            + codec.encode_message(2, [['R', 'bad']], 'ascii')
+            + codec.encode_message(3, [['R', '3']], 'ascii'))
+        self.assertEqual(constants.ACK + constants.ACK + constants.NAK
+                         + constants.ACK, self.receive(4))
+        self.assertEqual(['1', '3'], self.messages)
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.data = self.flushed = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        self.flushed = self.data
+
+    def close(self):
+        self.closed = True
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        asynclib.close_all()
+        self.sink = Sink()
+        self.server = Server(port=0, sink=self.sink)
+        self.addCleanup(asynclib.close_all)
+
+    def connect(self):
+        sock = socket.create_connection(self.server.socket.getsockname(), 5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def loop_until(self, predicate):
+        start = time.time()
+        while not predicate() and time.time() - start < 5:
+            asynclib.loop(0.01, count=1)
+
+    def test_flush_sink_per_session(self):
+        sock = self.connect()
+        message = codec.encode_message(1, [['H', '\\^&']], 'ascii')
+        sock.sendall(constants.ENQ + message + constants.EOT)
+        self.loop_until(lambda: self.sink.flushed)
+        self.assertEqual(constants.ENQ + message + constants.EOT,
+                         self.sink.flushed)
+
+    def test_shutdown(self):
+        sock = self.connect()
+        sock.sendall(constants.ENQ)
+        self.loop_until(lambda: select.select([sock], [], [], 0)[0])
+        self.assertEqual(constants.ACK, sock.recv(1))
+        self.server.shutdown()
+        self.assertTrue(self.sink.closed)
+        asynclib.loop(0.01)
+        self.assertEqual({}, asynclib._SOCKET_MAP)
+        self.assertEqual(b'', sock.recv(1))
+
+    def test_step_loop(self):
+        self.server.serve_forever(0.01, count=1)
+        self.assertFalse(self.sink.closed)
+        self.assertTrue(self.server.accepting)
+
+    def test_shutdown_own_connections_only(self):
+        other = Server(port=0)
+        sock = socket.create_connection(other.socket.getsockname(), 5)
+        self.addCleanup(sock.close)
+        self.connect()
+        self.loop_until(lambda: len(asynclib._SOCKET_MAP) > 4)
+        self.server.shutdown()
+        self.assertTrue(other.accepting)
+        sock.sendall(constants.ENQ)
+        self.loop_until(lambda: select.select([sock], [], [], 0)[0])
+        self.assertEqual(constants.ACK, sock.recv(1))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@unittest.skipIf(not hasattr(os, 'fork')
+                 or not hasattr(socket, 'SO_REUSEPORT'),
+                 'fork and SO_REUSEPORT are required')
+class PreforkServerTestCase(unittest.TestCase):
+
+    def test_share_port(self):
+        asynclib.close_all()
+        self.addCleanup(asynclib.close_all)
+        port = free_port()
+        servers = [Server(port=port, reuse_port=True, backlog=16)
+                   for _ in range(2)]
+        self.assertEqual([port, port], [server.socket.getsockname()[1]
+                                        for server in servers])
+        sock = socket.create_connection(('localhost', port), 5)
+        self.addCleanup(sock.close)
+        sock.sendall(constants.ENQ)
+        start = time.time()
+        while (not select.select([sock], [], [], 0)[0]
+               and time.time() - start < 5):
+            asynclib.loop(0.01, count=1)
+        self.assertEqual(constants.ACK, sock.recv(1))
+
+    def test_reject_shared_sink(self):
+        self.assertRaises(ValueError, PreforkServer, sink=BytesIO())
+        self.assertRaises(ValueError, PreforkServer, executor=object())
+
+    def test_restart_died_workers(self):
+        class DummyServer(object):
+            def serve_forever(self):
+                pass
+            def shutdown(self):
+                pass
+        class Supervisor(PreforkServer):
+            restart_delay = 0
+            spawned = []
+            def make_server(self, worker):
+                return DummyServer()
+            def _spawn(self, worker, args, kwargs):
+                self.spawned.append(worker)
+                if len(self.spawned) == 4:
+                    self.stop()
+                    return
+                return super(Supervisor, self)._spawn(worker, args, kwargs)
+        supervisor = Supervisor(workers=2)
+        supervisor.serve_forever()
+        self.assertEqual([0, 1], sorted(supervisor.spawned[:2]))
+        self.assertEqual(4, len(supervisor.spawned))
+        self.assertEqual({}, supervisor.pids)
+
+    def test_serve(self):
+        port = free_port()
+        pid = os.fork()
+        if not pid:
+            try:
+                PreforkServer(workers=2, port=port).serve_forever(0.1)
+            finally:
+                os._exit(0)
+        try:
+            for _ in range(50):
+                try:
+                    sock = socket.create_connection(('localhost', port), 1)
+                    break
+                except socket.error:
+                    time.sleep(0.1)
+            sock.sendall(constants.ENQ)
+            self.assertEqual(constants.ACK, sock.recv(1))
+            sock.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            self.assertEqual(pid, os.waitpid(pid, 0)[0])
+
+    def test_graceful_stop(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        class MarkerSink(Sink):
+            def __init__(self, path):
+                super(MarkerSink, self).__init__()
+                self.path = path
+            def close(self):
+                open(self.path, 'w').close()
+        class Supervisor(PreforkServer):
+            def make_server(self, worker):
+                server = super(Supervisor, self).make_server(worker)
+                path = os.path.join(tmpdir, str(worker))
+                server.sink = MarkerSink(path + '.closed')
+                open(path + '.started', 'w').close()
+                return server
+        pid = os.fork()
+        if not pid:
+            try:
+                Supervisor(workers=2, port=free_port()).serve_forever(0.1)
+            finally:
+                os._exit(0)
+        try:
+            for _ in range(50):
+                if len(os.listdir(tmpdir)) == 2:
+                    break
+                time.sleep(0.1)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            self.assertEqual(pid, os.waitpid(pid, 0)[0])
+        self.assertEqual(['0.closed', '0.started', '1.closed', '1.started'],
+                         sorted(os.listdir(tmpdir)))
+
 
 if __name__ == '__main__':
     unittest.main()
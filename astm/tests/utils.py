@@ -7,6 +7,9 @@
 # you should have received as part of this distribution.
 #
 
+from astm import codec
+from astm.constants import ENQ, EOT
+
 
 class DummyMixIn(object):
     _input_buffer = ''
@@ -32,3 +35,12 @@ class CallLogger(object):
 
 def track_call(func):
     return CallLogger(func)
+
+
+def make_session(*records, **kwargs):
+    """Builds stored ASTM session of `records` wrapped by Header and
+    Terminator ones. Custom Header record may be passed as `header`."""
+    header = kwargs.get('header', ['H', [[None], [None, '&']]])
+    messages = codec.encode([header] + list(records) + [['L', '1', 'N']],
+                            'ascii')
+    return ENQ + b''.join(messages) + EOT